@@ -0,0 +1,45 @@
+"""
+A/B testing analysis library. Importing it does no data loading or heavy work,
+scipy and statsmodels are only imported when a function that needs them runs.
+"""
+from .hypothesis import two_proportion_ztest
+from .summary import count_users_by_variant, summarize_experiments
+from .streaming import SessionAggregator, aggregate_sessions_csv
+from .session_store import SessionStore
+from .power import (
+    cohens_h,
+    rate_from_cohens_h,
+    power_from_effect_size,
+    sample_size_from_effect_size,
+    effect_size_from_sample_size,
+    planning_grid,
+    calculate_statistical_power_from_results,
+    calculate_sample_users_from_results,
+    calculate_minimum_detectable_effect_from_results,
+    analyze_power_from_results,
+    calculate_power,
+    calculate_sample_size,
+    calculate_minimum_detectable_effect,
+)
+
+__all__ = [
+    'two_proportion_ztest',
+    'count_users_by_variant',
+    'summarize_experiments',
+    'SessionAggregator',
+    'aggregate_sessions_csv',
+    'SessionStore',
+    'cohens_h',
+    'rate_from_cohens_h',
+    'power_from_effect_size',
+    'sample_size_from_effect_size',
+    'effect_size_from_sample_size',
+    'planning_grid',
+    'calculate_statistical_power_from_results',
+    'calculate_sample_users_from_results',
+    'calculate_minimum_detectable_effect_from_results',
+    'analyze_power_from_results',
+    'calculate_power',
+    'calculate_sample_size',
+    'calculate_minimum_detectable_effect',
+]
@@ -0,0 +1,194 @@
+"""
+Bayesian analysis of conversion experiments: Beta-Binomial posteriors from the n/x counts, P(treatment > control),
+the expected loss of each decision and a credible interval for the relative lift. Every function takes arrays (one
+entry per experiment, or per experiment and period) and works on all of them at once.
+
+Two ways to get the probabilities:
+- 'quadrature' (default): one-dimensional Gauss-Legendre integration over the control posterior, using the
+  regularized incomplete beta function for the treatment side. Deterministic and accurate to about 1e-6.
+- 'monte_carlo': batched Beta draws, processed in blocks of experiments to bound memory.
+"""
+import numpy as np
+import pandas as pd
+
+QUADRATURE_NODES = 64
+#The integration range covers the control posterior between these quantiles
+TAIL_PROBABILITY = 1e-12
+RATIO_NEWTON_STEPS = 12
+RATIO_TOLERANCE = 1e-10
+DEFAULT_DRAWS = 20000
+MAX_BLOCK_ELEMENTS = 1 << 22
+
+
+def beta_posteriors(n, x, prior_alpha=1.0, prior_beta=1.0):
+    """
+    Beta posterior parameters for x conversions out of n users under a Beta(prior_alpha, prior_beta) prior
+    """
+    n = np.asarray(n, dtype=float)
+    x = np.asarray(x, dtype=float)
+    return prior_alpha + x, prior_beta + n - x
+
+
+def _quadrature(control_alpha, control_beta, treatment_alpha, treatment_beta, credible_level):
+    from scipy.special import betainc, betaincinv, betaln, ndtri
+
+    nodes, weights = np.polynomial.legendre.leggauss(QUADRATURE_NODES)
+    lower = betaincinv(control_alpha, control_beta, TAIL_PROBABILITY)[:, None]
+    upper = betaincinv(control_alpha, control_beta, 1 - TAIL_PROBABILITY)[:, None]
+    #Nodes and weights mapped onto each experiment's [lower, upper], weighted by the control posterior density there
+    c = lower + (upper - lower) * (nodes + 1) / 2
+    log_density = (control_alpha[:, None] - 1) * np.log(c) + (control_beta[:, None] - 1) * np.log1p(-c) - betaln(control_alpha, control_beta)[:, None]
+    w = weights * (upper - lower) / 2 * np.exp(log_density)
+
+    a_t = treatment_alpha[:, None]
+    b_t = treatment_beta[:, None]
+    treatment_mean = treatment_alpha / (treatment_alpha + treatment_beta)
+    control_mean = control_alpha / (control_alpha + control_beta)
+    treatment_cdf = betainc(a_t, b_t, c)
+    prob_treatment_better = 1 - (w * treatment_cdf).sum(axis=1)
+    #E[max(C - T, 0) | C = c] = c * P(T < c) - E[T; T < c], and E[T; T < c] = E[T] * I_c(a_t + 1, b_t)
+    loss_treatment = (w * (c * treatment_cdf - treatment_mean[:, None] * betainc(a_t + 1, b_t, c))).sum(axis=1)
+    loss_control = treatment_mean - control_mean + loss_treatment
+
+    #Quantiles of T / C: safeguarded Newton steps on log(r) for P(T <= r * C) = target, started from a log-normal
+    #approximation and falling back to bisection whenever a step leaves the bracket, for all experiments at once
+    log_normalizer_t = betaln(treatment_alpha, treatment_beta)[:, None]
+    log_spread = np.sqrt(treatment_beta / (treatment_alpha * (treatment_alpha + treatment_beta + 1))
+                         + control_beta / (control_alpha * (control_alpha + control_beta + 1)))
+    log_center = np.log(treatment_mean) - np.log(control_mean)
+    tail = (1 - credible_level) / 2
+    bounds = []
+    for target in (tail, 1 - tail):
+        low = np.full(len(control_alpha), np.log(1e-9))
+        high = -np.log(np.maximum(lower[:, 0], 1e-12))
+        guess = np.clip(log_center + ndtri(target) * log_spread, low, high)
+        for _ in range(RATIO_NEWTON_STEPS):
+            ratio = np.exp(guess)
+            t = np.minimum(ratio[:, None] * c, 1 - 1e-15)
+            error = (w * betainc(a_t, b_t, t)).sum(axis=1) - target
+            if np.all(np.abs(error) < RATIO_TOLERANCE):
+                break
+            low = np.where(error < 0, guess, low)
+            high = np.where(error < 0, high, guess)
+            #d/d(log r) P(T <= r * C) = sum over nodes of density * r * c * f_T(r * c)
+            slope = (w * t * np.exp((a_t - 1) * np.log(t) + (b_t - 1) * np.log1p(-t) - log_normalizer_t)).sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                step = guess - error / slope
+            inside = np.isfinite(step) & (step >= low) & (step <= high)
+            guess = np.where(inside, step, (low + high) / 2)
+        bounds.append(np.exp(guess) - 1)
+    return np.clip(prob_treatment_better, 0.0, 1.0), np.maximum(loss_treatment, 0.0), np.maximum(loss_control, 0.0), bounds[0], bounds[1]
+
+
+def _monte_carlo(control_alpha, control_beta, treatment_alpha, treatment_beta, credible_level, draws, seed):
+    rng = np.random.default_rng(seed)
+    size = len(control_alpha)
+    prob_treatment_better, loss_treatment, loss_control, lift_lower, lift_upper = (np.empty(size) for _ in range(5))
+    tail = (1 - credible_level) / 2
+    block = max(1, MAX_BLOCK_ELEMENTS // draws)
+    for start in range(0, size, block):
+        rows = slice(start, min(start + block, size))
+        shape = (rows.stop - rows.start, draws)
+        control = rng.beta(control_alpha[rows, None], control_beta[rows, None], size=shape)
+        treatment = rng.beta(treatment_alpha[rows, None], treatment_beta[rows, None], size=shape)
+        difference = treatment - control
+        prob_treatment_better[rows] = (difference > 0).mean(axis=1)
+        loss_treatment[rows] = np.maximum(-difference, 0).mean(axis=1)
+        loss_control[rows] = np.maximum(difference, 0).mean(axis=1)
+        lift_lower[rows], lift_upper[rows] = np.quantile(treatment / control - 1, [tail, 1 - tail], axis=1)
+    return prob_treatment_better, loss_treatment, loss_control, lift_lower, lift_upper
+
+
+def bayesian_ab_test(control_n, control_x, treatment_n, treatment_x, prior_alpha=1.0, prior_beta=1.0, credible_level=0.95,
+                     method='quadrature', draws=DEFAULT_DRAWS, seed=0):
+    """
+    Beta-Binomial comparison of treatment against control. Every count can be a scalar or an array.
+
+    Returns a dict with the posterior means, prob_treatment_better, expected_loss_treatment (conversion rate given up
+    on average by shipping treatment if control is really better), expected_loss_control (the same for keeping
+    control), and the posterior mean and credible interval of the relative lift in percent.
+    Values are floats for scalar inputs and NumPy arrays for array inputs
+    """
+    scalar = all(np.ndim(value) == 0 for value in (control_n, control_x, treatment_n, treatment_x))
+    control_alpha, control_beta = (np.atleast_1d(value) for value in beta_posteriors(control_n, control_x, prior_alpha, prior_beta))
+    treatment_alpha, treatment_beta = (np.atleast_1d(value) for value in beta_posteriors(treatment_n, treatment_x, prior_alpha, prior_beta))
+    control_alpha, control_beta, treatment_alpha, treatment_beta = np.broadcast_arrays(control_alpha, control_beta, treatment_alpha, treatment_beta)
+
+    if method == 'quadrature':
+        results = _quadrature(control_alpha, control_beta, treatment_alpha, treatment_beta, credible_level)
+    elif method == 'monte_carlo':
+        results = _monte_carlo(control_alpha, control_beta, treatment_alpha, treatment_beta, credible_level, draws, seed)
+    else:
+        raise ValueError("method must be 'quadrature' or 'monte_carlo'.")
+    prob_treatment_better, loss_treatment, loss_control, lift_lower, lift_upper = results
+
+    control_mean = control_alpha / (control_alpha + control_beta)
+    treatment_mean = treatment_alpha / (treatment_alpha + treatment_beta)
+    #E[T / C] = E[T] * E[1 / C], and E[1 / C] = (a + b - 1) / (a - 1) for a Beta(a, b) with a > 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lift_mean = np.where(control_alpha > 1, treatment_mean * (control_alpha + control_beta - 1) / (control_alpha - 1) - 1, np.inf)
+
+    output = {
+        'control_posterior_mean': control_mean,
+        'treatment_posterior_mean': treatment_mean,
+        'prob_treatment_better': prob_treatment_better,
+        'expected_loss_treatment': loss_treatment,
+        'expected_loss_control': loss_control,
+        'lift_mean_percent': lift_mean * 100,
+        'lift_lower_percent': lift_lower * 100,
+        'lift_upper_percent': lift_upper * 100,
+    }
+    if scalar:
+        return {key: value.item() for key, value in output.items()}
+    return output
+
+
+def bayesian_summary(counts_df, experiments, **kwargs):
+    """
+    One row per experiment (in the order of experiments, id -> name) from an n/x counts frame such as
+    count_users_by_variant's. kwargs go to bayesian_ab_test
+    """
+    counts = counts_df.unstack('variant').reindex(list(experiments.keys()))
+    control_n = counts[('n', 'control')].to_numpy()
+    control_x = counts[('x', 'control')].to_numpy()
+    treatment_n = counts[('n', 'treatment')].to_numpy()
+    treatment_x = counts[('x', 'treatment')].to_numpy()
+    results = bayesian_ab_test(control_n, control_x, treatment_n, treatment_x, **kwargs)
+    return pd.DataFrame({
+        'experiment_id': list(experiments.keys()),
+        'experiment_name': list(experiments.values()),
+        'control_size': control_n.astype(int),
+        'treatment_size': treatment_n.astype(int),
+        **results,
+    })
+
+
+def bayesian_by_period(rollups_df, **kwargs):
+    """
+    bayesian_ab_test for every period of a conversion rollup frame (time_period, variant, users, converting_users,
+    and experiment_id if it covers several experiments), in one pass. Periods missing either variant are left out
+    """
+    keys = [column for column in ('experiment_id', 'time_period') if column in rollups_df.columns]
+    wide = rollups_df.pivot_table(index=keys, columns='variant', values=['users', 'converting_users'], aggfunc='sum').dropna()
+    results = bayesian_ab_test(
+        wide[('users', 'control')].to_numpy(),
+        wide[('converting_users', 'control')].to_numpy(),
+        wide[('users', 'treatment')].to_numpy(),
+        wide[('converting_users', 'treatment')].to_numpy(),
+        **kwargs,
+    )
+    return pd.DataFrame({key: np.atleast_1d(value) for key, value in results.items()}, index=wide.index).reset_index()
+
+
+def bayesian_from_rollups(conn, grain='weekly', **kwargs):
+    """
+    Per-period Bayesian results for every experiment, straight from the conversion_rollups table for one grain
+    """
+    from .rollups import ROLLUP_TABLE
+
+    rollups_df = pd.read_sql_query(
+        f"SELECT experiment_id, time_period, variant, users, converting_users FROM {ROLLUP_TABLE} WHERE grain = ?",
+        conn,
+        params=(grain,),
+    )
+    return bayesian_by_period(rollups_df, **kwargs)
@@ -0,0 +1,160 @@
+"""
+Stale-while-revalidate cache for the dashboard's query results. Entries are keyed by (query name, params) and remember
+the data version and time they were computed at. A lookup with the same data version inside the TTL is a fresh hit;
+an expired entry or one from an older data version is served as-is while a background thread recomputes it, so
+only a key nobody has asked for before has to wait for its query. Size is bounded with LRU eviction.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from . import instrumentation
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_WORKERS = 2
+
+
+class StaleWhileRevalidateCache:
+    """
+    loader(query_name, params) computes a value. get() returns cached values, refreshing them in the background once
+    they're stale; prewarm() computes a list of keys in the background, for instance every experiment's views after a load
+    """
+
+    def __init__(self, loader, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES, workers: int = DEFAULT_WORKERS):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cache-refresh")
+        self._stats = {"fresh_hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+        self._watcher = None
+        self._stop = threading.Event()
+        self.prewarmed_version = None
+
+    def _count(self, stat):
+        self._stats[stat] += 1
+        instrumentation.count(f"dashboard_cache_{stat}")
+
+    def _store(self, key, value, version):
+        self._entries[key] = (value, version, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _refresh(self, key, version, background=True):
+        """
+        Computes key and stores it, in the background or in the calling thread, unless another thread is already
+        computing it. Returns a future for the value either way
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._in_flight[key] = Future()
+        if background:
+            try:
+                self._executor.submit(self._compute, key, version, future)
+            except RuntimeError:
+                #Closed: nothing will ever compute it
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                future.cancel()
+        else:
+            self._compute(key, version, future)
+        return future
+
+    def _compute(self, key, version, future):
+        #close() may have cancelled it while it was queued
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with instrumentation.timer("cache_refresh"):
+                value = self.loader(*key)
+        except Exception as error:
+            with self._lock:
+                self._stats["refresh_errors"] += 1
+                self._in_flight.pop(key, None)
+            future.set_exception(error)
+            return
+        with self._lock:
+            current = self._entries.get(key)
+            #A slower refresh for an older version mustn't overwrite a newer one
+            if current is None or current[1] is None or version is None or current[1] <= version:
+                self._store(key, value, version)
+            self._stats["refreshes"] += 1
+            self._in_flight.pop(key, None)
+        future.set_result(value)
+
+    def get(self, query_name: str, params: tuple, data_version):
+        key = (query_name, tuple(params))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                value, version, computed_at = entry
+                if version == data_version and time.monotonic() - computed_at < self.ttl:
+                    self._count("fresh_hits")
+                    return value
+                self._count("stale_hits")
+            else:
+                self._count("misses")
+        if entry is not None:
+            self._refresh(key, data_version)
+            return entry[0]
+        #Nothing to serve yet: compute it here, or wait for whoever already is
+        return self._refresh(key, data_version, background=False).result()
+
+    def prewarm(self, keys, data_version):
+        """
+        Refreshes every (query_name, params) key in the background, once per data version. Returns the futures
+        """
+        with self._lock:
+            if self.prewarmed_version == data_version:
+                return []
+            self.prewarmed_version = data_version
+        return [self._refresh((query_name, tuple(params)), data_version) for query_name, params in keys]
+
+    def watch(self, version_fn, keys_fn, interval: float = 30.0):
+        """
+        Starts a daemon thread that checks version_fn() every interval seconds and prewarms keys_fn() (plus every key
+        already cached) when it changes, so results are recomputed right after a load rather than on the next visit
+        """
+        if self._watcher is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    version = version_fn()
+                    if version != self.prewarmed_version:
+                        with self._lock:
+                            cached_keys = list(self._entries)
+                        self.prewarm(list(dict.fromkeys([*cached_keys, *((name, tuple(params)) for name, params in keys_fn())])), version)
+                except Exception:
+                    #A failed poll (say, the database is being replaced) is retried on the next tick
+                    with self._lock:
+                        self._stats["refresh_errors"] += 1
+
+        self._watcher = threading.Thread(target=run, name="cache-watcher", daemon=True)
+        self._watcher.start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "in_flight": len(self._in_flight)}
+
+    def close(self):
+        """
+        Stops the watcher and the refreshes. Queued refreshes are cancelled, so anyone waiting on one gets
+        CancelledError instead of waiting forever; one already running still finishes
+        """
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            pending = list(self._in_flight.values())
+            self._in_flight.clear()
+        for future in pending:
+            future.cancel()
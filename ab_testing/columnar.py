@@ -0,0 +1,338 @@
+"""
+Columnar storage mode: the CSVs written out as Arrow datasets (Parquet by default, or uncompressed Arrow IPC),
+partitioned by experiment_id and month, plus readers for the analysis and the dashboard that only touch the
+columns and partitions they need. Needs pyarrow, which the rest of the package doesn't.
+"""
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.fs as pa_fs
+
+from .forecast import FORECAST_COLUMNS, RESULT_COLUMNS as FORECAST_RESULT_COLUMNS, accumulate, daily_arrivals
+from .quality import QUALITY_COLUMNS, DataQualityAccumulator, assignment_counts, first_assignments, session_counts
+from .rollups import GRAINS
+from .segments import build_segment_cube, SEGMENT_DIMENSIONS
+from .streaming import SessionAggregator
+
+PARQUET_DIR = Path("data/parquet")
+DEFAULT_FORMAT = "parquet"
+#Written next to the datasets on every write, so readers can tell the data changed without walking the tree
+VERSION_FILE = "_version"
+#Well under the usual per-process file descriptor limit
+MAX_OPEN_FILES = 512
+
+#Tables with a date get split into experiment_id=/month= directories, the rest are written as a single file
+PARTITION_DATE_COLUMNS = {
+    "user_sessions": "session_date",
+    "experiment_assignments": "assignment_date",
+    "daily_metrics": "date",
+}
+PARTITION_SCHEMA = pa.schema([("experiment_id", pa.int32()), ("month", pa.string())])
+
+SQL_TO_ARROW = {
+    "INTEGER": pa.int64(),
+    "REAL": pa.float64(),
+    "BOOLEAN": pa.bool_(),
+    "DATE": pa.date32(),
+    "TEXT": pa.string(),
+}
+#ids are small enough for int32, which halves what the aggregation has to scan
+NARROW_COLUMNS = {"experiment_id": pa.int32(), "user_id": pa.int32()}
+
+
+def _arrow_type(column, column_type):
+    return NARROW_COLUMNS.get(column, SQL_TO_ARROW.get(column_type, pa.string()))
+
+
+def _open_csv(csv_path, column_types, include_columns, block_size):
+    return pa_csv.open_csv(
+        csv_path,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={column: _arrow_type(column, column_types.get(column, "")) for column in include_columns},
+            include_columns=include_columns,
+            true_values=["True", "true", "1"],
+            false_values=["False", "false", "0"],
+        ),
+    )
+
+
+def _partition_counts(csv_path, date_column, column_types, block_size):
+    """
+    experiment_id -> number of month partitions it spans, from a pass over just those two columns
+    """
+    months = set()
+    for batch in _open_csv(csv_path, column_types, ["experiment_id", date_column], block_size):
+        keys = pa.table({
+            "experiment_id": batch.column("experiment_id"),
+            "month": pc.strftime(batch.column(date_column), format="%Y-%m"),
+        }).group_by(["experiment_id", "month"]).aggregate([])
+        months.update(zip(keys.column("experiment_id").to_pylist(), keys.column("month").to_pylist()))
+    counts = {}
+    for experiment_id, _ in months:
+        counts[experiment_id] = counts.get(experiment_id, 0) + 1
+    return counts
+
+
+def _experiment_groups(partition_counts):
+    """
+    Splits the experiments into groups spanning at most MAX_OPEN_FILES partitions each, so every group can be written
+    with one file open per partition
+    """
+    groups, group, group_partitions = [], [], 0
+    for experiment_id, partitions in sorted(partition_counts.items(), key=lambda item: (item[0] is None, item[0] or 0)):
+        if group and group_partitions + partitions > MAX_OPEN_FILES:
+            groups.append((group, group_partitions))
+            group, group_partitions = [], 0
+        group.append(experiment_id)
+        group_partitions += partitions
+    groups.append((group, group_partitions))
+    return groups
+
+
+def write_table_dataset(csv_path, out_dir, column_types=None, file_format=DEFAULT_FORMAT, block_size=64 << 20):
+    """
+    Streams one CSV into an Arrow dataset at out_dir (replacing whatever was there) and bumps the version marker
+    next to it. column_types maps column name -> SQL type, the same shape as load_csv_files.TABLE_SCHEMAS
+    """
+    csv_path = Path(csv_path)
+    out_dir = Path(out_dir)
+    column_types = column_types or {}
+    table_name = csv_path.stem.lower()
+
+    with open(csv_path, encoding="utf-8") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+    named_columns = [column for column in header if column.strip()]
+
+    if out_dir.exists():
+        shutil.rmtree(out_dir)
+    date_column = PARTITION_DATE_COLUMNS.get(table_name)
+    if date_column is None:
+        ds.write_dataset(
+            _open_csv(csv_path, column_types, named_columns, block_size),
+            out_dir,
+            format=file_format,
+            existing_data_behavior="overwrite_or_ignore",
+        )
+    else:
+        #pyarrow refuses a batch that spans more than max_partitions (1024 by default) and closes files past
+        #max_open_files, so both are set from the experiment x month count. A catalog too big to keep every partition
+        #open is written a group of experiments per pass over the CSV
+        groups = _experiment_groups(_partition_counts(csv_path, date_column, column_types, block_size))
+        partitioning = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+        for number, (experiment_ids, partitions) in enumerate(groups):
+            reader = _open_csv(csv_path, column_types, named_columns, block_size)
+            schema = reader.schema.append(pa.field("month", pa.string()))
+            value_set = pa.array(experiment_ids, pa.int32()) if len(groups) > 1 else None
+
+            def batches(reader=reader, schema=schema, value_set=value_set):
+                for batch in reader:
+                    if value_set is not None:
+                        batch = batch.filter(pc.is_in(batch.column("experiment_id"), value_set=value_set))
+                    month = pc.strftime(batch.column(date_column), format="%Y-%m")
+                    yield pa.RecordBatch.from_arrays([*batch.columns, month], schema=schema)
+
+            ds.write_dataset(
+                pa.RecordBatchReader.from_batches(schema, batches()),
+                out_dir,
+                format=file_format,
+                partitioning=partitioning,
+                basename_template=f"part-{number}-{{i}}.{file_format}",
+                max_partitions=max(partitions, 1),
+                max_open_files=max(partitions, 1),
+                existing_data_behavior="overwrite_or_ignore",
+            )
+    (out_dir.parent / VERSION_FILE).write_text(str(time.time_ns()))
+
+
+def open_dataset(table_name, parquet_dir=PARQUET_DIR, file_format=DEFAULT_FORMAT):
+    """
+    The table's dataset, read through memory-mapped files. Partition columns (experiment_id, month) behave like
+    normal columns, and filters on them skip whole directories
+    """
+    path = (Path(parquet_dir) / table_name).resolve()
+    partitioning = ds.partitioning(PARTITION_SCHEMA, flavor="hive") if table_name in PARTITION_DATE_COLUMNS else None
+    return ds.dataset(str(path), format=file_format, partitioning=partitioning, filesystem=pa_fs.LocalFileSystem(use_mmap=True))
+
+
+def dataset_version(parquet_dir=PARQUET_DIR):
+    """
+    Changes whenever write_table_dataset rewrites a dataset under parquet_dir, for use as a cache key. One small file
+    read, so it is cheap enough for every dashboard rerun
+    """
+    try:
+        return int((Path(parquet_dir) / VERSION_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _sessions_filter(experiment_ids=None, start_date=None, end_date=None):
+    conditions = []
+    if experiment_ids is not None:
+        conditions.append(ds.field("experiment_id").isin(list(experiment_ids)))
+    if start_date is not None:
+        conditions.append(ds.field("session_date") >= pa.scalar(pd.Timestamp(start_date).date(), pa.date32()))
+    if end_date is not None:
+        conditions.append(ds.field("session_date") <= pa.scalar(pd.Timestamp(end_date).date(), pa.date32()))
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def count_users_arrow(dataset, experiment_ids=None, start_date=None, end_date=None):
+    """
+    count_users_by_variant straight off a user_sessions dataset. Only the four needed columns are read, the filters
+    are pushed down to the partitions/row groups, and the numeric buffers go to the aggregator without a pandas copy
+    """
+    aggregator = SessionAggregator()
+    scanner = dataset.scanner(
+        columns=["experiment_id", "variant", "user_id", "converted"],
+        filter=_sessions_filter(experiment_ids, start_date, end_date),
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows == 0:
+            continue
+        variants = pc.dictionary_encode(batch.column("variant"))
+        aggregator.update_arrays(
+            batch.column("experiment_id").to_numpy(zero_copy_only=True),
+            variants.indices.to_numpy(zero_copy_only=True),
+            variants.dictionary.to_pylist(),
+            batch.column("user_id").to_numpy(zero_copy_only=True),
+            #Arrow packs booleans into bits, so this one column has to be unpacked
+            batch.column("converted").to_numpy(zero_copy_only=False),
+        )
+    return aggregator.counts()
+
+
+def _period_keys(dates, grain):
+    if grain == "daily":
+        return dates.dt.strftime("%Y-%m-%d")
+    if grain == "monthly":
+        return dates.dt.strftime("%Y-%m")
+    #SQLite's date(d, 'weekday 1', '-7 days'): the next Monday on or after d, minus a week
+    days_to_monday = (7 - dates.dt.weekday) % 7
+    return (dates + pd.to_timedelta(days_to_monday - 7, unit="D")).dt.strftime("%Y-%m-%d")
+
+
+def conversion_rates_over_time(parquet_dir, grain, experiment_id):
+    """
+    Same columns and rows as queries/conversion_rates_over_time.txt, computed from the user_sessions dataset
+    """
+    if grain not in GRAINS:
+        raise ValueError(f"grain must be one of {sorted(GRAINS)}")
+    table = open_dataset("user_sessions", parquet_dir).to_table(
+        columns=["variant", "user_id", "session_date", "converted"],
+        filter=ds.field("experiment_id") == experiment_id,
+    )
+    sessions = table.to_pandas()
+    sessions["time_period"] = _period_keys(pd.to_datetime(sessions["session_date"]), grain)
+    user_periods = sessions.groupby(["time_period", "variant", "user_id"], sort=False)["converted"].max()
+    result = user_periods.groupby(level=["time_period", "variant"]).agg(users="size", converting_users="sum").reset_index()
+    result["converting_users"] = result["converting_users"].astype(np.int64)
+    result["conversion_rate"] = result["converting_users"] / result["users"]
+    return result.sort_values(["time_period", "variant"], ignore_index=True)
+
+
+def experiments_list(parquet_dir):
+    """
+    Same as queries/experiments.txt, from the experiments dataset
+    """
+    return open_dataset("experiments", parquet_dir).to_table(columns=["experiment_id", "experiment_name"]).to_pandas().sort_values(
+        "experiment_id", ignore_index=True
+    )
+
+
+def experiment_results_summary(parquet_dir, experiment_id):
+    """
+    The columnar stand-in for queries/experiments_results_summary.txt. There is no results store in this mode, so it
+    reads the results_summary dataset exported from results_summary.csv, matched to the experiment by name
+    """
+    experiments = open_dataset("experiments", parquet_dir).to_table(
+        columns=["experiment_id", "experiment_name"], filter=ds.field("experiment_id") == experiment_id
+    ).to_pandas()
+    return open_dataset("results_summary", parquet_dir).to_table(
+        filter=ds.field("experiment_name").isin(experiments["experiment_name"].tolist())
+    ).to_pandas()
+
+
+def segment_cube(parquet_dir, experiment_id):
+    """
+    Same as queries/segment_cube.txt, built for one experiment from the assignments, sessions and users datasets
+    """
+    experiment_filter = ds.field("experiment_id") == experiment_id
+    assignments = open_dataset("experiment_assignments", parquet_dir).to_table(
+        columns=["experiment_id", "variant", "user_id"], filter=experiment_filter
+    ).to_pandas()
+    sessions = open_dataset("user_sessions", parquet_dir).to_table(
+        columns=["experiment_id", "user_id", "converted"], filter=experiment_filter
+    ).to_pandas()
+    users = open_dataset("users", parquet_dir).to_table(
+        columns=["user_id", *SEGMENT_DIMENSIONS], filter=ds.field("user_id").isin(assignments["user_id"].unique())
+    ).to_pandas()
+    cube = build_segment_cube(assignments, sessions, users)
+    return cube.sort_values(["dimension", "segment_value", "variant"], ignore_index=True)
+
+
+def data_quality_checks(parquet_dir, experiment_id):
+    """
+    Same as queries/data_quality_checks.txt. Nothing stores the checks in this mode, so the counts are computed for one
+    experiment from its partitions of the assignments, sessions and daily_metrics datasets, the sessions a batch at a time
+    """
+    experiment_filter = ds.field("experiment_id") == experiment_id
+    quality = DataQualityAccumulator()
+    assignments = first_assignments(open_dataset("experiment_assignments", parquet_dir).to_table(
+        columns=QUALITY_COLUMNS["experiment_assignments"], filter=experiment_filter
+    ).to_pandas())
+    quality.add_counts("assignments", assignment_counts(assignments))
+    for batch in open_dataset("user_sessions", parquet_dir).to_batches(columns=QUALITY_COLUMNS["user_sessions"], filter=experiment_filter):
+        quality.add_counts("sessions", session_counts(batch.to_pandas(), assignments))
+    reported = open_dataset("daily_metrics", parquet_dir).to_table(
+        columns=QUALITY_COLUMNS["daily_metrics"], filter=experiment_filter
+    ).to_pandas()
+    quality.add_counts("daily", reported.rename(columns={"date": "day", "total_users": "reported_users", "total_conversions": "reported_conversions"}))
+    observed = conversion_rates_over_time(parquet_dir, "daily", experiment_id)
+    quality.add_counts("daily", observed.assign(experiment_id=experiment_id).rename(
+        columns={"time_period": "day", "users": "observed_users", "converting_users": "observed_conversions"}
+    ))
+    checks = quality.results()
+    return checks.loc[checks["experiment_id"] == experiment_id, ["check_name", "status", "value", "detail"]].reset_index(drop=True)
+
+
+def traffic_forecast(parquet_dir, experiment_id):
+    """
+    Same as queries/traffic_forecast.txt, fitted from the experiment's user_sessions partitions on the fly. The users so
+    far and the control rate come from the results_summary dataset, this mode's stand-in for experiment_results
+    """
+    sessions = open_dataset("user_sessions", parquet_dir).to_table(
+        columns=["experiment_id", "variant", "user_id", "session_date"],
+        filter=ds.field("experiment_id") == experiment_id,
+    ).to_pandas()
+    empty_state = pd.DataFrame(columns=["experiment_id", *FORECAST_COLUMNS])
+    if len(sessions) == 0:
+        return empty_state.reindex(columns=[*empty_state.columns, *FORECAST_RESULT_COLUMNS])
+    state = accumulate(empty_state, daily_arrivals(sessions))
+    results = experiment_results_summary(parquet_dir, experiment_id)
+    for column in FORECAST_RESULT_COLUMNS:
+        state[column] = results[column].iloc[0] if len(results) else np.nan
+    return state
+
+
+#Lets the dashboard swap a query file for its columnar equivalent; the functions take the query's parameters in the same order
+QUERY_FUNCTIONS = {
+    "conversion_rates_over_time.txt": conversion_rates_over_time,
+    "experiments.txt": experiments_list,
+    "experiments_results_summary.txt": experiment_results_summary,
+    "segment_cube.txt": segment_cube,
+    "data_quality_checks.txt": data_quality_checks,
+    "traffic_forecast.txt": traffic_forecast,
+}
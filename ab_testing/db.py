@@ -0,0 +1,120 @@
+"""
+Read-only access to ab_testing.db for the dashboard: a small pool of shared connections, the SQL query files
+loaded once, and the database's data version for cache invalidation.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from . import instrumentation
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE_KIB = 64 * 1024
+
+
+def load_queries(queries_dir) -> dict:
+    """
+    Reads every .txt query in queries_dir once and returns {file name: SQL text}
+    """
+    with instrumentation.timer("query_loading"):
+        return {path.name: path.read_text(encoding="utf-8") for path in sorted(Path(queries_dir).glob("*.txt"))}
+
+
+class ReadOnlyConnectionPool:
+    """
+    A fixed number of read-only SQLite connections shared between threads (Streamlit sessions).
+    Connections are opened lazily; once size of them are in use, callers wait for one to come back.
+    Each connection keeps SQLite's prepared-statement cache, so the same query text is only compiled once per connection.
+    """
+
+    def __init__(self, db_path, size: int = DEFAULT_POOL_SIZE, mmap_size: int = DEFAULT_MMAP_SIZE, cache_size_kib: int = DEFAULT_CACHE_SIZE_KIB):
+        self.db_path = Path(db_path)
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = f"file:{self.db_path.resolve().as_posix()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {-int(self.cache_size_kib)}")
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def read_df(self, query: str, params: tuple = (), name: str = None) -> pd.DataFrame:
+        """
+        Runs query on a pooled connection. name (the query file) only labels the run in the instrumentation
+        """
+        with self.connection() as conn:
+            if not instrumentation.is_enabled():
+                return pd.read_sql_query(query, conn, params=params)
+            start = time.perf_counter()
+            df = pd.read_sql_query(query, conn, params=params)
+            seconds = time.perf_counter() - start
+        instrumentation.observe("query_execution", seconds)
+        instrumentation.record_query(name, query, params, seconds)
+        return df
+
+    def explain_query_plan(self, query: str, params: tuple = ()) -> pd.DataFrame:
+        """
+        SQLite's EXPLAIN QUERY PLAN for query: which indexes it uses and where it scans whole tables
+        """
+        with self.connection() as conn:
+            return pd.read_sql_query(f"EXPLAIN QUERY PLAN {query}", conn, params=params)
+
+    def data_version(self) -> int:
+        """
+        SQLite's PRAGMA data_version from a dedicated connection. It changes whenever another connection
+        (the loader, the analysis job) commits to the database, so it works as a cache key for query results.
+        """
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = self._connect()
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._opened = 0
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
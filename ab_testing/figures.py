@@ -0,0 +1,143 @@
+"""
+Plotly figures for one experiment, shared by the dashboard and the batch report exporter so both draw the same charts.
+Every function takes the frames the dashboard queries return: a latest_experiment_results row and the
+conversion_rates_over_time rows.
+"""
+from statistics import NormalDist
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+#Same level as the z-test's confidence interval
+CONFIDENCE_LEVEL = 0.95
+
+
+def conversion_rates_figure(conversion_rates_df, period_label="Period"):
+    return px.line(
+        conversion_rates_df,
+        x="time_period",
+        y="conversion_rate",
+        color="variant",
+        markers=True,
+        labels={"time_period": period_label, "conversion_rate": "Conversion rate"},
+    )
+
+
+def _interval_traces(results_row):
+    """
+    Scatter traces for the CI plot: each variant's conversion rate with its normal-approximation interval, and the
+    treatment - control difference with the interval two_proportion_ztest reported
+    """
+    critical = NormalDist().inv_cdf(1 - (1 - CONFIDENCE_LEVEL) / 2)
+    rates = np.array([results_row["control_rate"], results_row["treatment_rate"]], dtype=float)
+    sizes = np.array([results_row["control_size"], results_row["treatment_size"]], dtype=float)
+    margins = critical * np.sqrt(rates * (1 - rates) / sizes)
+    difference = results_row["treatment_rate"] - results_row["control_rate"]
+    variants = go.Scatter(
+        x=rates,
+        y=["control", "treatment"],
+        mode="markers",
+        error_x={"type": "data", "array": margins},
+        marker={"size": 10},
+        name="Conversion rate",
+        showlegend=False,
+    )
+    lift = go.Scatter(
+        x=[difference],
+        y=["treatment - control"],
+        mode="markers",
+        error_x={"type": "data", "array": [results_row["upper_ci"] - difference], "arrayminus": [difference - results_row["lower_ci"]]},
+        marker={"size": 10, "color": "seagreen" if results_row["lower_ci"] > 0 or results_row["upper_ci"] < 0 else "gray"},
+        name="Difference",
+        showlegend=False,
+    )
+    return variants, lift
+
+
+def confidence_interval_figure(results_row):
+    """
+    Two panels: the variants' conversion rates and the difference between them, each with its 95% interval.
+    The difference panel has a line at zero, so an interval that crosses it is visibly not significant
+    """
+    variants, lift = _interval_traces(results_row)
+    fig = make_subplots(rows=1, cols=2, subplot_titles=("Conversion rate by variant", "Difference in conversion rate"), horizontal_spacing=0.2)
+    fig.add_trace(variants, row=1, col=1)
+    fig.add_trace(lift, row=1, col=2)
+    fig.add_vline(x=0, line_dash="dash", line_color="gray", row=1, col=2)
+    fig.update_xaxes(tickformat=".1%")
+    fig.update_layout(height=300, margin={"t": 60, "b": 40})
+    return fig
+
+
+def verdicts(results_row):
+    """
+    The significance, power and MDE verdicts statistical_tests.py prints, as short sentences
+    """
+    lines = []
+    if results_row["p_value"] < 0.05:
+        lines.append(f"Statistically significant (p = {results_row['p_value']:.4g}): reject H0.")
+    else:
+        lines.append(f"Not statistically significant (p = {results_row['p_value']:.4g}): not enough evidence to reject H0.")
+    if results_row.get("power") is not None and not np.isnan(results_row["power"]):
+        lines.append(
+            f"Power {results_row['power']:.1%}: {results_row['required_users_per_group']:,.0f} users per group needed for 80% power "
+            f"({results_row['users_multiplier']:.1f}x the current sample)."
+        )
+        powered = "well-powered" if results_row["well_powered"] else "underpowered"
+        lines.append(
+            f"MDE {results_row['mde_relative_lift_pct']:.1f}% vs observed lift {results_row['lift_percent']:.1f}%: {powered}."
+        )
+    return lines
+
+
+def report_figure(results_row, conversion_rates_df, title, period_label="Period"):
+    """
+    A whole one-page report: the four metric tiles, conversion rates over time, the CI plots and the verdicts
+    """
+    fig = make_subplots(
+        rows=3,
+        cols=4,
+        specs=[
+            [{"type": "indicator"}] * 4,
+            [{"type": "xy", "colspan": 4}, None, None, None],
+            [{"type": "xy", "colspan": 2}, None, {"type": "xy", "colspan": 2}, None],
+        ],
+        row_heights=[0.15, 0.45, 0.4],
+        vertical_spacing=0.1,
+        subplot_titles=("", "", "", "", "Conversion rates over time", "Conversion rate by variant", "Difference in conversion rate"),
+    )
+    tiles = [
+        ("Lift", results_row["lift_percent"], {"suffix": "%", "valueformat": "+.2f"}),
+        ("p-value", results_row["p_value"], {"valueformat": ".4g"}),
+        ("z-score", results_row["z_score"], {"valueformat": ".3f"}),
+    ]
+    for column, (label, value, number) in enumerate(tiles, start=1):
+        fig.add_trace(go.Indicator(mode="number", value=value, number=number, title={"text": label}), row=1, col=column)
+    #An indicator can only show a number, so the yes/no tile is a title and an annotation in the same cell
+    significant = results_row["p_value"] < 0.05
+    cell = fig.get_subplot(1, 4)
+    fig.add_annotation(
+        text=f"<span style='font-size:14px'>Significant?</span><br><br><b>{'Yes' if significant else 'No'}</b>",
+        xref="paper", yref="paper", x=sum(cell.x) / 2, y=sum(cell.y) / 2, showarrow=False,
+        font={"size": 44, "color": "seagreen" if significant else "firebrick"},
+    )
+
+    for trace in conversion_rates_figure(conversion_rates_df).data:
+        fig.add_trace(trace, row=2, col=1)
+    fig.update_xaxes(title_text=period_label, row=2, col=1)
+    fig.update_yaxes(title_text="Conversion rate", tickformat=".1%", row=2, col=1)
+
+    variants, lift = _interval_traces(results_row)
+    fig.add_trace(variants, row=3, col=1)
+    fig.add_trace(lift, row=3, col=3)
+    fig.add_vline(x=0, line_dash="dash", line_color="gray", row=3, col=3, exclude_empty_subplots=False)
+    fig.update_xaxes(tickformat=".1%", row=3)
+
+    fig.add_annotation(
+        text="<br>".join(verdicts(results_row)),
+        xref="paper", yref="paper", x=0, y=-0.06, xanchor="left", yanchor="top", align="left", showarrow=False,
+    )
+    fig.update_layout(title=title, width=1100, height=1300, margin={"t": 80, "b": 140}, legend={"orientation": "h", "y": 0.88})
+    return fig
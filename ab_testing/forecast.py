@@ -0,0 +1,242 @@
+"""
+How many more days an experiment needs: a linear trend fitted to each experiment's daily arrivals (users whose first
+session falls on that day) projected forward from the users each group already has, combined with the closed-form
+sample sizes from power.py. The users so far and the baseline (control) conversion rate are the distinct-user figures
+of the latest analysis run in experiment_results, so the forecast counts users the same way the test does.
+
+The fit is kept as OLS sufficient statistics (sums of t, t^2, y, t*y) in traffic_forecast_state, one row per
+experiment, so new days are added to the sums without rereading old ones, and a forecast over any grid of lifts is a
+handful of array operations. Each user's first session date is kept in traffic_forecast_first_sessions, which is what
+lets a refresh tell new users from returning ones while reading only the new sessions.
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from .power import cohens_h, sample_size_from_effect_size
+from .results_store import LATEST_RESULTS_VIEW, create_results_tables
+
+FORECAST_TABLE = "traffic_forecast_state"
+FIRST_SESSIONS_TABLE = "traffic_forecast_first_sessions"
+#Column -> SQL type, after experiment_id. t is days since the experiment's first day of traffic
+FORECAST_COLUMNS = {
+    "first_date": "TEXT",
+    "last_date": "TEXT",
+    "days": "INTEGER",
+    "arms": "INTEGER",
+    #Arrivals, all arms together: y = users whose first session was that day
+    "sum_t": "REAL",
+    "sum_t2": "REAL",
+    "sum_new_users": "REAL",
+    "sum_t_new_users": "REAL",
+}
+SUM_COLUMNS = [column for column in FORECAST_COLUMNS if column.startswith("sum_")]
+#What forecast_durations needs from the latest analysis run, besides the state
+RESULT_COLUMNS = ["control_rate", "control_size", "treatment_size"]
+#First session of every user with a session after the newest cached day. Sessions are assumed to arrive in date
+#order, so a user already in the table keeps the date it has; a bare column next to MIN() comes from the MIN() row
+FIRST_SESSIONS_SQL = f"""
+    INSERT INTO {FIRST_SESSIONS_TABLE} (experiment_id, user_id, variant, first_date)
+    SELECT experiment_id, user_id, variant, MIN(session_date)
+    FROM user_sessions
+    WHERE session_date > COALESCE((SELECT MAX(last_date) FROM {FORECAST_TABLE}), '')
+    GROUP BY experiment_id, user_id
+    ON CONFLICT (experiment_id, user_id) DO NOTHING
+"""
+#Arrivals per day for every day after each experiment's cached last_date (all days for experiments without state)
+NEW_DAYS_SQL = f"""
+    SELECT
+        f.experiment_id,
+        f.first_date AS date,
+        COUNT(*) AS new_users,
+        COUNT(DISTINCT f.variant) AS arms
+    FROM {FIRST_SESSIONS_TABLE} f
+    LEFT JOIN {FORECAST_TABLE} s ON s.experiment_id = f.experiment_id
+    WHERE s.last_date IS NULL OR f.first_date > s.last_date
+    GROUP BY f.experiment_id, f.first_date
+"""
+
+
+def create_forecast_table(conn: sqlite3.Connection):
+    #State from before the fit moved to arrivals counted user-days; it is all derived, so it is dropped and rebuilt
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({FORECAST_TABLE})")}
+    if existing and not set(FORECAST_COLUMNS) <= existing:
+        conn.execute(f"DROP TABLE {FORECAST_TABLE}")
+    columns = ", ".join(f"{column} {column_type}" for column, column_type in FORECAST_COLUMNS.items())
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {FORECAST_TABLE} (experiment_id INTEGER PRIMARY KEY, {columns})")
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {FIRST_SESSIONS_TABLE} ("
+        "experiment_id INTEGER NOT NULL, user_id INTEGER NOT NULL, variant TEXT NOT NULL, first_date TEXT NOT NULL, "
+        "PRIMARY KEY (experiment_id, user_id)) WITHOUT ROWID"
+    )
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FIRST_SESSIONS_TABLE}_first_date ON {FIRST_SESSIONS_TABLE} (experiment_id, first_date)")
+
+
+def daily_arrivals(sessions_df):
+    """
+    Per-(experiment_id, date) arrivals from a frame of sessions (experiment_id, variant, user_id, session_date), the
+    same columns NEW_DAYS_SQL returns
+    """
+    dates = sessions_df["session_date"].astype(str).str[:10]
+    first = sessions_df.assign(date=dates).sort_values("date").drop_duplicates(["experiment_id", "user_id"])
+    return first.groupby(["experiment_id", "date"], as_index=False).agg(
+        new_users=("user_id", "size"),
+        arms=("variant", "nunique"),
+    )
+
+
+def accumulate(state_df, traffic_df):
+    """
+    Adds new days (daily_arrivals or NEW_DAYS_SQL rows, all later than each experiment's last_date) to the cached sums.
+    state_df has FORECAST_COLUMNS and experiment_id, and may be empty. Returns the updated state, one row per experiment
+    """
+    state = state_df.set_index("experiment_id")
+    traffic = traffic_df.copy()
+    traffic["date"] = traffic["date"].astype(str).str[:10]
+    #t is measured from the first day ever seen for the experiment, which stays fixed as days are added
+    first_dates = traffic.groupby("experiment_id")["date"].min().rename("first_date").to_frame()
+    first_dates.update(state["first_date"])
+    traffic = traffic.join(first_dates, on="experiment_id")
+    t = (pd.to_datetime(traffic["date"]) - pd.to_datetime(traffic["first_date"])).dt.days.to_numpy(dtype=float)
+    new_users = traffic["new_users"].to_numpy(dtype=float)
+    sums = pd.DataFrame({
+        "experiment_id": traffic["experiment_id"].to_numpy(),
+        "days": 1,
+        "sum_t": t,
+        "sum_t2": t * t,
+        "sum_new_users": new_users,
+        "sum_t_new_users": t * new_users,
+    }).groupby("experiment_id").sum()
+    sums["last_date"] = traffic.groupby("experiment_id")["date"].max()
+    sums["arms"] = traffic.groupby("experiment_id")["arms"].max()
+    sums["first_date"] = first_dates["first_date"]
+
+    combined = state.reindex(state.index.union(sums.index))
+    added = sums.reindex(combined.index)
+    has_new = added["days"].notna()
+    for column in ["days", *SUM_COLUMNS]:
+        combined[column] = combined[column].astype(float).fillna(0) + added[column].fillna(0)
+    combined.loc[has_new, "last_date"] = added.loc[has_new, "last_date"]
+    combined.loc[has_new, "first_date"] = added.loc[has_new, "first_date"]
+    combined["arms"] = np.fmax(combined["arms"].astype(float), added["arms"].astype(float))
+    combined[["days", "arms"]] = combined[["days", "arms"]].astype(np.int64)
+    return combined[list(FORECAST_COLUMNS)].reset_index()
+
+
+def read_forecast_state(conn: sqlite3.Connection, experiment_id=None):
+    """
+    The cached fits, with the RESULT_COLUMNS of each experiment's latest analysis run (NULL before the first run)
+    """
+    create_forecast_table(conn)
+    create_results_tables(conn)
+    result_columns = ", ".join(f"r.{column}" for column in RESULT_COLUMNS)
+    query = f"SELECT s.*, {result_columns} FROM {FORECAST_TABLE} s LEFT JOIN {LATEST_RESULTS_VIEW} r USING (experiment_id)"
+    params = ()
+    if experiment_id is not None:
+        query += " WHERE s.experiment_id = ?"
+        params = (experiment_id,)
+    return pd.read_sql_query(query + " ORDER BY s.experiment_id", conn, params=params)
+
+
+def refresh_forecast_state(conn: sqlite3.Connection, full: bool = False):
+    """
+    Adds the days user_sessions has beyond each experiment's cached last_date to the cached sums, reading only the
+    sessions after the newest cached day. Like the rollups, it assumes days arrive in date order and complete; pass
+    full=True after user_sessions was rebuilt
+    """
+    create_forecast_table(conn)
+    if full:
+        conn.execute(f"DELETE FROM {FORECAST_TABLE}")
+        conn.execute(f"DELETE FROM {FIRST_SESSIONS_TABLE}")
+    conn.execute(FIRST_SESSIONS_SQL)
+    new_days = pd.read_sql_query(NEW_DAYS_SQL, conn)
+    if len(new_days) == 0:
+        return
+    state = accumulate(read_forecast_state(conn)[["experiment_id", *FORECAST_COLUMNS]], new_days)
+    columns = ["experiment_id", *FORECAST_COLUMNS]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {FORECAST_TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [tuple(value.item() if hasattr(value, "item") else value for value in row) for row in state[columns].itertuples(index=False)],
+    )
+
+
+def _days_to_reach(remaining, intercept, slope, arms):
+    """
+    Smallest whole number of days d with sum_{k=1..d} (intercept + slope * k) / arms >= remaining, inf if the
+    forecast traffic never gets there (a falling trend that runs out first)
+    """
+    target = remaining * arms
+    #sum_{k=1..d} (a + b k) = b/2 d^2 + (a + b/2) d; the stable form of the positive root also covers b = 0 and b < 0
+    q = slope / 2
+    linear = intercept + slope / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        root = np.sqrt(linear ** 2 + 4 * q * target)
+        days = np.where(np.isfinite(root) & (linear + root > 0), 2 * target / (linear + root), np.inf)
+    #Past the peak of a falling trend traffic would go negative, so a root beyond it isn't reachable
+    with np.errstate(divide="ignore", invalid="ignore"):
+        peak = np.where(slope < 0, -intercept / slope, np.inf)
+    days = np.where(days > peak, np.inf, days)
+    days = np.where(remaining <= 0, 0.0, np.ceil(days - 1e-9))
+    #No analysis run yet means no users so far or baseline to forecast from
+    return np.where(np.isnan(remaining), np.nan, days)
+
+
+def forecast_durations(state_df, lifts, power=0.8, alpha=0.05):
+    """
+    For every experiment in state_df (read_forecast_state rows) and every relative lift in lifts (0.05 = +5%), the
+    users per group needed and the days from the last day of traffic until the test reaches significance (the expected
+    z-score crosses the critical value, i.e. 50% power) and until it reaches the target power, if the true lift is that
+    lift. Experiments without an analysis run get NaN
+    """
+    state = state_df.reset_index(drop=True)
+    lifts = np.atleast_1d(np.asarray(lifts, dtype=float))
+    sums = {column: state[column].to_numpy(dtype=float) for column in ["days", "arms", *SUM_COLUMNS]}
+    days = sums["days"]
+
+    #Arrival trend: new users per day = a + b t
+    mean_t = sums["sum_t"] / days
+    mean_users = sums["sum_new_users"] / days
+    s_tt = sums["sum_t2"] - days * mean_t ** 2
+    s_ty = sums["sum_t_new_users"] - days * mean_t * mean_users
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(s_tt > 0, s_ty / s_tt, 0.0)
+    last_t = (pd.to_datetime(state["last_date"]) - pd.to_datetime(state["first_date"])).dt.days.to_numpy(dtype=float)
+    #Shifted so that k = 1 is the day after last_date
+    intercept = mean_users + slope * (last_t - mean_t)
+
+    #Distinct users and the user-level control rate, as the test counts them; the smaller arm is the one still short
+    baseline = np.clip(state["control_rate"].to_numpy(dtype=float), 1e-6, 1 - 1e-6)
+    current = np.fmin(state["control_size"].to_numpy(dtype=float), state["treatment_size"].to_numpy(dtype=float))
+
+    arms = sums["arms"]
+
+    #(experiment, lift) grid, experiments down the rows
+    effect_size = cohens_h(baseline[:, None], np.clip(baseline[:, None] * (1 + lifts[None, :]), 0, 1))
+    needed_significance = sample_size_from_effect_size(effect_size, 0.5, alpha)
+    needed_power = sample_size_from_effect_size(effect_size, power, alpha)
+    args = (intercept[:, None], slope[:, None], arms[:, None])
+    days_significance = _days_to_reach(needed_significance - current[:, None], *args)
+    days_power = _days_to_reach(needed_power - current[:, None], *args)
+
+    last_date = pd.to_datetime(state["last_date"]).to_numpy()[:, None]
+    def dates(day_counts):
+        finite = np.isfinite(day_counts)
+        offsets = np.where(finite, day_counts, 0).astype("timedelta64[D]")
+        return np.where(finite, last_date + offsets, np.datetime64("NaT")).ravel()
+
+    n_lifts = len(lifts)
+    return pd.DataFrame({
+        "experiment_id": np.repeat(state["experiment_id"].to_numpy(), n_lifts),
+        "relative_lift": np.tile(lifts, len(state)),
+        "baseline_rate": np.repeat(baseline, n_lifts),
+        "daily_users_per_group": np.repeat(np.maximum(intercept + slope, 0) / arms, n_lifts),
+        "daily_users_trend": np.repeat(slope / arms, n_lifts),
+        "users_per_group_so_far": np.repeat(current, n_lifts),
+        "users_per_group_for_significance": np.ceil(needed_significance).ravel(),
+        "users_per_group_for_power": np.ceil(needed_power).ravel(),
+        "days_to_significance": days_significance.ravel(),
+        "days_to_target_power": days_power.ravel(),
+        "significance_date": dates(days_significance),
+        "target_power_date": dates(days_power),
+    })
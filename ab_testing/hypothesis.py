@@ -0,0 +1,81 @@
+import numpy as np
+
+
+def two_proportion_ztest(n1, x1, n2, x2):
+    """
+    Perform two-proportion z-test. Every argument can be a scalar or an array (one entry per experiment).
+    
+    Parameters:
+    n1: sample size for group 1 (control)
+    x1: number of successes in group 1 (control conversions)
+    n2: sample size for group 2 (treatment)
+    x2: number of successes in group 2 (treatment conversions)
+    
+    Returns:
+    dict with z_score, p_value, significance (boolean), lower confidence interval, upper confidence interval and lift_percent.
+    Values are floats for scalar inputs and NumPy arrays for array inputs
+    """
+    from scipy import stats
+
+    n1, x1, n2, x2 = (np.asarray(value, dtype=float) for value in (n1, x1, n2, x2))
+
+    if np.any(n1 == 0) or np.any(n2 == 0):
+        raise ValueError("Sample sizes n1 and n2 must be greater than 0.")
+
+    p1 = x1 / n1
+    p2 = x2 / n2
+    p_pool = (x1 + x2) / (n1 + n2)
+    #Nobody (or everybody) converted, so there is nothing to test
+    degenerate = (p_pool == 0) | (p_pool == 1)
+
+    standard_error = np.sqrt(p_pool * (1 - p_pool) * (1/n1 + 1/n2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_score = np.where(standard_error == 0, 0.0, (p2 - p1) / standard_error)
+        lift_percent = np.where(p1 == 0, np.where(p2 > 0, np.inf, 0.0), np.round((p2 - p1) / p1 * 100, 2))
+    p_value_two_tail = 2 * stats.norm.sf(np.abs(z_score))
+
+    difference = p2 - p1
+    standard_error_diff = np.sqrt((p1*(1-p1)/n1) + (p2*(1-p2)/n2))
+    confidence_interval_lower = difference - 1.96 * standard_error_diff
+    confidence_interval_upper = difference + 1.96 * standard_error_diff
+
+    results = {
+        'z_score': np.where(degenerate, 0.0, z_score),
+        'p_value': np.where(degenerate, 1.0, p_value_two_tail),
+        'significant': np.where(degenerate, False, p_value_two_tail < 0.05),
+        'lower_ci': np.where(degenerate, 0.0, confidence_interval_lower),
+        'upper_ci': np.where(degenerate, 0.0, confidence_interval_upper),
+        'lift_percent': np.where(degenerate, 0.0, lift_percent),
+    }
+    if n1.ndim == 0 and x1.ndim == 0 and n2.ndim == 0 and x2.ndim == 0:
+        return {key: value.item() for key, value in results.items()}
+    return results
+
+
+def adjust_pvalues(p_values, method='holm'):
+    """
+    Multiple-comparison adjustment of a 1-D array of p-values, vectorized. NaNs are left out of the family and stay NaN.
+
+    method: 'bonferroni', 'holm' (family-wise error rate) or 'fdr_bh' (Benjamini-Hochberg false discovery rate)
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    m = len(valid)
+    if m == 0:
+        return adjusted
+
+    order = valid[np.argsort(p_values[valid], kind='stable')]
+    ranked = p_values[order]
+    if method == 'bonferroni':
+        values = ranked * m
+    elif method == 'holm':
+        #p_(i) * (m - i + 1), made monotone from the smallest p-value up
+        values = np.maximum.accumulate(ranked * (m - np.arange(m)))
+    elif method == 'fdr_bh':
+        #p_(i) * m / i, made monotone from the largest p-value down
+        values = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError("method must be 'bonferroni', 'holm' or 'fdr_bh'.")
+    adjusted[order] = np.minimum(values, 1.0)
+    return adjusted
@@ -0,0 +1,165 @@
+"""
+Lightweight, switchable timing for the hot paths: per-stage latency histograms, counters (cache hits and misses) and
+a short history of recent SQL queries, exported as Prometheus text or JSON. Off by default; turn it on with
+AB_INSTRUMENTATION=1 or enable(). While it's off, timer() hands back a shared no-op context manager, so the hooks
+cost a function call and an if.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+#Histogram bucket upper bounds in seconds, the same ladder Prometheus client libraries default to
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RECENT_QUERIES = 200
+
+#Whether it starts on; enable() and disable() switch it afterwards
+ENABLED_AT_START = os.environ.get("AB_INSTRUMENTATION", "").lower() in ("1", "true", "yes", "on")
+
+_enabled = ENABLED_AT_START
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_recent_queries = deque(maxlen=RECENT_QUERIES)
+_noop = nullcontext()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _recent_queries.clear()
+
+
+def observe(stage: str, seconds: float):
+    """
+    Adds one duration to the stage's histogram
+    """
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = {"buckets": [0] * (len(BUCKETS) + 1), "count": 0, "sum": 0.0, "max": 0.0}
+        histogram["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram["count"] += 1
+        histogram["sum"] += seconds
+        histogram["max"] = max(histogram["max"], seconds)
+
+
+@contextmanager
+def _timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def timer(stage: str):
+    """
+    with timer("stage"): ... records how long the block took, if instrumentation is on
+    """
+    return _timer(stage) if _enabled else _noop
+
+
+def count(name: str, value: int = 1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def record_query(name: str, sql: str, params: tuple, seconds: float):
+    """
+    Remembers a query execution for slowest_queries(). name is the query file name when there is one
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _recent_queries.append({"name": name, "sql": sql, "params": tuple(params), "seconds": seconds, "at": time.time()})
+
+
+def slowest_queries(n: int = 10) -> list:
+    """
+    The n slowest of the recent queries, slowest first
+    """
+    with _lock:
+        queries = list(_recent_queries)
+    return sorted(queries, key=lambda query: query["seconds"], reverse=True)[:n]
+
+
+def quantile(stage: str, q: float) -> float:
+    """
+    Upper bound of the histogram bucket holding the q-th quantile of the stage's durations (max for the overflow bucket)
+    """
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None or histogram["count"] == 0:
+            return float("nan")
+        target = q * histogram["count"]
+        seen = 0
+        for upper, bucket_count in zip((*BUCKETS, histogram["max"]), histogram["buckets"]):
+            seen += bucket_count
+            if seen >= target:
+                return min(upper, histogram["max"])
+        return histogram["max"]
+
+
+def snapshot() -> dict:
+    """
+    Everything recorded so far as plain data: {"histograms": {stage: {...}}, "counters": {...}, "recent_queries": [...]}
+    """
+    with _lock:
+        histograms = {
+            stage: {**histogram, "buckets": dict(zip([*map(str, BUCKETS), "+Inf"], histogram["buckets"]))}
+            for stage, histogram in _histograms.items()
+        }
+        return {"histograms": histograms, "counters": dict(_counters), "recent_queries": list(_recent_queries)}
+
+
+def to_json() -> str:
+    return json.dumps(snapshot(), default=str, indent=2)
+
+
+def to_prometheus(prefix: str = "ab_testing") -> str:
+    """
+    Prometheus text exposition format: one <prefix>_stage_seconds histogram labelled by stage, and one counter per name
+    """
+    lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+    with _lock:
+        for stage, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for upper, bucket_count in zip([*map(str, BUCKETS), "+Inf"], histogram["buckets"]):
+                cumulative += bucket_count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{upper}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        for name, value in sorted(_counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_report(path):
+    """
+    Writes the metrics to path, Prometheus text for a .prom file and JSON otherwise
+    """
+    text = to_prometheus() if str(path).endswith(".prom") else to_json()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
@@ -0,0 +1,180 @@
+"""
+Test engine for any number of arms and metrics. Every metric is reduced to per-arm sufficient statistics in one
+groupby (or one SQL GROUP BY): the unit count n and the sums of y, d, y^2, d^2 and y*d for a numerator y and
+denominator d per unit. That covers conversion (y = converted, d = 1), means such as revenue per user (d = 1) and
+ratio metrics such as revenue per user from daily totals (y = revenue, d = users per day), where the ratio's variance
+comes from the delta method. compare_arms then tests every arm against control for every metric at once.
+
+A stats frame has one row per (experiment_id, variant, metric) with columns n, sum_y, sum_d, sum_y2, sum_d2, sum_yd
+and proportion (True when y is 0/1 and d = 1, so the test uses the pooled standard error like two_proportion_ztest).
+"""
+import numpy as np
+import pandas as pd
+
+from .hypothesis import adjust_pvalues
+
+STATS_KEYS = ['experiment_id', 'variant', 'metric']
+STATS_COLUMNS = ['n', 'sum_y', 'sum_d', 'sum_y2', 'sum_d2', 'sum_yd']
+#Ratio metrics daily_metrics supports, metric -> (numerator column, denominator column). Units are days
+DAILY_METRICS = {
+    'revenue_per_user': ('total_revenue', 'total_users'),
+    'conversions_per_user': ('total_conversions', 'total_users'),
+}
+
+
+def unit_stats(units_df, metrics, proportion=()):
+    """
+    Sufficient statistics from a unit-level frame (experiment_id, variant, one row per unit, whatever columns metrics
+    names). metrics maps metric name -> (numerator column, denominator column or None for a plain mean); metric names
+    in proportion are 0/1 outcomes. Every metric is aggregated in a single groupby
+    """
+    columns = {}
+    for metric, (numerator, denominator) in metrics.items():
+        y = units_df[numerator].to_numpy(dtype=float)
+        d = np.ones(len(units_df)) if denominator is None else units_df[denominator].to_numpy(dtype=float)
+        columns.update({(metric, 'n'): np.ones(len(units_df)), (metric, 'sum_y'): y, (metric, 'sum_d'): d,
+                        (metric, 'sum_y2'): y * y, (metric, 'sum_d2'): d * d, (metric, 'sum_yd'): y * d})
+    wide = pd.DataFrame(columns, index=pd.MultiIndex.from_frame(units_df[['experiment_id', 'variant']]))
+    wide.columns = pd.MultiIndex.from_tuples(wide.columns, names=['metric', None])
+    sums = wide.groupby(level=['experiment_id', 'variant'], sort=False, observed=True).sum()
+    stats_df = sums.stack('metric', future_stack=True).reset_index()[[*STATS_KEYS, *STATS_COLUMNS]]
+    stats_df['n'] = stats_df['n'].astype(np.int64)
+    stats_df['proportion'] = stats_df['metric'].isin(list(proportion))
+    return stats_df
+
+
+def conversion_stats(counts_df, metric='conversion'):
+    """
+    Conversion stats straight from an n/x counts frame (count_users_by_variant, SessionAggregator, count_users_arrow),
+    for however many variants it has: for a 0/1 outcome every sum follows from n and x
+    """
+    counts = counts_df.reset_index()
+    n = counts['n'].to_numpy(dtype=np.int64)
+    x = counts['x'].to_numpy(dtype=float)
+    return pd.DataFrame({
+        'experiment_id': counts['experiment_id'],
+        'variant': counts['variant'],
+        'metric': metric,
+        'n': n,
+        'sum_y': x,
+        'sum_d': n.astype(float),
+        'sum_y2': x,
+        'sum_d2': n.astype(float),
+        'sum_yd': x,
+        'proportion': True,
+    })
+
+
+def daily_metric_stats(daily_metrics_df, metrics=None):
+    """
+    Ratio-metric stats from daily_metrics (one unit per day and variant), for the DAILY_METRICS names given (all by default)
+    """
+    metrics = DAILY_METRICS if metrics is None else {metric: DAILY_METRICS[metric] for metric in metrics}
+    return unit_stats(daily_metrics_df, metrics)
+
+
+def daily_metric_stats_from_db(conn, metrics=None):
+    """
+    daily_metric_stats computed by SQLite from the loaded daily_metrics table: one GROUP BY for every arm and metric
+    """
+    metrics = DAILY_METRICS if metrics is None else {metric: DAILY_METRICS[metric] for metric in metrics}
+    selects = [
+        f"SELECT experiment_id, variant, '{metric}' AS metric, COUNT(*) AS n, "
+        f"SUM({y}) AS sum_y, SUM({d}) AS sum_d, SUM({y} * {y}) AS sum_y2, SUM({d} * {d}) AS sum_d2, SUM({y} * {d}) AS sum_yd "
+        "FROM daily_metrics GROUP BY experiment_id, variant"
+        for metric, (y, d) in metrics.items()
+    ]
+    stats_df = pd.read_sql_query(" UNION ALL ".join(selects), conn)
+    stats_df[STATS_COLUMNS[1:]] = stats_df[STATS_COLUMNS[1:]].astype(float)
+    stats_df['proportion'] = False
+    return stats_df
+
+
+def _ratio_and_variance(stats):
+    """
+    Per-row estimate sum_y / sum_d and the delta-method variance of that estimate
+    """
+    n = stats['n'].to_numpy(dtype=float)
+    mean_y = stats['sum_y'].to_numpy() / n
+    mean_d = stats['sum_d'].to_numpy() / n
+    #Sample (co)variances of the per-unit y and d; p(1 - p) for proportions, as two_proportion_ztest's interval uses
+    dof = np.where(stats['proportion'].to_numpy(), n, np.maximum(n - 1, 1))
+    var_y = (stats['sum_y2'].to_numpy() - n * mean_y ** 2) / dof
+    var_d = (stats['sum_d2'].to_numpy() - n * mean_d ** 2) / dof
+    cov_yd = (stats['sum_yd'].to_numpy() - n * mean_y * mean_d) / dof
+    ratio = mean_y / mean_d
+    variance = (var_y - 2 * ratio * cov_yd + ratio ** 2 * var_d) / (n * mean_d ** 2)
+    return ratio, np.maximum(variance, 0.0)
+
+
+def compare_arms(stats_df, control='control', alpha=0.05, method='holm', family=('experiment_id',)):
+    """
+    Every non-control arm against control, for every experiment and metric in stats_df, in one vectorized pass.
+
+    Returns one row per (experiment_id, metric, variant) with both estimates, the difference and its CI, the relative
+    lift and its delta-method CI (percent), z_score, p_value, and adjusted_p_value from adjust_pvalues(method) within
+    each family (columns of the result; by default all comparisons of one experiment, every arm and metric). None for
+    family treats the whole table as one family
+    """
+    from scipy import stats
+
+    estimate, variance = _ratio_and_variance(stats_df)
+    arms = stats_df[[*STATS_KEYS, 'n', 'proportion']].assign(estimate=estimate, variance=variance,
+                                                              sum_y=stats_df['sum_y'].to_numpy())
+    is_control = arms['variant'] == control
+    #Each arm's row lined up with its experiment's control row for the same metric
+    paired = arms[~is_control].merge(arms[is_control].drop(columns=['variant', 'proportion']), on=['experiment_id', 'metric'], suffixes=('', '_control'))
+
+    n_arm, n_control = paired['n'].to_numpy(dtype=float), paired['n_control'].to_numpy(dtype=float)
+    arm_value, control_value = paired['estimate'].to_numpy(), paired['estimate_control'].to_numpy()
+    arm_var, control_var = paired['variance'].to_numpy(), paired['variance_control'].to_numpy()
+    difference = arm_value - control_value
+    standard_error = np.sqrt(arm_var + control_var)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #Proportions are tested with the pooled standard error, the same z two_proportion_ztest gives for two arms
+        p_pool = (paired['sum_y'].to_numpy() + paired['sum_y_control'].to_numpy()) / (n_arm + n_control)
+        pooled_error = np.sqrt(p_pool * (1 - p_pool) * (1 / n_arm + 1 / n_control))
+        test_error = np.where(paired['proportion'].to_numpy(), pooled_error, standard_error)
+        z_score = np.where(test_error > 0, difference / test_error, 0.0)
+        lift = arm_value / control_value - 1
+        #Var(A / C) ~ Var(A) / C^2 + A^2 Var(C) / C^4
+        lift_error = np.sqrt(arm_var / control_value ** 2 + arm_value ** 2 * control_var / control_value ** 4)
+    critical = stats.norm.ppf(1 - alpha / 2)
+
+    results_df = pd.DataFrame({
+        'experiment_id': paired['experiment_id'],
+        'metric': paired['metric'],
+        'variant': paired['variant'],
+        'control_size': n_control.astype(np.int64),
+        'control_value': control_value,
+        'variant_size': n_arm.astype(np.int64),
+        'variant_value': arm_value,
+        'difference': difference,
+        'lower_ci': difference - critical * standard_error,
+        'upper_ci': difference + critical * standard_error,
+        'lift_percent': lift * 100,
+        'lift_lower_percent': (lift - critical * lift_error) * 100,
+        'lift_upper_percent': (lift + critical * lift_error) * 100,
+        'z_score': z_score,
+        'p_value': 2 * stats.norm.sf(np.abs(z_score)),
+    })
+    if family is None:
+        results_df['adjusted_p_value'] = adjust_pvalues(results_df['p_value'].to_numpy(), method)
+    else:
+        results_df['adjusted_p_value'] = results_df.groupby(list(family), sort=False)['p_value'].transform(
+            lambda p_values: adjust_pvalues(p_values.to_numpy(), method)
+        )
+    results_df['is_significant'] = results_df['adjusted_p_value'] < alpha
+    return results_df.sort_values(['experiment_id', 'metric', 'variant'], kind='stable').reset_index(drop=True)
+
+
+def results_array(results_df, column='p_value'):
+    """
+    One column of compare_arms output as an (experiment, metric, arm) array, NaN where an arm doesn't have a metric.
+    Returns (array, experiment_ids, metrics, variants)
+    """
+    cube = results_df.set_index(['experiment_id', 'metric', 'variant'])[column]
+    experiment_ids, metrics, variants = cube.index.remove_unused_levels().levels
+    full_index = pd.MultiIndex.from_product([experiment_ids, metrics, variants])
+    array = cube.reindex(full_index).to_numpy(dtype=float).reshape(len(experiment_ids), len(metrics), len(variants))
+    return array, list(experiment_ids), list(metrics), list(variants)
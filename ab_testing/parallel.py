@@ -0,0 +1,90 @@
+"""
+Runs the user-level aggregation for every experiment on a process pool, then the z-test, power, sample size and MDE
+for all of them in one vectorized pass, the same calls the serial path makes, so both return the same table. The
+session columns are put in shared memory once, sorted by experiment_id, and each worker reads its experiment's slice
+from there instead of being sent a pickled DataFrame.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from .power import analyze_power_from_results
+from .streaming import SessionAggregator
+from .summary import summarize_experiments
+
+
+def _to_shared(array):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm
+
+
+def _count_partition(task):
+    """
+    Worker: attaches to the shared columns and aggregates rows [start, stop) (one experiment) into n/x counts
+    """
+    start, stop, columns, variant_names = task
+    handles = []
+    try:
+        arrays = {}
+        for name, (shm_name, dtype, length) in columns.items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            handles.append(shm)
+            arrays[name] = np.ndarray((length,), dtype=dtype, buffer=shm.buf)[start:stop]
+
+        aggregator = SessionAggregator()
+        aggregator.update_arrays(arrays['experiment_id'], arrays['variant'], variant_names, arrays['user_id'], arrays['converted'])
+        #The views have to go before the shared blocks can be closed
+        del arrays
+        return aggregator.counts()
+    finally:
+        for shm in handles:
+            shm.close()
+
+
+def run_parallel_analysis(sessions_df, experiments, workers=None, power=0.8, alpha=0.05):
+    """
+    Analyzes every experiment in experiments (experiment_id -> name) on a pool of workers processes.
+    Returns (per-variant n/x counts, one consolidated table with the results_summary, power, sample size and MDE columns).
+    Experiments without sessions get the same NaN row the serial path gives them
+    """
+    experiment_ids = sessions_df['experiment_id'].to_numpy(dtype=np.int32)
+    order = np.argsort(experiment_ids, kind='stable')
+    variants = sessions_df['variant'].astype('category')
+    columns = {
+        'experiment_id': experiment_ids[order],
+        'variant': variants.cat.codes.to_numpy()[order],
+        'user_id': sessions_df['user_id'].to_numpy(dtype=np.int32)[order],
+        'converted': sessions_df['converted'].to_numpy(dtype=bool)[order],
+    }
+    variant_names = list(variants.cat.categories)
+
+    shared = {}
+    try:
+        for name, array in columns.items():
+            shared[name] = _to_shared(array)
+        shared_columns = {name: (shared[name].name, columns[name].dtype.str, len(columns[name])) for name in columns}
+
+        sorted_ids = columns['experiment_id']
+        tasks = []
+        for experiment_id in experiments:
+            start = int(np.searchsorted(sorted_ids, experiment_id, side='left'))
+            stop = int(np.searchsorted(sorted_ids, experiment_id, side='right'))
+            #An experiment with no sessions has nothing to count; summarize_experiments fills in its row
+            if stop > start:
+                tasks.append((start, stop, shared_columns, variant_names))
+        del columns, sorted_ids
+
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, max(len(tasks), 1))) as pool:
+            results = list(pool.map(_count_partition, tasks))
+    finally:
+        for shm in shared.values():
+            shm.close()
+            shm.unlink()
+
+    counts_df = pd.concat(results) if results else SessionAggregator().counts()
+    analysis_df = analyze_power_from_results(summarize_experiments(counts_df, experiments), power, alpha)
+    return counts_df, analysis_df
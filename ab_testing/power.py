@@ -0,0 +1,350 @@
+import numpy as np
+import pandas as pd
+
+
+#Phase 2: Time to look at sample sizes and power analysis. We want to know the ideal number of users needed for our tests
+
+#Key definitions: 
+#1.) Sample users: Number of users in each group. More users means more sensitive tests.
+#2.) Effect size: The minimum detectable effect. Would be the smallest difference you want to be able to detect like  a 3% lift from controlled experiment to treatment experiment
+#3.) Statistical power: The probability of detecting a real effect when it exists, like the ability to detect a 5% lift.
+#4.) Significance level: The probability of incorrectly rejecting a true null hypothesis in a statistical test(chance of a false positive)
+
+#Everything below runs on closed-form normal-approximation math, the same model statsmodels' zt_ind_solve_power uses,
+#but on whole NumPy arrays at once instead of running an iterative solver for every scenario.
+#Arguments broadcast against each other, so a column of baselines times a row of lifts gives a whole grid in one call.
+#The far tail of the two-sided test (the chance of rejecting in the wrong direction) is left out when solving
+#for sample size or effect size; it is below 1e-6 at any power worth planning for.
+
+def cohens_h(p1, p2):
+    """
+    Cohen's h effect size for going from rate p1 to rate p2 (same as statsmodels' proportion_effectsize(p2, p1))
+    """
+    return 2 * np.arcsin(np.sqrt(p2)) - 2 * np.arcsin(np.sqrt(p1))
+
+
+def rate_from_cohens_h(p1, effect_size):
+    """
+    Inverts Cohen's h: the rate p2 that is effect_size away from p1. NaN when no rate that high (or low) exists
+    """
+    angle = np.arcsin(np.sqrt(p1)) + np.asarray(effect_size) / 2
+    with np.errstate(invalid='ignore'):
+        return np.where((angle >= 0) & (angle <= np.pi / 2), np.sin(angle) ** 2, np.nan)
+
+
+def _effective_nobs(nobs1, ratio):
+    #nobs1 * nobs2 / (nobs1 + nobs2) with nobs2 = nobs1 * ratio
+    return np.asarray(nobs1) * ratio / (1 + np.asarray(ratio))
+
+
+def power_from_effect_size(effect_size, nobs1, alpha=0.05, ratio=1.0):
+    """
+    Power of a two-sided two-sample z-test. nobs1 is the control size and the treatment size is nobs1 * ratio
+    """
+    from scipy.special import ndtr, ndtri
+
+    critical = -ndtri(np.asarray(alpha) / 2)
+    shift = np.abs(effect_size) * np.sqrt(_effective_nobs(nobs1, ratio))
+    return ndtr(shift - critical) + ndtr(-shift - critical)
+
+
+def sample_size_from_effect_size(effect_size, power=0.8, alpha=0.05, ratio=1.0):
+    """
+    Control group size (not rounded) needed to reach the given power. The treatment group needs ratio times as many
+    """
+    from scipy.special import ndtri
+
+    z_total = -ndtri(np.asarray(alpha) / 2) + ndtri(power)
+    with np.errstate(divide='ignore'):
+        effective_nobs = (z_total / np.abs(effect_size)) ** 2
+    return effective_nobs * (1 + np.asarray(ratio)) / ratio
+
+
+def effect_size_from_sample_size(nobs1, power=0.8, alpha=0.05, ratio=1.0):
+    """
+    Smallest Cohen's h that nobs1 control users (and nobs1 * ratio treatment users) detect with the given power
+    """
+    from scipy.special import ndtri
+
+    z_total = -ndtri(np.asarray(alpha) / 2) + ndtri(power)
+    return z_total / np.sqrt(_effective_nobs(nobs1, ratio))
+
+
+def planning_grid(baseline_rates, expected_lifts, sample_sizes, alphas=0.05, ratios=1.0, power=0.8):
+    """
+    Every combination of baseline rate, relative lift, control sample size, alpha and ratio in one table, with
+    the power at that sample size, the control size required for the target power and the MDE at that sample size
+    """
+    grids = np.meshgrid(*(np.atleast_1d(np.asarray(values, dtype=float)) for values in (baseline_rates, expected_lifts, sample_sizes, alphas, ratios)), indexing='ij')
+    baseline, lift, sample_size, alpha, ratio = (grid.ravel() for grid in grids)
+
+    effect_size = cohens_h(baseline, baseline * (1 + lift))
+    mde_effect_size = effect_size_from_sample_size(sample_size, power, alpha, ratio)
+    return pd.DataFrame({
+        'baseline_rate': baseline,
+        'expected_lift': lift,
+        'sample_size': sample_size,
+        'alpha': alpha,
+        'ratio': ratio,
+        'effect_size': effect_size,
+        'power': power_from_effect_size(effect_size, sample_size, alpha, ratio),
+        'required_sample_per_group': np.ceil(sample_size_from_effect_size(effect_size, power, alpha, ratio)),
+        'mde_relative_lift_pct': (rate_from_cohens_h(baseline, mde_effect_size) - baseline) / baseline * 100,
+    })
+
+
+def _to_output(values, scalar):
+    #Plain Python values for a single scenario, arrays otherwise
+    if scalar:
+        return {key: np.asarray(value).item() for key, value in values.items()}
+    return values
+
+
+def _variance_factor(summary_df):
+    #Rows from cuped.cuped_summary say how much of the variance the covariates removed. Removing a share v of the
+    #variance is worth the same as having 1 / (1 - v) times the users, so the sizes below get scaled by this factor
+    if 'variance_reduction' in summary_df.columns:
+        return 1 - summary_df['variance_reduction'].to_numpy(dtype=float)
+    return np.ones(len(summary_df))
+
+
+#Let's start with getting the power for each of our experiments
+#The *_from_results functions take one or many rows of results_summary and return plain numbers for one row, arrays for many
+def calculate_statistical_power_from_results(summary_df, alpha=0.05):
+    p1 = summary_df['control_rate'].to_numpy()
+    p2 = summary_df['treatment_rate'].to_numpy()
+    effect_size = cohens_h(p1, p2)
+    control_n = summary_df['control_size'].to_numpy()
+    treatment_n = summary_df['treatment_size'].to_numpy()
+    ratio = treatment_n / control_n
+    #Maybe change the ratio here too
+    power = power_from_effect_size(effect_size, control_n / _variance_factor(summary_df), alpha, ratio)
+    return power.item() if len(summary_df) == 1 else power
+
+
+#Now let's try and get the number of users we would need to detect a lift(sample size)
+def calculate_sample_users_from_results(summary_df, power=0.8, alpha=0.05):
+    """
+    Calculates the number of users per group required to detect a lift, the total number of users based on the ratio and the multiplier to reach
+    the required users per group
+    """
+    p1 = summary_df['control_rate'].to_numpy()
+    p2 = summary_df['treatment_rate'].to_numpy()
+    control_n = summary_df['control_size'].to_numpy()
+    treatment_n = summary_df['treatment_size'].to_numpy()
+    effect_size = cohens_h(p1, p2)
+    ratio = treatment_n / control_n
+
+    required_users = np.round(sample_size_from_effect_size(effect_size, power, alpha, ratio) * _variance_factor(summary_df))
+    total_required = np.round(required_users * (1 + ratio))
+    multiplier = np.round(required_users / control_n, 1)
+
+    if len(summary_df) == 1:
+        return int(required_users[0]), int(total_required[0]), float(multiplier[0])
+    return required_users.astype(int), total_required.astype(int), multiplier
+
+
+#Now it's time to work on an effect size calculator for a minimum detectable effect
+
+
+#CHANGE THIS. YOU'RE IMPROVING A BIT
+#This seems right. effect_size is an arbitrary value that people don't really use when talking
+#MDE is used to get the lift you actually want to detect and that is mde_relative_lift
+def calculate_minimum_detectable_effect_from_results(summary_df, power=0.8, alpha=0.05):
+    """
+    Calculates the minimum lift you could have detected from control conversion to treatment conversion 
+    With a variance_reduction column (CUPED results) the MDE is the one the adjusted test can detect
+    """
+    control_rate = summary_df['control_rate'].to_numpy()
+    treatment_rate = summary_df['treatment_rate'].to_numpy()
+    control_n = summary_df['control_size'].to_numpy()
+    treatment_n = summary_df['treatment_size'].to_numpy()
+    ratio = treatment_n / control_n
+
+    effect_size = effect_size_from_sample_size(control_n / _variance_factor(summary_df), power, alpha, ratio)
+    mde_treatment_rate = rate_from_cohens_h(control_rate, effect_size)
+    mde_relative_lift = (mde_treatment_rate - control_rate) / control_rate * 100
+
+    return _to_output({
+        'effect_size': effect_size,
+        'baseline_rate': control_rate, #Control rate
+        'mde_treatment_rate': mde_treatment_rate,  # THEORETICAL minimum
+        'mde_relative_lift_pct': mde_relative_lift,  # MDE as %
+        'actual_treatment_rate': treatment_rate,  # ACTUAL from data
+        'actual_lift_pct': summary_df['lift_percent'].to_numpy(),  # ACTUAL lift
+        'sample_size': control_n
+    }, len(summary_df) == 1)
+
+
+#All three of the above for a whole results_summary table at once, one row per experiment
+def analyze_power_from_results(summary_df, power=0.8, alpha=0.05):
+    """
+    Returns a copy of summary_df with the achieved power, the users needed for the target power and the MDE added to every row
+    """
+    analysis_df = summary_df.reset_index(drop=True)
+    required_users, total_required, multiplier = calculate_sample_users_from_results(analysis_df, power, alpha)
+    mde = calculate_minimum_detectable_effect_from_results(analysis_df, power, alpha)
+
+    analysis_df['power'] = np.atleast_1d(calculate_statistical_power_from_results(analysis_df, alpha))
+    analysis_df['required_users_per_group'] = np.atleast_1d(required_users)
+    analysis_df['total_required_users'] = np.atleast_1d(total_required)
+    analysis_df['users_multiplier'] = np.atleast_1d(multiplier)
+    analysis_df['mde_effect_size'] = np.atleast_1d(mde['effect_size'])
+    analysis_df['mde_treatment_rate'] = np.atleast_1d(mde['mde_treatment_rate'])
+    analysis_df['mde_relative_lift_pct'] = np.atleast_1d(mde['mde_relative_lift_pct'])
+    analysis_df['well_powered'] = analysis_df['lift_percent'].abs() >= analysis_df['mde_relative_lift_pct'].abs()
+    return analysis_df
+
+
+#Good work. Now time to create functions for calculating power, sample size and minimum detectable effect for values inputted by users.
+#For these , probably leave alpha as a default of 0.05
+#They also take arrays, in which case every value in the returned dict (interpretations included) is an array
+def calculate_power(baseline_rate, expected_lift, sample_size, alpha=0.05, ratio=1.0):
+    """
+    Calculates statistical power for a planned A/B test
+    Assumptions: The ratio of control size to treatment size is 1:1 unless ratio says otherwise
+    """
+    scalar = all(np.ndim(value) == 0 for value in (baseline_rate, expected_lift, sample_size, alpha, ratio))
+    baseline_rate, expected_lift, sample_size, alpha, ratio = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (baseline_rate, expected_lift, sample_size, alpha, ratio)))
+
+    treatment_rate = baseline_rate * (1 + expected_lift)
+    effect_size = cohens_h(baseline_rate, treatment_rate)
+
+    power = power_from_effect_size(effect_size, sample_size, alpha, ratio)
+
+    interpretation = np.select([power >= 0.80, power >= 0.60], [
+        "Good power! You have a high chance of detecting this effect.",
+        "Moderate power. You might detect the effect, but you won't have a high chance of doing so.",
+    ], "Low power! High chance of missing the effect even if it exists.")
+    recommendation = np.select([power >= 0.80, power >= 0.60], [
+        "Proceed with the test.",
+        "Consider running longer or testing a bigger effect.",
+    ], "Increase sample size or test larger changes.")
+
+    return _to_output({
+        'baseline_rate': baseline_rate,
+        'treatment_rate': treatment_rate,
+        'expected_lift': expected_lift,
+        'absolute_lift': treatment_rate - baseline_rate,
+        'sample_size': sample_size,
+        'total_users': sample_size * (1 + ratio),
+        'effect_size': effect_size,
+        'power': power,
+        'alpha': alpha,
+        'interpretation': interpretation,
+        'recommendation': recommendation
+    }, scalar)
+
+def calculate_sample_size(baseline_rate, expected_lift,power=0.8, alpha=0.05, ratio=1.0):
+    """
+    Calculate number of required users for the user's for detecting a lift from a particular baseline rate
+    Assuming equal grpups for control and treatment unless ratio says otherwise
+    """
+    scalar = all(np.ndim(value) == 0 for value in (baseline_rate, expected_lift, power, alpha, ratio))
+    baseline_rate, expected_lift, power, alpha, ratio = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (baseline_rate, expected_lift, power, alpha, ratio)))
+
+    treatment_rate = baseline_rate * (1 + expected_lift)
+    effect_size = cohens_h(baseline_rate, treatment_rate)
+
+    required_users_per_group = np.ceil(sample_size_from_effect_size(effect_size, power, alpha, ratio))
+    total_users = np.ceil(required_users_per_group * (1 + ratio))
+    
+    interpretation = np.select([total_users <= 2000, total_users <= 20000], [
+        (
+            "Small–moderate sample size. This test should be easy to run "
+            "if you have steady traffic."
+        ),
+        (
+            "Moderate–large sample size. You’ll need decent traffic or a longer test duration."
+        ),
+    ], (
+        "Very large required sample size. With this baseline and expected lift, "
+        "the test needs a lot of users to reliably detect the effect."
+    ))
+    recommendation = np.select([total_users <= 2000, total_users <= 20000], [
+        (
+            "You can likely proceed with this design as-is."
+        ),
+        (
+            "Make sure your traffic volume and test duration are sufficient; "
+            "consider slightly larger lifts if this is hard to reach."
+        ),
+    ], (
+        "Consider one or more of: (1) testing a larger expected lift, "
+        "(2) relaxing the power requirement, or (3) running the test for longer."
+    ))
+
+
+    return _to_output({
+        'baseline_rate': baseline_rate,
+        'treatment_rate': treatment_rate,
+        'expected_lift': expected_lift,
+        'absolute_lift': treatment_rate - baseline_rate,
+        'effect_size': effect_size,
+        'alpha': alpha,
+        'required_sample_per_group': required_users_per_group,
+        'total_required_users': total_users,
+        'interpretation': interpretation,
+        'recommendation': recommendation,
+    }, scalar)
+
+def calculate_minimum_detectable_effect(baseline_rate,expected_lift,sample_size,power=0.8,alpha=0.05, ratio=1.0):
+    """
+    Calculates the effect size and minimum detectable effect
+    """
+    scalar = all(np.ndim(value) == 0 for value in (baseline_rate, expected_lift, sample_size, power, alpha, ratio))
+    baseline_rate, expected_lift, sample_size, power, alpha, ratio = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (baseline_rate, expected_lift, sample_size, power, alpha, ratio)))
+
+    treatment_rate = baseline_rate * (1 + expected_lift)
+
+
+    effect_size = effect_size_from_sample_size(sample_size, power, alpha, ratio)
+    
+    mde_treatment_rate = rate_from_cohens_h(baseline_rate, effect_size)
+    mde_relative_lift = (mde_treatment_rate - baseline_rate) / baseline_rate * 100
+
+    expected_relative_lift_pct = expected_lift * 100
+    absolute_lift_expected = treatment_rate - baseline_rate
+
+    sensitivity_label = np.select([effect_size < 0.2, effect_size < 0.5, effect_size < 0.8], [
+        "very high – can detect tiny effects",
+        "high – can detect small effects",
+        "moderate – best for medium-sized effects",
+    ], "low – only large effects are detectable")
+
+    detectable = expected_relative_lift_pct >= mde_relative_lift
+    interpretation = np.where(detectable, (
+        "Your expected lift is larger than the minimum detectable effect. "
+        "This design should have roughly the requested power to detect the effect."
+    ), (
+        "Your expected lift is smaller than the minimum detectable effect. "
+        "There is a high chance this test will miss the effect even if it exists."
+    ))
+    recommendation = np.where(detectable, (
+        "Proceed with this sample size, or increase it if you also want sensitivity "
+        "to smaller lifts."
+    ), (
+        "Increase the sample size, accept a larger detectable lift, or relax the "
+        "power requirement if that’s acceptable."
+    ))
+
+    return _to_output({
+        'baseline_rate': baseline_rate,
+        'expected_treatment_rate': treatment_rate,
+        'expected_lift': expected_lift,
+        'expected_relative_lift_pct': expected_relative_lift_pct,
+        'absolute_lift_expected': absolute_lift_expected,
+
+        'effect_size_required': effect_size,       # Cohen's h
+        'mde_treatment_rate': mde_treatment_rate,           # min detectable rate
+        'mde_relative_lift_pct': mde_relative_lift,     # MDE in %
+
+        'sample_size_per_group': sample_size,# Make sure to include per group here
+        'total_users': sample_size * (1 + ratio),
+        'target_power': power,
+        'alpha': alpha,
+
+        'sensitivity_label': sensitivity_label,
+        'interpretation': interpretation,
+        'recommendation': recommendation,
+    }, scalar)
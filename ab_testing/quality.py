@@ -0,0 +1,384 @@
+"""
+Data-quality checks computed while the loader brings the CSVs in: sample ratio mismatch, duplicate assignments,
+sessions before (or outside) the user's assignment, and daily_metrics against the sessions. Everything the checks
+need is reduced to per-(experiment_id, variant, day) counts, kept in SQLite next to the tables they come from:
+
+- data_quality_first_assignments: each (experiment, user)'s first assignment, how many it had and whether they
+  switched variant. The lookup the session checks join against, rebuilt when experiment_assignments changes.
+- data_quality_assignment_counts: first assignments, duplicated and switched users per cell.
+- data_quality_session_counts: sessions, and those before the assignment, from unassigned users or in another
+  variant, per cell. Appended sessions are joined and added on their own, so a load costs O(new sessions).
+- daily_metrics' reported users and conversions are compared with the daily conversion rollups.
+
+DataQualityAccumulator turns the counts into checks, so its memory is bounded by experiments x variants x days
+however many sessions there are. Results live in the data_quality_checks table, one row per experiment and check.
+"""
+import sqlite3
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from .rollups import ROLLUP_TABLE
+
+QUALITY_TABLE = "data_quality_checks"
+FIRST_ASSIGNMENTS_TABLE = "data_quality_first_assignments"
+ASSIGNMENT_COUNTS_TABLE = "data_quality_assignment_counts"
+SESSION_COUNTS_TABLE = "data_quality_session_counts"
+QUALITY_STATE_TABLE = "data_quality_state"
+#Tables the checks read, in the loader's order
+QUALITY_SOURCES = ["experiment_assignments", "user_sessions", "daily_metrics"]
+QUALITY_COLUMNS = {
+    "experiment_assignments": ["experiment_id", "user_id", "variant", "assignment_date"],
+    "user_sessions": ["experiment_id", "user_id", "variant", "session_date", "converted"],
+    "daily_metrics": ["date", "experiment_id", "variant", "total_users", "total_conversions"],
+}
+#Every cell is keyed by (experiment_id, variant, day), day an ISO date
+COUNT_KEYS = ["experiment_id", "variant", "day"]
+COUNT_COLUMNS = {
+    "assignments": ["users", "duplicated", "switched"],
+    "sessions": ["sessions", "before_assignment", "unassigned", "mismatched"],
+    "daily": ["reported_users", "reported_conversions", "observed_users", "observed_conversions"],
+}
+#Every experiment has a control and at least one other arm. An experiment's expected arms are these plus every variant
+#any source (assignments, sessions, daily_metrics) has for it, so an arm that got no users still counts against the split
+CONTROL_ARM = "control"
+DEFAULT_TREATMENT_ARM = "treatment"
+#An SRM p-value this small fails the experiment; the usual threshold, since a real imbalance gives tiny p-values quickly
+SRM_ALPHA = 0.001
+#'fail' means the experiment's results can't be trusted, 'warn' that something upstream disagrees and needs a look
+CHECK_SEVERITY = {
+    "sample_ratio_mismatch": "fail",
+    "duplicate_assignments": "fail",
+    "sessions_before_assignment": "fail",
+    "session_variant_mismatch": "fail",
+    "daily_metrics_consistency": "warn",
+}
+
+FIRST_ASSIGNMENTS_SQL = f"""
+    INSERT INTO {FIRST_ASSIGNMENTS_TABLE} (experiment_id, user_id, variant, day, assignments, switched)
+    SELECT experiment_id, user_id, variant, day, assignments, switched
+    FROM (
+        SELECT
+            experiment_id,
+            user_id,
+            variant,
+            assignment_date AS day,
+            ROW_NUMBER() OVER (PARTITION BY experiment_id, user_id ORDER BY assignment_date, rowid) AS position,
+            COUNT(*) OVER user_rows AS assignments,
+            MIN(variant) OVER user_rows <> MAX(variant) OVER user_rows AS switched
+        FROM experiment_assignments
+        WINDOW user_rows AS (PARTITION BY experiment_id, user_id)
+    )
+    WHERE position = 1
+"""
+ASSIGNMENT_COUNTS_SQL = f"""
+    INSERT INTO {ASSIGNMENT_COUNTS_TABLE} (experiment_id, variant, day, users, duplicated, switched)
+    SELECT experiment_id, variant, day, COUNT(*), SUM(assignments > 1), SUM(switched)
+    FROM {FIRST_ASSIGNMENTS_TABLE}
+    GROUP BY experiment_id, variant, day
+"""
+#Sessions after the given rowid, joined to their user's first assignment and added to the cells
+SESSION_COUNTS_SQL = f"""
+    INSERT INTO {SESSION_COUNTS_TABLE} (experiment_id, variant, day, sessions, before_assignment, unassigned, mismatched)
+    SELECT
+        s.experiment_id,
+        s.variant,
+        s.session_date,
+        COUNT(*),
+        SUM(a.user_id IS NOT NULL AND s.session_date < a.day),
+        SUM(a.user_id IS NULL),
+        SUM(a.user_id IS NULL OR a.variant <> s.variant)
+    FROM user_sessions s
+    LEFT JOIN {FIRST_ASSIGNMENTS_TABLE} a ON a.experiment_id = s.experiment_id AND a.user_id = s.user_id
+    WHERE s.rowid > ?
+    GROUP BY s.experiment_id, s.variant, s.session_date
+    ON CONFLICT (experiment_id, variant, day) DO UPDATE SET
+        sessions = sessions + excluded.sessions,
+        before_assignment = before_assignment + excluded.before_assignment,
+        unassigned = unassigned + excluded.unassigned,
+        mismatched = mismatched + excluded.mismatched
+"""
+REPORTED_DAILY_SQL = """
+    SELECT experiment_id, variant, date AS day, SUM(total_users) AS reported_users, SUM(total_conversions) AS reported_conversions
+    FROM daily_metrics
+    GROUP BY experiment_id, variant, date
+"""
+OBSERVED_DAILY_SQL = f"""
+    SELECT experiment_id, variant, time_period AS day, users AS observed_users, converting_users AS observed_conversions
+    FROM {ROLLUP_TABLE}
+    WHERE grain = 'daily'
+"""
+
+
+def first_assignments(assignments_df):
+    """
+    The FIRST_ASSIGNMENTS_TABLE rows from an experiment_assignments frame, for when the data isn't in SQLite
+    """
+    ordered = assignments_df.assign(day=pd.to_datetime(assignments_df["assignment_date"]).dt.strftime("%Y-%m-%d"))
+    ordered = ordered.sort_values(["experiment_id", "user_id", "day"], kind="stable")
+    users = ordered.groupby(["experiment_id", "user_id"], sort=False)
+    first = users[["variant", "day"]].first()
+    first["assignments"] = users.size()
+    first["switched"] = (users["variant"].nunique() > 1).astype(np.int64)
+    return first.reset_index()
+
+
+def assignment_counts(first_assignments_df):
+    """
+    ASSIGNMENT_COUNTS_SQL on a first_assignments() frame
+    """
+    return first_assignments_df.assign(duplicated=first_assignments_df["assignments"] > 1).groupby(COUNT_KEYS, as_index=False).agg(
+        users=("user_id", "size"), duplicated=("duplicated", "sum"), switched=("switched", "sum")
+    )
+
+
+def session_counts(sessions_df, first_assignments_df):
+    """
+    SESSION_COUNTS_SQL on a frame of sessions and a first_assignments() frame
+    """
+    sessions = sessions_df.assign(day=pd.to_datetime(sessions_df["session_date"]).dt.strftime("%Y-%m-%d"))
+    joined = sessions.merge(
+        first_assignments_df[["experiment_id", "user_id", "variant", "day"]],
+        on=["experiment_id", "user_id"], how="left", suffixes=("", "_assigned"),
+    )
+    assigned = joined["variant_assigned"].notna()
+    return joined.assign(
+        sessions=1,
+        before_assignment=assigned & (joined["day"] < joined["day_assigned"]),
+        unassigned=~assigned,
+        mismatched=~assigned | (joined["variant"] != joined["variant_assigned"]),
+    ).groupby(COUNT_KEYS, as_index=False)[COUNT_COLUMNS["sessions"]].sum()
+
+
+class DataQualityAccumulator:
+    """
+    Add per-(experiment_id, variant, day) counts with add_counts() in as many pieces as you like, then read the checks
+    from results()
+    """
+
+    def __init__(self, expected_shares=None, arms=None):
+        #variant -> expected share of users; an even split between each experiment's arms by default
+        self.expected_shares = expected_shares
+        #experiment_id -> declared arms, for experiments whose arms are known up front
+        self.arms = arms or {}
+        self._counts = {kind: None for kind in COUNT_COLUMNS}
+
+    def add_counts(self, kind: str, counts_df: pd.DataFrame):
+        """
+        Adds counts_df (COUNT_KEYS and some of COUNT_COLUMNS[kind], missing ones count as 0) to the cells of one kind:
+        'assignments', 'sessions' or 'daily'
+        """
+        if len(counts_df) == 0:
+            return
+        columns = COUNT_COLUMNS[kind]
+        counts = counts_df.reindex(columns=[*COUNT_KEYS, *columns])
+        counts[columns] = counts[columns].fillna(0).astype(np.int64)
+        counts["day"] = counts["day"].astype(str).str[:10]
+        if self._counts[kind] is not None:
+            counts = pd.concat([self._counts[kind], counts], ignore_index=True)
+        #Summed per cell every time, so the state never grows past one row per cell
+        self._counts[kind] = counts.groupby(COUNT_KEYS, as_index=False)[columns].sum()
+
+    def _expected_arms(self):
+        """
+        experiment_id -> sorted expected arms: control, the declared arms (or the shares' arms) and every variant any
+        source has for the experiment, plus a treatment arm if that leaves control on its own
+        """
+        seen = pd.concat([counts[["experiment_id", "variant"]] for counts in self._counts.values() if counts is not None])
+        shared = [variant for variant, share in (self.expected_shares or {}).items() if share > 0]
+        arms = {}
+        for experiment_id, variants in seen.groupby("experiment_id")["variant"]:
+            expected = {CONTROL_ARM, *self.arms.get(int(experiment_id), ()), *shared, *variants}
+            if len(expected) < 2:
+                expected.add(DEFAULT_TREATMENT_ARM)
+            arms[int(experiment_id)] = sorted(expected)
+        return arms
+
+    def results(self) -> pd.DataFrame:
+        """
+        One row per (experiment_id, check_name) with status ('pass', 'warn' or 'fail'), value and a readable detail
+        """
+        from scipy import stats
+
+        rows = []
+
+        def add(experiment_ids, check_name, failed, values, details):
+            for experiment_id, is_failed, value, detail in zip(experiment_ids, failed, values, details):
+                status = CHECK_SEVERITY[check_name] if is_failed else "pass"
+                rows.append((int(experiment_id), check_name, status, float(value), detail))
+
+        assignments = self._counts["assignments"]
+        if assignments is not None:
+            #Sample ratio mismatch: chi-square of users per arm against the expected split, over all of the
+            #experiment's arms, so an arm that got no users at all fails instead of dropping out of the test
+            users = assignments.groupby(["experiment_id", "variant"])["users"].sum()
+            expected_arms = self._expected_arms()
+            experiment_ids = users.index.get_level_values("experiment_id").unique().sort_values()
+            weights = self.expected_shares or {}
+            p_values, chi_squares, details = [], [], []
+            for experiment_id in experiment_ids:
+                arms = expected_arms[int(experiment_id)]
+                observed = users.loc[experiment_id].reindex(arms, fill_value=0).to_numpy(dtype=float)
+                shares = np.array([weights.get(arm, 0.0) for arm in arms]) if self.expected_shares else np.ones(len(arms))
+                expected = shares / shares.sum() * observed.sum()
+                #Users in an arm that shouldn't have any make the split impossible under H0
+                if np.any((expected == 0) & (observed > 0)):
+                    chi_square = np.inf
+                else:
+                    in_test = expected > 0
+                    chi_square = float(((observed[in_test] - expected[in_test]) ** 2 / expected[in_test]).sum())
+                p_value = float(stats.chi2.sf(chi_square, max(int((expected > 0).sum()) - 1, 1)))
+                chi_squares.append(chi_square)
+                p_values.append(p_value)
+                details.append(
+                    ", ".join(f"{arm} {int(count)}" for arm, count in zip(arms, observed)) + f" (chi-square {chi_square:.2f}, p = {p_value:.3g})"
+                )
+            add(experiment_ids, "sample_ratio_mismatch", np.array(p_values) < SRM_ALPHA, p_values, details)
+
+            per_experiment = assignments.groupby("experiment_id")[["duplicated", "switched"]].sum()
+            add(per_experiment.index, "duplicate_assignments", per_experiment["duplicated"] > 0, per_experiment["duplicated"], [
+                f"{int(row.duplicated)} users assigned more than once, {int(row.switched)} of them to different variants"
+                for row in per_experiment.itertuples()
+            ])
+
+        sessions = self._counts["sessions"]
+        if sessions is not None:
+            per_experiment = sessions.groupby("experiment_id")[COUNT_COLUMNS["sessions"]].sum()
+            add(per_experiment.index, "sessions_before_assignment", per_experiment["before_assignment"] > 0, per_experiment["before_assignment"],
+                [f"{int(row.before_assignment)} of {int(row.sessions)} sessions dated before the user's assignment" for row in per_experiment.itertuples()])
+            add(per_experiment.index, "session_variant_mismatch", per_experiment["mismatched"] > 0, per_experiment["mismatched"], [
+                f"{int(row.mismatched - row.unassigned)} sessions in another variant than the user's assignment, {int(row.unassigned)} from unassigned users"
+                for row in per_experiment.itertuples()
+            ])
+
+        daily = self._counts["daily"]
+        if daily is not None:
+            user_gap = (daily["reported_users"] - daily["observed_users"]).abs()
+            conversion_gap = (daily["reported_conversions"] - daily["observed_conversions"]).abs()
+            cells = daily.assign(differs=(user_gap > 0) | (conversion_gap > 0), user_gap=user_gap, conversion_gap=conversion_gap)
+            per_experiment = cells.groupby("experiment_id").agg(
+                cells=("differs", "size"), differs=("differs", "sum"), user_gap=("user_gap", "max"), conversion_gap=("conversion_gap", "max")
+            )
+            add(per_experiment.index, "daily_metrics_consistency", per_experiment["differs"] > 0, per_experiment["differs"], [
+                f"{int(row.differs)} of {int(row.cells)} (day, variant) cells differ from the sessions: users off by up to "
+                f"{int(row.user_gap)}, conversions by up to {int(row.conversion_gap)}"
+                for row in per_experiment.itertuples()
+            ])
+
+        return pd.DataFrame(rows, columns=["experiment_id", "check_name", "status", "value", "detail"]).sort_values(
+            ["experiment_id", "check_name"], kind="stable"
+        ).reset_index(drop=True)
+
+
+def create_count_tables(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {FIRST_ASSIGNMENTS_TABLE} ("
+        "experiment_id INTEGER NOT NULL, user_id INTEGER NOT NULL, variant TEXT, day TEXT, assignments INTEGER NOT NULL, "
+        "switched INTEGER NOT NULL, PRIMARY KEY (experiment_id, user_id)) WITHOUT ROWID"
+    )
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {ASSIGNMENT_COUNTS_TABLE} ("
+        "experiment_id INTEGER NOT NULL, variant TEXT NOT NULL, day TEXT NOT NULL, users INTEGER NOT NULL, "
+        "duplicated INTEGER NOT NULL, switched INTEGER NOT NULL, PRIMARY KEY (experiment_id, variant, day)) WITHOUT ROWID"
+    )
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {SESSION_COUNTS_TABLE} ("
+        "experiment_id INTEGER NOT NULL, variant TEXT NOT NULL, day TEXT NOT NULL, sessions INTEGER NOT NULL, "
+        "before_assignment INTEGER NOT NULL, unassigned INTEGER NOT NULL, mismatched INTEGER NOT NULL, "
+        "PRIMARY KEY (experiment_id, variant, day)) WITHOUT ROWID"
+    )
+    #Newest rowid of each source the counts cover
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {QUALITY_STATE_TABLE} (source TEXT PRIMARY KEY, max_rowid INTEGER)")
+
+
+def _table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone() is not None
+
+
+def _watermark(conn: sqlite3.Connection, source: str):
+    state = conn.execute(f"SELECT max_rowid FROM {QUALITY_STATE_TABLE} WHERE source = ?", (source,)).fetchone()
+    return None if state is None else state[0] or 0
+
+
+def _set_watermark(conn: sqlite3.Connection, source: str):
+    conn.execute(f'INSERT OR REPLACE INTO {QUALITY_STATE_TABLE} (source, max_rowid) SELECT ?, MAX(rowid) FROM "{source}"', (source,))
+
+
+def refresh_quality_counts(conn: sqlite3.Connection, statuses: dict):
+    """
+    Brings the count tables up to date after a load. statuses is the loader's {table_name: 'skipped' | 'appended' |
+    'replaced'}: a changed experiment_assignments rebuilds the assignment lookup and every session count, replaced
+    sessions are counted again from scratch and appended ones are joined and added on their own. Must be called
+    inside a transaction
+    """
+    create_count_tables(conn)
+    has_assignments = _table_exists(conn, "experiment_assignments")
+    rebuild_sessions = statuses.get("user_sessions") == "replaced"
+    if has_assignments and (statuses.get("experiment_assignments", "skipped") != "skipped" or _watermark(conn, "experiment_assignments") is None):
+        conn.execute(f"DELETE FROM {FIRST_ASSIGNMENTS_TABLE}")
+        conn.execute(f"DELETE FROM {ASSIGNMENT_COUNTS_TABLE}")
+        conn.execute(FIRST_ASSIGNMENTS_SQL)
+        conn.execute(ASSIGNMENT_COUNTS_SQL)
+        _set_watermark(conn, "experiment_assignments")
+        #Sessions are judged against the assignments, so they all need judging again
+        rebuild_sessions = True
+
+    if has_assignments and _table_exists(conn, "user_sessions"):
+        watermark = _watermark(conn, "user_sessions")
+        if rebuild_sessions or watermark is None:
+            conn.execute(f"DELETE FROM {SESSION_COUNTS_TABLE}")
+            watermark = 0
+        conn.execute(SESSION_COUNTS_SQL, (watermark,))
+        _set_watermark(conn, "user_sessions")
+
+
+def read_quality_counts(conn: sqlite3.Connection, expected_shares=None) -> DataQualityAccumulator:
+    """
+    A DataQualityAccumulator holding every stored count: the assignment and session cells, and daily_metrics
+    against the daily rollups
+    """
+    quality = DataQualityAccumulator(expected_shares)
+    for kind, table_name in (("assignments", ASSIGNMENT_COUNTS_TABLE), ("sessions", SESSION_COUNTS_TABLE)):
+        if _table_exists(conn, table_name):
+            quality.add_counts(kind, pd.read_sql_query(f"SELECT * FROM {table_name}", conn))
+    #The sessions' side of the daily comparison is the daily rollups, so it needs both
+    if _table_exists(conn, "daily_metrics") and _table_exists(conn, ROLLUP_TABLE):
+        quality.add_counts("daily", pd.read_sql_query(REPORTED_DAILY_SQL, conn))
+        quality.add_counts("daily", pd.read_sql_query(OBSERVED_DAILY_SQL, conn))
+    return quality
+
+
+def create_quality_table(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {QUALITY_TABLE} ("
+        "experiment_id INTEGER NOT NULL, check_name TEXT NOT NULL, status TEXT NOT NULL, value REAL, detail TEXT, "
+        "checked_at TEXT NOT NULL, PRIMARY KEY (experiment_id, check_name))"
+    )
+
+
+def write_quality_checks(conn: sqlite3.Connection, checks_df: pd.DataFrame, checked_at=None):
+    """
+    Replaces the stored checks with checks_df (DataQualityAccumulator.results()). Must be called inside a transaction
+    """
+    if checked_at is None:
+        checked_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    create_quality_table(conn)
+    conn.execute(f"DELETE FROM {QUALITY_TABLE}")
+    conn.executemany(
+        f"INSERT INTO {QUALITY_TABLE} (experiment_id, check_name, status, value, detail, checked_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [(*row, checked_at) for row in checks_df[["experiment_id", "check_name", "status", "value", "detail"]].itertuples(index=False)],
+    )
+
+
+def read_quality_checks(conn: sqlite3.Connection, experiment_id=None) -> pd.DataFrame:
+    """
+    The stored checks, optionally for one experiment (empty if the loader hasn't run the checks yet)
+    """
+    create_quality_table(conn)
+    query = f"SELECT experiment_id, check_name, status, value, detail, checked_at FROM {QUALITY_TABLE}"
+    params = ()
+    if experiment_id is not None:
+        query += " WHERE experiment_id = ?"
+        params = (experiment_id,)
+    return pd.read_sql_query(query + " ORDER BY experiment_id, check_name", conn, params=params)
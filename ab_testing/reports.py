@@ -0,0 +1,184 @@
+"""
+Headless batch export of one report per experiment: the dashboard's metric tiles, conversion rates over time, the CI
+plots and the power/MDE verdicts, rendered from the results store and the conversion rollups to static files.
+
+Each experiment's inputs are hashed into a fingerprint, and output_dir/manifest.json remembers the fingerprint every
+report was rendered from, so a rerun only re-renders experiments whose data (or the report options) changed.
+Rendering runs on a process pool. Static formats (png, svg, pdf) go through kaleido, which needs Chrome; html needs
+neither.
+"""
+import hashlib
+import html
+import json
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+from .results_store import LATEST_RESULTS_VIEW
+from .rollups import ROLLUP_TABLE
+
+MANIFEST_NAME = "manifest.json"
+INDEX_NAME = "index.html"
+#Bump when the report layout changes, so every report is re-rendered once
+REPORT_VERSION = 1
+REPORT_FORMATS = ("png", "svg", "pdf", "html")
+#Columns that change on every analysis run without the data changing
+VOLATILE_COLUMNS = ["run_at"]
+
+
+def load_report_data(conn: sqlite3.Connection, grain="weekly"):
+    """
+    {experiment_id: (latest results row, conversion rollup rows for grain)} for every analyzed experiment, in two queries
+    """
+    results_df = pd.read_sql_query(f"SELECT * FROM {LATEST_RESULTS_VIEW} ORDER BY experiment_id", conn)
+    rollups_df = pd.read_sql_query(
+        "SELECT experiment_id, time_period, variant, users, converting_users, 1.0 * converting_users / users AS conversion_rate "
+        f"FROM {ROLLUP_TABLE} WHERE grain = ? ORDER BY experiment_id, time_period, variant",
+        conn,
+        params=(grain,),
+    )
+    rollups = {experiment_id: rows.drop(columns="experiment_id").reset_index(drop=True) for experiment_id, rows in rollups_df.groupby("experiment_id")}
+    empty_rollups = rollups_df.drop(columns="experiment_id").iloc[:0]
+    return {
+        int(row["experiment_id"]): (row, rollups.get(row["experiment_id"], empty_rollups))
+        for _, row in results_df.iterrows()
+    }
+
+
+def report_fingerprint(results_row, rollups_df, options):
+    """
+    Hash of everything a report is drawn from, plus the options it's rendered with
+    """
+    digest = hashlib.sha256(json.dumps({"version": REPORT_VERSION, **options}, sort_keys=True).encode())
+    digest.update(results_row.drop(VOLATILE_COLUMNS, errors="ignore").to_json().encode())
+    digest.update(rollups_df.to_csv(index=False).encode())
+    return digest.hexdigest()
+
+
+def _report_dir_name(experiment_id, experiment_name):
+    return f"{experiment_id}_{re.sub(r'[^A-Za-z0-9_-]+', '_', str(experiment_name))}"
+
+
+def _render_report(task):
+    """
+    Worker: draws one experiment's figures and writes them in every format. Returns the written paths, relative to output_dir
+    """
+    #Imported here so the parent process doesn't pay for plotly unless it renders too
+    from .figures import confidence_interval_figure, conversion_rates_figure, report_figure
+
+    experiment_id, results_row, rollups_df, output_dir, formats, grain = task
+    period_label = f"{grain.title()} period"
+    name = results_row["experiment_name"]
+    #The full page, and the two charts on their own for slides
+    figures = {
+        "report": report_figure(results_row, rollups_df, f"{name.replace('_', ' ').title()} (experiment {experiment_id})", period_label),
+        "conversion_rates": conversion_rates_figure(rollups_df, period_label),
+        "confidence_intervals": confidence_interval_figure(results_row),
+    }
+    report_dir = Path(output_dir) / _report_dir_name(experiment_id, name)
+    report_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for figure_name, fig in figures.items():
+        for file_format in formats:
+            path = report_dir / f"{figure_name}.{file_format}"
+            if file_format == "html":
+                fig.write_html(path, include_plotlyjs="cdn")
+            else:
+                fig.write_image(path, format=file_format)
+            files.append(path.relative_to(output_dir).as_posix())
+    return experiment_id, files
+
+
+def _read_manifest(output_dir):
+    path = Path(output_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    return {int(experiment_id): entry for experiment_id, entry in json.loads(path.read_text(encoding="utf-8")).items()}
+
+
+def _write_index(output_dir, data, manifest, formats):
+    """
+    A stakeholder index page: one row per experiment with its headline numbers, verdict and links to its files
+    """
+    from .figures import verdicts
+
+    preview = next((file_format for file_format in ("png", "svg") if file_format in formats), None)
+    rows = []
+    for experiment_id, (results_row, _) in data.items():
+        entry = manifest[experiment_id]
+        links = " ".join(f'<a href="{file}">{Path(file).name}</a>' for file in entry["files"] if Path(file).stem == "report")
+        image = f'<br><img src="{Path(entry["files"][0]).parent.as_posix()}/report.{preview}" width="400">' if preview else ""
+        rows.append(
+            f"<tr><td>{experiment_id}</td><td>{html.escape(str(results_row['experiment_name']))}</td><td>{results_row['lift_percent']:+.2f}%</td>"
+            f"<td>{results_row['p_value']:.4g}</td><td>{'<br>'.join(verdicts(results_row))}</td><td>{links}{image}</td></tr>"
+        )
+    generated_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    (Path(output_dir) / INDEX_NAME).write_text(
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Experiment reports</title></head><body>"
+        f"<h1>Experiment reports</h1><p>Generated {generated_at}</p>"
+        "<table border=\"1\" cellpadding=\"6\"><tr><th>ID</th><th>Experiment</th><th>Lift</th><th>p-value</th><th>Verdict</th><th>Report</th></tr>"
+        + "".join(rows)
+        + "</table></body></html>",
+        encoding="utf-8",
+    )
+
+
+def export_reports(db_path, output_dir, formats=("png", "pdf"), grain="weekly", workers=None, force=False):
+    """
+    Renders a report for every experiment in the results store whose fingerprint differs from the manifest's (all of
+    them with force), on workers processes, and rewrites the manifest and index.html.
+    Returns {experiment_id: 'rendered' | 'cached'}
+    """
+    unknown = set(formats) - set(REPORT_FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown report formats {sorted(unknown)}, expected some of {list(REPORT_FORMATS)}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(f"file:{Path(db_path).as_posix()}?mode=ro", uri=True)
+    try:
+        data = load_report_data(conn, grain)
+    finally:
+        conn.close()
+
+    options = {"formats": sorted(formats), "grain": grain}
+    manifest = _read_manifest(output_dir)
+    fingerprints = {experiment_id: report_fingerprint(results_row, rollups_df, options) for experiment_id, (results_row, rollups_df) in data.items()}
+    tasks = []
+    statuses = {}
+    for experiment_id, (results_row, rollups_df) in data.items():
+        entry = manifest.get(experiment_id)
+        up_to_date = (
+            not force
+            and entry is not None
+            and entry["fingerprint"] == fingerprints[experiment_id]
+            and all((output_dir / file).exists() for file in entry["files"])
+        )
+        if up_to_date:
+            statuses[experiment_id] = "cached"
+        else:
+            tasks.append((experiment_id, results_row, rollups_df, str(output_dir), list(formats), grain))
+
+    if workers is not None and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            rendered = list(pool.map(_render_report, tasks))
+    else:
+        rendered = [_render_report(task) for task in tasks]
+    rendered_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    for experiment_id, files in rendered:
+        old_files = set(manifest.get(experiment_id, {}).get("files", [])) - set(files)
+        #Files of a format that's no longer exported; only ever ones this exporter wrote
+        for file in old_files:
+            (output_dir / file).unlink(missing_ok=True)
+        manifest[experiment_id] = {"fingerprint": fingerprints[experiment_id], "files": files, "rendered_at": rendered_at}
+        statuses[experiment_id] = "rendered"
+    #Experiments no longer in the results store drop out of the manifest and the index
+    manifest = {experiment_id: entry for experiment_id, entry in manifest.items() if experiment_id in data}
+
+    (output_dir / MANIFEST_NAME).write_text(json.dumps({str(key): value for key, value in sorted(manifest.items())}, indent=2), encoding="utf-8")
+    _write_index(output_dir, data, manifest, formats)
+    return dict(sorted(statuses.items()))
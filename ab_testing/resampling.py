@@ -0,0 +1,240 @@
+"""
+Bootstrap and permutation tests for lift, done as batched NumPy operations instead of one Python loop per replicate.
+
+Everything works on "units": rows with a numerator and a denominator, the metric being sum(numerator) / sum(denominator).
+Users are units with numerator = converted (or revenue) and denominator = 1. Days from daily_metrics are units with
+numerator = total_revenue and denominator = total_users, which resamples whole days for revenue per user. An optional
+count column says how many identical units a row stands for.
+
+The bootstrap is a Poisson bootstrap (each unit gets a Poisson(1) weight per replicate), so units can be processed in
+blocks, and units with the same value can share one Poisson weight. Conversion units only take two distinct values,
+so for conversions the cost doesn't depend on the number of users at all. Replicates are split into fixed-size chunks
+with their own seeds, so a fixed seed gives the same answer whether the chunks run in one process or in a pool.
+resample_experiments starts one pool for all of its experiments and arms, since starting worker processes costs more
+than a chunk does.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+REPLICATES_PER_CHUNK = 250
+#Roughly how many weights (replicates x units) to hold in memory at once
+MAX_BLOCK_ELEMENTS = 1 << 22
+
+
+def conversion_units(sessions_df):
+    """
+    One unit per (experiment, variant, user): converted if any session converted
+    """
+    users = sessions_df.groupby(['experiment_id', 'variant', 'user_id'], sort=False, observed=True)['converted'].max()
+    units = users.reset_index()
+    return pd.DataFrame({
+        'experiment_id': units['experiment_id'],
+        'variant': units['variant'],
+        'numerator': units['converted'].astype(float),
+        'denominator': 1.0,
+    })
+
+
+def conversion_units_from_counts(counts_df):
+    """
+    The same units as conversion_units, built from an n/x counts frame (count_users_by_variant, SessionAggregator,
+    count_users_arrow): per arm one converted unit with count x and one non-converted unit with count n - x
+    """
+    counts = counts_df.reset_index()
+    return pd.DataFrame({
+        'experiment_id': np.repeat(counts['experiment_id'].to_numpy(), 2),
+        'variant': np.repeat(counts['variant'].to_numpy(), 2),
+        'numerator': np.tile([1.0, 0.0], len(counts)),
+        'denominator': 1.0,
+        'count': np.column_stack([counts['x'], counts['n'] - counts['x']]).ravel(),
+    })
+
+
+def revenue_units_from_sessions(sessions_df, revenue_column='revenue'):
+    """
+    One unit per (experiment, variant, user) with the user's total revenue
+    """
+    users = sessions_df.groupby(['experiment_id', 'variant', 'user_id'], sort=False, observed=True)[revenue_column].sum()
+    units = users.reset_index()
+    return pd.DataFrame({
+        'experiment_id': units['experiment_id'],
+        'variant': units['variant'],
+        'numerator': units[revenue_column].astype(float),
+        'denominator': 1.0,
+    })
+
+
+def revenue_units_from_daily_metrics(daily_metrics_df):
+    """
+    One unit per (experiment, variant, day): revenue per user, resampling days
+    """
+    return pd.DataFrame({
+        'experiment_id': daily_metrics_df['experiment_id'],
+        'variant': daily_metrics_df['variant'],
+        'numerator': daily_metrics_df['total_revenue'].astype(float),
+        'denominator': daily_metrics_df['total_users'].astype(float),
+    })
+
+
+def _collapse_units(numerator, denominator, count=None):
+    """
+    Distinct (numerator, denominator) pairs and how many units have each. Conversion units collapse to two rows
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    count = np.ones(len(numerator), dtype=np.int64) if count is None else np.asarray(count, dtype=np.int64)
+    pairs, inverse = np.unique(np.column_stack([numerator, denominator]), axis=0, return_inverse=True)
+    multiplicity = np.bincount(inverse.ravel(), weights=count, minlength=len(pairs)).astype(np.int64)
+    return pairs[:, 0].copy(), pairs[:, 1].copy(), multiplicity
+
+
+def _bootstrap_chunk(task):
+    """
+    Poisson bootstrap replicates of sum(numerator) / sum(denominator) for one arm. The sum of k Poisson(1) weights
+    is Poisson(k), so units that share a value get a single Poisson(multiplicity) weight between them
+    """
+    numerator, denominator, multiplicity, n_replicates, seed = task
+    rng = np.random.default_rng(seed)
+    numerator_sums = np.zeros(n_replicates)
+    denominator_sums = np.zeros(n_replicates)
+    block = max(1, MAX_BLOCK_ELEMENTS // n_replicates)
+    for start in range(0, len(numerator), block):
+        counts = multiplicity[start:start + block]
+        weights = rng.poisson(counts, size=(n_replicates, len(counts))).astype(np.float64)
+        numerator_sums += weights @ numerator[start:start + block]
+        denominator_sums += weights @ denominator[start:start + block]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return numerator_sums / denominator_sums
+
+
+def _permutation_chunk(task):
+    """
+    Treatment minus control metric with the arm labels shuffled, for n_replicates shuffles. Which units land in
+    control only matters through how many of each distinct value do, which is multivariate hypergeometric
+    """
+    numerator, denominator, multiplicity, n_control, n_replicates, seed = task
+    rng = np.random.default_rng(seed)
+    total_numerator = numerator @ multiplicity
+    total_denominator = denominator @ multiplicity
+    differences = np.empty(n_replicates)
+    block = max(1, MAX_BLOCK_ELEMENTS // max(len(numerator), 1))
+    for start in range(0, n_replicates, block):
+        size = min(block, n_replicates - start)
+        control = rng.multivariate_hypergeometric(multiplicity, n_control, size=size, method='marginals').astype(np.float64)
+        control_numerator = control @ numerator
+        control_denominator = control @ denominator
+        with np.errstate(divide='ignore', invalid='ignore'):
+            differences[start:start + size] = (
+                (total_numerator - control_numerator) / (total_denominator - control_denominator)
+                - control_numerator / control_denominator
+            )
+    return differences
+
+
+def _run_chunks(function, tasks, workers, pool=None):
+    if pool is not None and len(tasks) > 1:
+        return np.concatenate(list(pool.map(function, tasks)))
+    if workers is not None and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            return np.concatenate(list(pool.map(function, tasks)))
+    return np.concatenate([function(task) for task in tasks])
+
+
+def _chunk_sizes(n_replicates):
+    sizes = [REPLICATES_PER_CHUNK] * (n_replicates // REPLICATES_PER_CHUNK)
+    if n_replicates % REPLICATES_PER_CHUNK:
+        sizes.append(n_replicates % REPLICATES_PER_CHUNK)
+    return sizes
+
+
+def _spawn_seeds(seed, count):
+    #seed can be an int, None or a SeedSequence spawned by the caller
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(count)
+
+
+def poisson_bootstrap(numerator, denominator, n_replicates=10000, seed=None, workers=None, count=None, pool=None):
+    """
+    n_replicates bootstrap values of sum(numerator) / sum(denominator). The chunks run in pool if given, otherwise in
+    a pool of workers processes started for this call
+    """
+    numerator, denominator, multiplicity = _collapse_units(numerator, denominator, count)
+    sizes = _chunk_sizes(n_replicates)
+    seeds = _spawn_seeds(seed, len(sizes))
+    tasks = [(numerator, denominator, multiplicity, size, child) for size, child in zip(sizes, seeds)]
+    return _run_chunks(_bootstrap_chunk, tasks, workers, pool)
+
+
+def permutation_test(control_numerator, control_denominator, treatment_numerator, treatment_denominator, n_permutations=10000, seed=None, workers=None, control_count=None, treatment_count=None, pool=None):
+    """
+    Two-sided permutation p-value for the difference in sum(numerator) / sum(denominator) between the arms. pool and
+    workers as in poisson_bootstrap
+    """
+    control = _collapse_units(control_numerator, control_denominator, control_count)
+    treatment = _collapse_units(treatment_numerator, treatment_denominator, treatment_count)
+    observed = (treatment[0] @ treatment[2]) / (treatment[1] @ treatment[2]) - (control[0] @ control[2]) / (control[1] @ control[2])
+
+    numerator, denominator, multiplicity = _collapse_units(
+        np.concatenate([control[0], treatment[0]]),
+        np.concatenate([control[1], treatment[1]]),
+        np.concatenate([control[2], treatment[2]]),
+    )
+    sizes = _chunk_sizes(n_permutations)
+    seeds = _spawn_seeds(seed, len(sizes))
+    tasks = [(numerator, denominator, multiplicity, int(control[2].sum()), size, child) for size, child in zip(sizes, seeds)]
+    differences = _run_chunks(_permutation_chunk, tasks, workers, pool)
+    #Small tolerance so ties with the observed value count as "at least as extreme"
+    extreme = np.abs(differences) >= np.abs(observed) - 1e-12
+    return (1 + extreme.sum()) / (1 + n_permutations)
+
+
+def resample_experiments(units_df, n_replicates=10000, n_permutations=0, alpha=0.05, seed=0, workers=None, pool=None):
+    """
+    Bootstrap CIs (percentile) for the treatment - control difference and the relative lift of every experiment in
+    units_df (experiment_id, variant, numerator, denominator, optional count), plus a permutation p-value if
+    n_permutations > 0. Every chunk runs in pool if given, otherwise in one pool of workers processes for the whole call
+    """
+    if pool is None and workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return resample_experiments(units_df, n_replicates, n_permutations, alpha, seed, pool=pool)
+    if 'count' not in units_df.columns:
+        units_df = units_df.assign(count=1)
+    groups = list(units_df.groupby('experiment_id', sort=True))
+    rows = []
+    for (experiment_id, experiment_units), experiment_seed in zip(groups, _spawn_seeds(seed, len(groups))):
+        control = experiment_units[experiment_units['variant'] == 'control']
+        treatment = experiment_units[experiment_units['variant'] == 'treatment']
+        control_seed, treatment_seed, permutation_seed = experiment_seed.spawn(3)
+
+        control_metric = (control['numerator'] * control['count']).sum() / (control['denominator'] * control['count']).sum()
+        treatment_metric = (treatment['numerator'] * treatment['count']).sum() / (treatment['denominator'] * treatment['count']).sum()
+        control_replicates = poisson_bootstrap(control['numerator'], control['denominator'], n_replicates, control_seed, count=control['count'], pool=pool)
+        treatment_replicates = poisson_bootstrap(treatment['numerator'], treatment['denominator'], n_replicates, treatment_seed, count=treatment['count'], pool=pool)
+        differences = treatment_replicates - control_replicates
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lifts = treatment_replicates / control_replicates - 1
+
+        quantiles = [alpha / 2, 1 - alpha / 2]
+        difference_ci = np.nanquantile(differences, quantiles)
+        lift_ci = np.nanquantile(lifts, quantiles)
+        row = {
+            'experiment_id': experiment_id,
+            'control_metric': control_metric,
+            'treatment_metric': treatment_metric,
+            'difference': treatment_metric - control_metric,
+            'difference_lower_ci': difference_ci[0],
+            'difference_upper_ci': difference_ci[1],
+            'lift_percent': (treatment_metric / control_metric - 1) * 100,
+            'lift_lower_ci_percent': lift_ci[0] * 100,
+            'lift_upper_ci_percent': lift_ci[1] * 100,
+        }
+        if n_permutations:
+            row['permutation_p_value'] = permutation_test(
+                control['numerator'], control['denominator'], treatment['numerator'], treatment['denominator'],
+                n_permutations, permutation_seed, control_count=control['count'], treatment_count=treatment['count'], pool=pool,
+            )
+        rows.append(row)
+    return pd.DataFrame(rows)
@@ -0,0 +1,126 @@
+"""
+Analysis results kept in SQLite, keyed by experiment_id and the time of the run, so the dashboard reads them straight
+from the database: no CSV round-trip through the loader and no join on experiment names. Every run is kept, and the
+latest_experiment_results view has the newest row per experiment.
+"""
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+RESULTS_TABLE = "experiment_results"
+LATEST_RESULTS_VIEW = "latest_experiment_results"
+
+#Column -> SQL type, in table order after experiment_id and run_at. Everything analyze_power_from_results produces
+RESULT_COLUMNS = {
+    "experiment_name": "TEXT",
+    "control_rate": "REAL",
+    "control_size": "INTEGER",
+    "treatment_rate": "REAL",
+    "treatment_size": "INTEGER",
+    "lift_percent": "REAL",
+    "z_score": "REAL",
+    "p_value": "REAL",
+    "is_significant": "INTEGER",
+    "lower_ci": "REAL",
+    "upper_ci": "REAL",
+    "power": "REAL",
+    "required_users_per_group": "INTEGER",
+    "total_required_users": "INTEGER",
+    "users_multiplier": "REAL",
+    "mde_effect_size": "REAL",
+    "mde_treatment_rate": "REAL",
+    "mde_relative_lift_pct": "REAL",
+    "well_powered": "INTEGER",
+    #Exact converter counts, so the Bayesian view doesn't have to reconstruct them from rounded rates
+    "control_conversions": "INTEGER",
+    "treatment_conversions": "INTEGER",
+}
+
+
+def create_results_tables(conn: sqlite3.Connection):
+    columns = ", ".join(f"{column} {column_type}" for column, column_type in RESULT_COLUMNS.items())
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {RESULTS_TABLE} ("
+        f"experiment_id INTEGER NOT NULL, run_at TEXT NOT NULL, {columns}, "
+        "PRIMARY KEY (experiment_id, run_at))"
+    )
+    #Tables created before a column was added get it here, with NULL for the older runs
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({RESULTS_TABLE})")}
+    for column, column_type in RESULT_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {RESULTS_TABLE} ADD COLUMN {column} {column_type}")
+    conn.execute(
+        f"CREATE VIEW IF NOT EXISTS {LATEST_RESULTS_VIEW} AS "
+        f"SELECT r.* FROM {RESULTS_TABLE} r "
+        f"JOIN (SELECT experiment_id, MAX(run_at) AS run_at FROM {RESULTS_TABLE} GROUP BY experiment_id) latest "
+        "USING (experiment_id, run_at)"
+    )
+
+
+def _next_run_at(conn: sqlite3.Connection) -> str:
+    """
+    The current UTC time to the microsecond, moved past the newest stored run if the clock hasn't got there (a coarse
+    clock, two runs in the same tick, or a clock that stepped back), so every run gets its own key and sorts last
+    """
+    now = datetime.now(timezone.utc)
+    latest = conn.execute(f"SELECT MAX(run_at) FROM {RESULTS_TABLE}").fetchone()[0]
+    try:
+        latest_time = datetime.fromisoformat(latest) if latest is not None else None
+        if latest_time is not None and now <= latest_time:
+            now = latest_time + timedelta(microseconds=1)
+    except (ValueError, TypeError):
+        #A run_at the caller chose that isn't a timezone-aware ISO time says nothing about the clock
+        pass
+    return now.isoformat(timespec="microseconds")
+
+
+def save_results(conn: sqlite3.Connection, analysis_df, experiment_ids, run_at=None) -> str:
+    """
+    Upserts one analysis run: analysis_df is analyze_power_from_results output and experiment_ids gives each row's
+    experiment_id, in order. Columns analysis_df doesn't have are stored as NULL. Rerunning with the same run_at
+    replaces that run. Returns run_at (UTC ISO-8601 with microseconds by default, later than every stored run)
+    """
+    create_results_tables(conn)
+    if run_at is None:
+        run_at = _next_run_at(conn)
+    columns = list(RESULT_COLUMNS)
+    analysis_df = analysis_df.reindex(columns=columns)
+    values = analysis_df.astype(object).where(analysis_df.notna(), None)
+    rows = [
+        (int(experiment_id), run_at, *(value.item() if hasattr(value, "item") else value for value in row))
+        for experiment_id, row in zip(experiment_ids, values.itertuples(index=False))
+    ]
+    placeholders = ", ".join("?" * (len(columns) + 2))
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns)
+    with conn:
+        conn.executemany(
+            f"INSERT INTO {RESULTS_TABLE} (experiment_id, run_at, {', '.join(columns)}) VALUES ({placeholders}) "
+            f"ON CONFLICT (experiment_id, run_at) DO UPDATE SET {updates}",
+            rows,
+        )
+    return run_at
+
+
+def save_results_to_db(db_path, analysis_df, experiment_ids, run_at=None) -> str:
+    """
+    save_results on its own connection to db_path, creating the database if it isn't there yet
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        return save_results(conn, analysis_df, experiment_ids, run_at)
+    finally:
+        conn.close()
+
+
+def results_history(conn: sqlite3.Connection, experiment_id=None):
+    """
+    Every stored run, oldest first, optionally for one experiment
+    """
+    query = f"SELECT * FROM {RESULTS_TABLE}"
+    params = ()
+    if experiment_id is not None:
+        query += " WHERE experiment_id = ?"
+        params = (experiment_id,)
+    return pd.read_sql_query(query + " ORDER BY experiment_id, run_at", conn, params=params)
@@ -0,0 +1,81 @@
+"""
+Per-(experiment, variant, period) user and converter counts, materialized from user_sessions so the dashboard
+never has to rebuild the per-user CTE over every session.
+"""
+import sqlite3
+
+ROLLUP_TABLE = "conversion_rollups"
+ROLLUP_STATE_TABLE = "conversion_rollup_state"
+
+#Same period keys the old weekly/monthly queries used, so the charts don't move
+GRAINS = {
+    "daily": "date(session_date)",
+    "weekly": "date(session_date, 'weekday 1', '-7 days')",
+    "monthly": "strftime('%Y-%m', session_date)",
+}
+
+#How far before a date its period can start. Anything in an affected period is at most this many days older than the watermark
+LOOKBACK_DAYS = {"daily": 0, "weekly": 7, "monthly": 31}
+
+
+def create_rollup_tables(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} ("
+        "grain TEXT NOT NULL, experiment_id INTEGER NOT NULL, variant TEXT NOT NULL, time_period TEXT NOT NULL, "
+        "users INTEGER NOT NULL, converting_users INTEGER NOT NULL, "
+        "PRIMARY KEY (grain, experiment_id, time_period, variant)) WITHOUT ROWID"
+    )
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {ROLLUP_STATE_TABLE} (grain TEXT PRIMARY KEY, max_session_date TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_session_date ON user_sessions (session_date)")
+
+
+def _rebuild_sql(period: str, incremental: bool) -> str:
+    where = ""
+    if incremental:
+        #Only periods that contain a session on or after the watermark get recomputed, but they get recomputed in full
+        where = (
+            f"WHERE session_date >= date(:watermark, :lookback) "
+            f"AND {period} IN (SELECT DISTINCT {period} FROM user_sessions WHERE session_date >= :watermark)"
+        )
+    return f"""
+        INSERT OR REPLACE INTO {ROLLUP_TABLE} (grain, experiment_id, variant, time_period, users, converting_users)
+        SELECT :grain, experiment_id, variant, time_period, COUNT(*), SUM(converted_user)
+        FROM (
+            SELECT
+                experiment_id,
+                variant,
+                {period} AS time_period,
+                user_id,
+                MAX(CASE WHEN converted THEN 1 ELSE 0 END) AS converted_user
+            FROM user_sessions
+            {where}
+            GROUP BY experiment_id, variant, time_period, user_id
+        )
+        GROUP BY experiment_id, variant, time_period
+    """
+
+
+def refresh_rollups(conn: sqlite3.Connection, full: bool = False):
+    """
+    Brings the rollups up to date with user_sessions. Incremental refreshes recompute only the periods that
+    contain sessions dated on or after the last refresh's newest session_date; that assumes new sessions arrive
+    in date order (which is what the loader's append path sees). Pass full=True after user_sessions was rebuilt.
+    """
+    create_rollup_tables(conn)
+    for grain, period in GRAINS.items():
+        state = conn.execute(f"SELECT max_session_date FROM {ROLLUP_STATE_TABLE} WHERE grain = ?", (grain,)).fetchone()
+        watermark = state[0] if state is not None else None
+
+        if full or watermark is None:
+            conn.execute(f"DELETE FROM {ROLLUP_TABLE} WHERE grain = ?", (grain,))
+            conn.execute(_rebuild_sql(period, incremental=False), {"grain": grain})
+        else:
+            conn.execute(
+                _rebuild_sql(period, incremental=True),
+                {"grain": grain, "watermark": watermark, "lookback": f"-{LOOKBACK_DAYS[grain]} days"},
+            )
+
+        conn.execute(
+            f"INSERT OR REPLACE INTO {ROLLUP_STATE_TABLE} (grain, max_session_date) SELECT ?, MAX(session_date) FROM user_sessions",
+            (grain,),
+        )
@@ -0,0 +1,117 @@
+"""
+Segment cube: users and converters per (experiment, variant, segment dimension, segment value), from
+experiment_assignments joined to each user's conversion and their users.csv attributes. Built in one join and one
+groupby, stored in SQLite, and tested cell by cell with z-tests corrected for multiple comparisons.
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from .hypothesis import adjust_pvalues, two_proportion_ztest
+
+SEGMENT_TABLE = "segment_cube"
+SEGMENT_DIMENSIONS = ['user_segment', 'device_type', 'location', 'age_group']
+
+
+def build_segment_cube(assignments_df, sessions_df, users_df, dimensions=SEGMENT_DIMENSIONS):
+    """
+    One row per (experiment_id, variant, dimension, segment_value) with users and converters.
+    Every assigned user counts, a user converted if any of their sessions in that experiment converted
+    """
+    converted = sessions_df.groupby(['experiment_id', 'user_id'], sort=False)['converted'].max().astype(np.int64).rename('converted')
+    assigned = assignments_df[['experiment_id', 'variant', 'user_id']].merge(
+        converted.reset_index(), on=['experiment_id', 'user_id'], how='left'
+    )
+    assigned['converted'] = assigned['converted'].fillna(0).astype(np.int64)
+    assigned = assigned.merge(users_df[['user_id', *dimensions]], on='user_id', how='left')
+
+    #Long format, so a single groupby covers every dimension at once
+    long_df = assigned.melt(
+        id_vars=['experiment_id', 'variant', 'converted'],
+        value_vars=list(dimensions),
+        var_name='dimension',
+        value_name='segment_value',
+    )
+    long_df['segment_value'] = long_df['segment_value'].fillna('unknown').astype(str)
+    cube = long_df.groupby(['experiment_id', 'variant', 'dimension', 'segment_value'], sort=True)['converted'].agg(
+        users='size', converters='sum'
+    )
+    return cube.reset_index()
+
+
+def create_segment_table(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {SEGMENT_TABLE} ("
+        "experiment_id INTEGER NOT NULL, variant TEXT NOT NULL, dimension TEXT NOT NULL, segment_value TEXT NOT NULL, "
+        "users INTEGER NOT NULL, converters INTEGER NOT NULL, "
+        "PRIMARY KEY (experiment_id, dimension, segment_value, variant)) WITHOUT ROWID"
+    )
+
+
+def write_segment_cube(conn: sqlite3.Connection, cube_df):
+    """
+    Replaces the stored cube with cube_df. Doesn't commit, so it can share the caller's transaction
+    """
+    create_segment_table(conn)
+    conn.execute(f"DELETE FROM {SEGMENT_TABLE}")
+    conn.executemany(
+        f"INSERT INTO {SEGMENT_TABLE} (experiment_id, variant, dimension, segment_value, users, converters) VALUES (?, ?, ?, ?, ?, ?)",
+        zip(
+            cube_df['experiment_id'].astype(int).tolist(),
+            cube_df['variant'].astype(str).tolist(),
+            cube_df['dimension'].astype(str).tolist(),
+            cube_df['segment_value'].astype(str).tolist(),
+            cube_df['users'].astype(int).tolist(),
+            cube_df['converters'].astype(int).tolist(),
+        ),
+    )
+
+
+def refresh_segment_cube(conn: sqlite3.Connection, dimensions=SEGMENT_DIMENSIONS):
+    """
+    Rebuilds the stored cube from the experiment_assignments, user_sessions and users tables
+    """
+    assignments_df = pd.read_sql_query("SELECT experiment_id, variant, user_id FROM experiment_assignments", conn)
+    sessions_df = pd.read_sql_query("SELECT experiment_id, user_id, converted FROM user_sessions", conn)
+    users_df = pd.read_sql_query(f"SELECT user_id, {', '.join(dimensions)} FROM users", conn)
+    write_segment_cube(conn, build_segment_cube(assignments_df, sessions_df, users_df, dimensions))
+
+
+def segment_tests(cube_df, alpha=0.05, method='holm', family=None):
+    """
+    Control vs treatment z-test for every (experiment, dimension, segment value) cell of the cube, with p-values
+    adjusted by adjust_pvalues(method). family lists the columns that define a family of tests (for instance
+    ['experiment_id', 'dimension']); by default every cell in cube_df is one family.
+    Cells where either variant has no users are dropped
+    """
+    wide = cube_df.pivot_table(
+        index=['experiment_id', 'dimension', 'segment_value'], columns='variant', values=['users', 'converters'], aggfunc='sum'
+    ).dropna()
+    wide = wide[(wide[('users', 'control')] > 0) & (wide[('users', 'treatment')] > 0)]
+
+    control_n = wide[('users', 'control')].to_numpy(dtype=float)
+    control_x = wide[('converters', 'control')].to_numpy(dtype=float)
+    treatment_n = wide[('users', 'treatment')].to_numpy(dtype=float)
+    treatment_x = wide[('converters', 'treatment')].to_numpy(dtype=float)
+    results_df = pd.DataFrame({
+        'control_users': control_n.astype(np.int64),
+        'control_rate': control_x / control_n,
+        'treatment_users': treatment_n.astype(np.int64),
+        'treatment_rate': treatment_x / treatment_n,
+    }, index=wide.index).reset_index()
+    if len(results_df) == 0:
+        return results_df.assign(lift_percent=[], z_score=[], p_value=[], lower_ci=[], upper_ci=[], adjusted_p_value=[], is_significant=[])
+
+    test = two_proportion_ztest(control_n, control_x, treatment_n, treatment_x)
+    for column in ['lift_percent', 'z_score', 'p_value', 'lower_ci', 'upper_ci']:
+        results_df[column] = test[column]
+
+    if family is None:
+        results_df['adjusted_p_value'] = adjust_pvalues(results_df['p_value'].to_numpy(), method)
+    else:
+        results_df['adjusted_p_value'] = results_df.groupby(list(family), sort=False)['p_value'].transform(
+            lambda p_values: adjust_pvalues(p_values.to_numpy(), method)
+        )
+    results_df['is_significant'] = results_df['adjusted_p_value'] < alpha
+    return results_df
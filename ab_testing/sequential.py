@@ -0,0 +1,390 @@
+"""
+Sequential monitoring: per-(experiment, variant) sufficient statistics kept in SQLite and updated from each new
+batch of sessions (or daily_metrics rows) in O(batch), plus tests that stay valid however often you look at them.
+
+- Always-valid p-values and confidence sequences for the treatment - control difference from the mixture
+  sequential probability ratio test (mSPRT) with a N(0, tau^2) mixing distribution.
+- Group-sequential boundaries for a planned number of users per group, from the Lan-DeMets O'Brien-Fleming
+  alpha-spending function. Every check that adds enough information is a look; the looks are kept in SQLite, since
+  each boundary depends on the ones before it.
+
+load_csv_files.py keeps the counts in step with user_sessions (refresh_sequential_stats) and
+statistical_tests.py --sequential runs the checks.
+"""
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+USERS_TABLE = "sequential_users"
+STATS_TABLE = "sequential_stats"
+TESTS_TABLE = "sequential_tests"
+LOOKS_TABLE = "sequential_looks"
+STATE_TABLE = "sequential_state"
+
+DEFAULT_TAU = 0.01
+#A check only becomes a group-sequential look once the information fraction has grown this much since the last look
+#(or reached 1). Checking every few minutes would otherwise mean thousands of looks with next to no new information each
+MIN_LOOK_INCREMENT = 0.01
+#Simpson nodes per look for the boundary integration; boundaries agree with a 1001-point grid to about 1e-5
+GRID_POINTS = 201
+
+
+def msprt_likelihood_ratio(difference, variance, tau=DEFAULT_TAU):
+    """
+    Mixture likelihood ratio against H0: difference == 0, for an estimate with the given variance
+    """
+    difference = np.asarray(difference, dtype=float)
+    variance = np.asarray(variance, dtype=float)
+    tau_squared = tau ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.sqrt(variance / (variance + tau_squared)) * np.exp(
+            difference ** 2 * tau_squared / (2 * variance * (variance + tau_squared))
+        )
+    return np.where(variance > 0, ratio, 1.0)
+
+
+def confidence_sequence_radius(variance, alpha=0.05, tau=DEFAULT_TAU):
+    """
+    Half-width of the (1 - alpha) mSPRT confidence sequence: every difference the test wouldn't reject at alpha
+    """
+    variance = np.asarray(variance, dtype=float)
+    tau_squared = tau ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        radius = np.sqrt(
+            variance * (variance + tau_squared) / tau_squared
+            * (np.log((variance + tau_squared) / variance) - 2 * np.log(alpha))
+        )
+    return np.where(variance > 0, radius, np.inf)
+
+
+def obrien_fleming_spending(information_fraction, alpha=0.05):
+    """
+    Two-sided alpha spent by each information fraction under the Lan-DeMets O'Brien-Fleming spending function, alpha / 2
+    per side: 4 - 4 * Phi(z_{alpha/4} / sqrt(t)). All of alpha is spent by t = 1
+    """
+    from scipy.special import ndtr, ndtri
+
+    information_fraction = np.clip(np.asarray(information_fraction, dtype=float), 1e-12, 1.0)
+    return 4 - 4 * ndtr(-ndtri(alpha / 4) / np.sqrt(information_fraction))
+
+
+def _simpson_grid(limit):
+    nodes = np.linspace(-limit, limit, GRID_POINTS)
+    weights = np.full(GRID_POINTS, 2.0)
+    weights[1::2] = 4.0
+    weights[[0, -1]] = 1.0
+    return nodes, weights * (nodes[1] - nodes[0]) / 3
+
+
+def group_sequential_boundaries(information_fractions, alpha=0.05):
+    """
+    Two-sided z boundaries for looks at these increasing information fractions, each spending exactly the
+    Lan-DeMets O'Brien-Fleming increment alpha(t_k) - alpha(t_{k-1}), and the alpha spent by each look.
+    Works on the score process S_k = Z_k * sqrt(t_k): the density of S at each look, over the paths that haven't crossed
+    yet, is carried forward by numerical integration over the earlier looks, and each boundary is the root of
+    P(cross at look k) = increment. A look with nothing left to spend gets an infinite boundary
+    """
+    from scipy.optimize import brentq
+    from scipy.special import ndtr, ndtri
+
+    information_fractions = np.asarray(information_fractions, dtype=float)
+    spent = obrien_fleming_spending(information_fractions, alpha)
+    boundaries = np.empty(len(information_fractions))
+    nodes = mass = None
+    previous_fraction = previous_spent = 0.0
+    for look, (fraction, spent_by_now) in enumerate(zip(information_fractions, spent)):
+        increment = spent_by_now - previous_spent
+        if nodes is None:
+            #First look: S ~ N(0, t), so the boundary is a plain normal quantile
+            step = np.sqrt(fraction)
+            score_boundary = step * -ndtri(increment / 2) if increment > 0 else np.inf
+        else:
+            step = np.sqrt(fraction - previous_fraction)
+
+            def crossing(score_boundary):
+                return np.sum(mass * (ndtr((-score_boundary - nodes) / step) + ndtr((nodes - score_boundary) / step))) - increment
+
+            score_boundary = brentq(crossing, 0.0, nodes[-1] + 40 * step, xtol=1e-10) if increment > 0 else np.inf
+        boundaries[look] = score_boundary / np.sqrt(fraction)
+
+        #Density of S over the continuation region, truncated where it's negligible anyway
+        new_nodes, weights = _simpson_grid(min(score_boundary, 8 * np.sqrt(fraction)))
+        if nodes is None:
+            density = np.exp(-new_nodes ** 2 / (2 * fraction)) / np.sqrt(2 * np.pi * fraction)
+        else:
+            z = (new_nodes[:, None] - nodes[None, :]) / step
+            density = (np.exp(-z * z / 2) / (np.sqrt(2 * np.pi) * step)) @ mass
+        nodes, mass = new_nodes, weights * density
+        previous_fraction, previous_spent = fraction, spent_by_now
+    return boundaries, spent
+
+
+class SequentialMonitor:
+    """
+    Keeps distinct users and converters per (experiment_id, variant) in the given SQLite database. Each update only
+    touches the users in the batch, so checking hundreds of experiments every few minutes never rescans history.
+    Feed it either sessions or daily_metrics for a given experiment, not both.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {USERS_TABLE} ("
+            "experiment_id INTEGER NOT NULL, variant TEXT NOT NULL, user_id INTEGER NOT NULL, converted INTEGER NOT NULL, "
+            "PRIMARY KEY (experiment_id, variant, user_id)) WITHOUT ROWID"
+        )
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {STATS_TABLE} ("
+            "experiment_id INTEGER NOT NULL, variant TEXT NOT NULL, users INTEGER NOT NULL, converters INTEGER NOT NULL, "
+            "PRIMARY KEY (experiment_id, variant))"
+        )
+        #Running minimum p-value and running intersection of the confidence sequence, which is what makes them always valid
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {TESTS_TABLE} ("
+            "experiment_id INTEGER PRIMARY KEY, p_value REAL NOT NULL, cs_lower REAL NOT NULL, cs_upper REAL NOT NULL, checked_at TEXT)"
+        )
+        #Every group-sequential look taken so far; the next boundary is solved given all of them
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {LOOKS_TABLE} ("
+            "experiment_id INTEGER NOT NULL, look INTEGER NOT NULL, information_fraction REAL NOT NULL, boundary REAL NOT NULL, "
+            "alpha_spent REAL NOT NULL, z_score REAL NOT NULL, crossed INTEGER NOT NULL, checked_at TEXT, "
+            "PRIMARY KEY (experiment_id, look)) WITHOUT ROWID"
+        )
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} (source TEXT PRIMARY KEY, max_session_date TEXT)")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS sequential_batch (experiment_id INTEGER, variant TEXT, user_id INTEGER, converted INTEGER)")
+
+    def _add_counts(self, counts):
+        self.conn.executemany(
+            f"INSERT INTO {STATS_TABLE} (experiment_id, variant, users, converters) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (experiment_id, variant) DO UPDATE SET users = users + excluded.users, converters = converters + excluded.converters",
+            counts,
+        )
+
+    def _apply_batch(self):
+        """
+        Folds the users in the sequential_batch temp table (one row per experiment, variant and user) into the counts,
+        then empties it. Doesn't commit
+        """
+        new_users = self.conn.execute(f"""
+            SELECT b.experiment_id, b.variant, COUNT(*), SUM(b.converted)
+            FROM sequential_batch b
+            LEFT JOIN {USERS_TABLE} s USING (experiment_id, variant, user_id)
+            WHERE s.user_id IS NULL
+            GROUP BY b.experiment_id, b.variant
+        """).fetchall()
+        newly_converted = self.conn.execute(f"""
+            SELECT b.experiment_id, b.variant, 0, COUNT(*)
+            FROM sequential_batch b
+            JOIN {USERS_TABLE} s USING (experiment_id, variant, user_id)
+            WHERE b.converted = 1 AND s.converted = 0
+            GROUP BY b.experiment_id, b.variant
+        """).fetchall()
+        self._add_counts(new_users + newly_converted)
+
+        self.conn.execute(f"""
+            INSERT INTO {USERS_TABLE} (experiment_id, variant, user_id, converted)
+            SELECT experiment_id, variant, user_id, converted FROM sequential_batch WHERE true
+            ON CONFLICT (experiment_id, variant, user_id) DO UPDATE SET converted = MAX(converted, excluded.converted)
+        """)
+        self.conn.execute("DELETE FROM sequential_batch")
+
+    def reset(self):
+        """
+        Forgets every count, check and look. Doesn't commit
+        """
+        for table_name in (USERS_TABLE, STATS_TABLE, TESTS_TABLE, LOOKS_TABLE, STATE_TABLE):
+            self.conn.execute(f"DELETE FROM {table_name}")
+
+    def update_sessions(self, sessions_df):
+        """
+        Adds a batch of sessions (experiment_id, variant, user_id, converted). Users seen in earlier batches
+        aren't counted again, and only count as a new converter the first time one of their sessions converts
+        """
+        if len(sessions_df) == 0:
+            return
+        batch = sessions_df.groupby(['experiment_id', 'variant', 'user_id'], sort=False, observed=True)['converted'].max().reset_index()
+        rows = list(zip(
+            batch['experiment_id'].astype(int).tolist(),
+            batch['variant'].astype(str).tolist(),
+            batch['user_id'].astype(int).tolist(),
+            batch['converted'].astype(int).tolist(),
+        ))
+
+        with self.conn:
+            self.conn.execute("DELETE FROM sequential_batch")
+            self.conn.executemany("INSERT INTO sequential_batch VALUES (?, ?, ?, ?)", rows)
+            self._apply_batch()
+
+    def update_from_table(self, table_name="user_sessions"):
+        """
+        Adds the sessions of a user_sessions-shaped table dated on or after the newest session_date the last call
+        saw. Sessions on that day are fed again, which is a no-op for the ones already counted. Like the rollups, it
+        assumes sessions arrive in date order. Doesn't commit, so the loader can run it inside its own transaction
+        """
+        state = self.conn.execute(f"SELECT max_session_date FROM {STATE_TABLE} WHERE source = ?", (table_name,)).fetchone()
+        watermark = state[0] if state is not None and state[0] is not None else ""
+        self.conn.execute("DELETE FROM sequential_batch")
+        self.conn.execute(f"""
+            INSERT INTO sequential_batch (experiment_id, variant, user_id, converted)
+            SELECT experiment_id, variant, user_id, MAX(CASE WHEN converted THEN 1 ELSE 0 END)
+            FROM "{table_name}"
+            WHERE session_date >= ?
+            GROUP BY experiment_id, variant, user_id
+        """, (watermark,))
+        self._apply_batch()
+        self.conn.execute(
+            f'INSERT OR REPLACE INTO {STATE_TABLE} (source, max_session_date) SELECT ?, MAX(session_date) FROM "{table_name}"',
+            (table_name,),
+        )
+
+    def update_daily_metrics(self, daily_metrics_df):
+        """
+        Adds a batch of daily_metrics rows. These are daily aggregates, so a user active on two days counts twice
+        """
+        if len(daily_metrics_df) == 0:
+            return
+        counts = daily_metrics_df.groupby(['experiment_id', 'variant'])[['total_users', 'total_conversions']].sum().reset_index()
+        with self.conn:
+            self._add_counts(list(zip(
+                counts['experiment_id'].astype(int).tolist(),
+                counts['variant'].astype(str).tolist(),
+                counts['total_users'].astype(int).tolist(),
+                counts['total_conversions'].astype(int).tolist(),
+            )))
+
+    def stats(self):
+        """
+        One row per experiment with control/treatment users (n) and converters (x)
+        """
+        stats_df = pd.read_sql_query(f"SELECT experiment_id, variant, users AS n, converters AS x FROM {STATS_TABLE}", self.conn)
+        wide = stats_df.pivot(index='experiment_id', columns='variant', values=['n', 'x'])
+        return pd.DataFrame({
+            'control_n': wide[('n', 'control')],
+            'control_x': wide[('x', 'control')],
+            'treatment_n': wide[('n', 'treatment')],
+            'treatment_x': wide[('x', 'treatment')],
+        }).dropna().astype(int)
+
+    def evaluate(self, planned_users_per_group=None, alpha=0.05, tau=DEFAULT_TAU):
+        """
+        Checks every experiment at once. Returns the current difference in conversion rate, the always-valid p-value
+        and confidence sequence (both carried over from earlier checks), and, when planned_users_per_group is given
+        (a number or a {experiment_id: users} dict), the group-sequential look (see _take_looks): information
+        fraction, looks so far, the O'Brien-Fleming spending boundary and whether a look crossed it. Keep alpha and the
+        planned users fixed for an experiment across checks
+        """
+        stats_df = self.stats()
+        control_n = stats_df['control_n'].to_numpy(dtype=float)
+        control_x = stats_df['control_x'].to_numpy(dtype=float)
+        treatment_n = stats_df['treatment_n'].to_numpy(dtype=float)
+        treatment_x = stats_df['treatment_x'].to_numpy(dtype=float)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p1 = control_x / control_n
+            p2 = treatment_x / treatment_n
+            difference = p2 - p1
+            variance = p1 * (1 - p1) / control_n + p2 * (1 - p2) / treatment_n
+            z_score = np.where(variance > 0, difference / np.sqrt(variance), 0.0)
+        variance = np.nan_to_num(variance, nan=0.0)
+        difference = np.nan_to_num(difference, nan=0.0)
+
+        p_value = np.minimum(1.0, 1 / msprt_likelihood_ratio(difference, variance, tau))
+        radius = confidence_sequence_radius(variance, alpha, tau)
+        cs_lower = difference - radius
+        cs_upper = difference + radius
+
+        previous = pd.read_sql_query(f"SELECT experiment_id, p_value, cs_lower, cs_upper FROM {TESTS_TABLE}", self.conn).set_index('experiment_id')
+        previous = previous.reindex(stats_df.index)
+        p_value = np.fmin(p_value, previous['p_value'].to_numpy(dtype=float))
+        cs_lower = np.fmax(cs_lower, previous['cs_lower'].to_numpy(dtype=float))
+        cs_upper = np.fmin(cs_upper, previous['cs_upper'].to_numpy(dtype=float))
+
+        results_df = pd.DataFrame({
+            **{column: stats_df[column].to_numpy() for column in stats_df.columns},
+            'difference': difference,
+            'z_score': z_score,
+            'always_valid_p_value': p_value,
+            'cs_lower': cs_lower,
+            'cs_upper': cs_upper,
+            'significant': p_value < alpha,
+        }, index=stats_df.index)
+
+        new_looks = []
+        if planned_users_per_group is not None:
+            if isinstance(planned_users_per_group, dict):
+                planned = stats_df.index.map(planned_users_per_group).to_numpy(dtype=float)
+            else:
+                planned = np.full(len(stats_df), float(planned_users_per_group))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                information_fraction = np.minimum(np.minimum(control_n, treatment_n) / planned, 1.0)
+            looks, boundary, alpha_spent, crossed, new_looks = self._take_looks(stats_df.index, information_fraction, z_score, alpha)
+            results_df['information_fraction'] = information_fraction
+            results_df['looks'] = looks
+            results_df['obf_boundary'] = boundary
+            results_df['alpha_spent'] = alpha_spent
+            results_df['crossed_boundary'] = crossed
+
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {TESTS_TABLE} (experiment_id, p_value, cs_lower, cs_upper, checked_at) VALUES (?, ?, ?, ?, datetime('now'))",
+                list(zip(stats_df.index.astype(int).tolist(), p_value.tolist(), cs_lower.tolist(), cs_upper.tolist())),
+            )
+            self.conn.executemany(
+                f"INSERT INTO {LOOKS_TABLE} (experiment_id, look, information_fraction, boundary, alpha_spent, z_score, crossed, checked_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))",
+                new_looks,
+            )
+        return results_df
+
+    def _take_looks(self, experiment_ids, information_fraction, z_score, alpha):
+        """
+        Records a new group-sequential look for every experiment whose information fraction grew by MIN_LOOK_INCREMENT
+        since its last look (or reached 1), with the boundary that spends its share of alpha given the earlier looks.
+        Returns, per experiment, the number of looks, the latest look's boundary and alpha spent, whether any look
+        crossed, and the new LOOKS_TABLE rows. Between looks the latest look's result stands
+        """
+        looks_df = pd.read_sql_query(
+            f"SELECT experiment_id, information_fraction, boundary, alpha_spent, crossed FROM {LOOKS_TABLE} ORDER BY experiment_id, look",
+            self.conn,
+        )
+        history = dict(tuple(looks_df.groupby('experiment_id')))
+        looks = np.zeros(len(experiment_ids), dtype=np.int64)
+        boundary = np.full(len(experiment_ids), np.nan)
+        alpha_spent = np.zeros(len(experiment_ids))
+        crossed = np.zeros(len(experiment_ids), dtype=bool)
+        new_looks = []
+        for i, experiment_id in enumerate(experiment_ids.astype(int).tolist()):
+            previous = history.get(experiment_id)
+            fractions = [] if previous is None else previous['information_fraction'].tolist()
+            if previous is not None:
+                looks[i] = len(previous)
+                boundary[i] = previous['boundary'].iloc[-1]
+                alpha_spent[i] = previous['alpha_spent'].iloc[-1]
+                crossed[i] = previous['crossed'].astype(bool).any()
+            fraction = information_fraction[i]
+            last_fraction = fractions[-1] if fractions else 0.0
+            #An experiment that already crossed has stopped; its decision doesn't change
+            if crossed[i] or not np.isfinite(fraction) or not (
+                fraction - last_fraction >= MIN_LOOK_INCREMENT or (fraction >= 1.0 and last_fraction < 1.0)
+            ):
+                continue
+            boundaries, spent = group_sequential_boundaries([*fractions, fraction], alpha)
+            looks[i] += 1
+            boundary[i] = boundaries[-1]
+            alpha_spent[i] = spent[-1]
+            crossed[i] = abs(z_score[i]) >= boundaries[-1]
+            new_looks.append((experiment_id, int(looks[i]), float(fraction), float(boundary[i]), float(alpha_spent[i]), float(z_score[i]), int(crossed[i])))
+        return looks, boundary, alpha_spent, crossed, new_looks
+
+
+def refresh_sequential_stats(conn: sqlite3.Connection, full: bool = False):
+    """
+    Brings the monitor's counts up to date with user_sessions, reading only the sessions since the last refresh.
+    Pass full=True after user_sessions was rebuilt: the counts, checks and looks start over. Must be called inside a
+    transaction
+    """
+    monitor = SequentialMonitor(conn)
+    if full:
+        monitor.reset()
+    monitor.update_from_table("user_sessions")
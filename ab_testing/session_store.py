@@ -0,0 +1,237 @@
+"""
+Compact in-memory copy of the sessions table. Rows are sorted by (experiment, variant, user, day), so experiment and
+variant don't need a column at all: they're dictionary-encoded into group numbers and every (experiment, variant)
+group is a contiguous row range. What's left per session is an int32 user id, a day number (16 bits when the data
+spans fewer than 65536 days) and one bit for converted, packed per group so each group starts on a byte.
+
+Slices for one experiment or arm are views into the store's arrays, and the user-level reduction (did each user
+convert) is done once and cached, so repeated analyses of the same data don't allocate new copies of it.
+"""
+import numpy as np
+import pandas as pd
+
+from .streaming import DEFAULT_CHUNKSIZE
+
+STORE_COLUMNS = ['experiment_id', 'variant', 'user_id', 'session_date', 'converted']
+#Dates repeat a lot, so they're read as categories too and only the distinct values get parsed
+STORE_DTYPES = {'experiment_id': 'int32', 'variant': 'category', 'user_id': 'int32', 'session_date': 'category', 'converted': 'bool'}
+
+
+def _day_numbers(dates):
+    return pd.to_datetime(dates).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+
+class SessionStore:
+    """
+    Build one with from_frame() or from_csv(). experiment_ids and variants are the dictionaries, in sorted order
+    """
+
+    def __init__(self, experiment_ids, variants, group_offsets, user_ids, day_offsets, first_day, converted_bits, bit_offsets):
+        self.experiment_ids = experiment_ids
+        self.variants = variants
+        self._experiment_codes = {experiment_id: code for code, experiment_id in enumerate(experiment_ids.tolist())}
+        self._variant_codes = {variant: code for code, variant in enumerate(variants)}
+        #Group g = experiment code * len(variants) + variant code covers rows group_offsets[g]:group_offsets[g + 1]
+        self._group_offsets = group_offsets
+        self._user_ids = user_ids
+        self._day_offsets = day_offsets
+        self._first_day = first_day
+        #Group g's converted bits are bytes bit_offsets[g]:bit_offsets[g + 1] of converted_bits
+        self._converted_bits = converted_bits
+        self._bit_offsets = bit_offsets
+        self._user_level = None
+
+    @classmethod
+    def from_arrays(cls, experiment_ids, variant_codes, variant_names, user_ids, days, converted):
+        """
+        Builds the store from plain per-session arrays: variant_codes index into variant_names and days are day numbers
+        (days since 1970-01-01)
+        """
+        user_ids = np.asarray(user_ids)
+        if len(user_ids) and (user_ids.min() < 0 or user_ids.max() > np.iinfo(np.int32).max):
+            raise ValueError("user_id values must fit in 32 signed bits.")
+        experiment_dictionary, experiment_codes = np.unique(np.asarray(experiment_ids), return_inverse=True)
+        #Variants in sorted order, so control sorts before treatment the same way a groupby would
+        variants = sorted(set(variant_names))
+        variant_lookup = np.array([variants.index(variant) for variant in variant_names], dtype=np.int64)
+        groups = experiment_codes.astype(np.int64) * len(variants) + variant_lookup[np.asarray(variant_codes, dtype=np.int64)]
+        days = np.asarray(days)
+
+        order = np.lexsort((days, user_ids, groups))
+        group_sizes = np.bincount(groups, minlength=len(experiment_dictionary) * len(variants))
+        group_offsets = np.r_[0, np.cumsum(group_sizes)]
+        first_day = int(days.min()) if len(days) else 0
+        day_span = int(days.max()) - first_day if len(days) else 0
+        day_offsets = (days[order].astype(np.int64) - first_day).astype(np.uint16 if day_span < 1 << 16 else np.int32)
+        sorted_converted = np.asarray(converted, dtype=bool)[order]
+        converted_bits = [np.packbits(sorted_converted[start:stop]) for start, stop in zip(group_offsets[:-1], group_offsets[1:])]
+        bit_offsets = np.r_[0, np.cumsum([len(bits) for bits in converted_bits])]
+        return cls(
+            experiment_dictionary.astype(np.int32),
+            variants,
+            group_offsets,
+            user_ids[order].astype(np.int32),
+            day_offsets,
+            first_day,
+            np.concatenate(converted_bits) if converted_bits else np.empty(0, dtype=np.uint8),
+            bit_offsets,
+        )
+
+    @classmethod
+    def from_frame(cls, sessions_df):
+        """
+        From a sessions DataFrame (experiment_id, variant, user_id, session_date, converted)
+        """
+        variants = sessions_df['variant'].astype('category')
+        return cls.from_arrays(
+            sessions_df['experiment_id'].to_numpy(),
+            variants.cat.codes.to_numpy(),
+            list(variants.cat.categories),
+            sessions_df['user_id'].to_numpy(),
+            _day_numbers(sessions_df['session_date']),
+            sessions_df['converted'].to_numpy(dtype=bool),
+        )
+
+    @classmethod
+    def from_csv(cls, path, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        From a user_sessions CSV, read in chunks with compact dtypes so the default-dtype frame never exists
+        """
+        columns = {name: [] for name in ('experiment_id', 'variant', 'user_id', 'days', 'converted')}
+        variant_names = []
+        reader = pd.read_csv(
+            path,
+            usecols=STORE_COLUMNS,
+            dtype=STORE_DTYPES,
+            true_values=['True', 'true', '1'],
+            false_values=['False', 'false', '0'],
+            chunksize=chunksize,
+        )
+        with reader:
+            for chunk in reader:
+                #Each chunk has its own categories, so map its codes onto one dictionary for the whole file
+                for variant in chunk['variant'].cat.categories:
+                    if variant not in variant_names:
+                        variant_names.append(variant)
+                lookup = np.array([variant_names.index(variant) for variant in chunk['variant'].cat.categories], dtype=np.int16)
+                columns['experiment_id'].append(chunk['experiment_id'].to_numpy())
+                columns['variant'].append(lookup[chunk['variant'].cat.codes.to_numpy()])
+                columns['user_id'].append(chunk['user_id'].to_numpy())
+                day_lookup = _day_numbers(chunk['session_date'].cat.categories).astype(np.int32)
+                columns['days'].append(day_lookup[chunk['session_date'].cat.codes.to_numpy()])
+                columns['converted'].append(chunk['converted'].to_numpy())
+        arrays = {name: np.concatenate(parts) if parts else np.empty(0, dtype=np.int32) for name, parts in columns.items()}
+        return cls.from_arrays(arrays['experiment_id'], arrays['variant'], variant_names, arrays['user_id'], arrays['days'], arrays['converted'])
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the store's arrays, including the cached user-level arrays once they exist
+        """
+        arrays = [self._group_offsets, self._user_ids, self._day_offsets, self._converted_bits, self._bit_offsets]
+        if self._user_level is not None:
+            arrays.extend(self._user_level)
+        return sum(array.nbytes for array in arrays)
+
+    def _groups(self, experiment_id, variant=None):
+        experiment_code = self._experiment_codes[experiment_id]
+        if variant is None:
+            return range(experiment_code * len(self.variants), (experiment_code + 1) * len(self.variants))
+        group = experiment_code * len(self.variants) + self._variant_codes[variant]
+        return range(group, group + 1)
+
+    def bounds(self, experiment_id, variant=None):
+        """
+        (start, stop) row range of one experiment, or of one of its arms
+        """
+        groups = self._groups(experiment_id, variant)
+        return int(self._group_offsets[groups.start]), int(self._group_offsets[groups.stop])
+
+    def user_ids(self, experiment_id, variant=None):
+        """
+        Session user ids of one experiment or arm, sorted by user within each arm. A view, not a copy
+        """
+        start, stop = self.bounds(experiment_id, variant)
+        return self._user_ids[start:stop]
+
+    def days(self, experiment_id, variant=None):
+        """
+        Session day numbers (days since 1970-01-01), lined up with user_ids(). Widened from the stored offsets, so a copy
+        """
+        start, stop = self.bounds(experiment_id, variant)
+        return self._day_offsets[start:stop].astype(np.int64) + self._first_day
+
+    def converted(self, experiment_id, variant=None):
+        """
+        Session converted flags, lined up with user_ids(). The bits are unpacked on the way out
+        """
+        parts = [
+            np.unpackbits(self._converted_bits[self._bit_offsets[group]:self._bit_offsets[group + 1]],
+                          count=int(self._group_offsets[group + 1] - self._group_offsets[group])).view(bool)
+            for group in self._groups(experiment_id, variant)
+        ]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def _users(self):
+        """
+        User-level arrays, computed on first use and kept: per group user offsets, each user's id and whether any of
+        their sessions in that arm converted. Rows are already sorted by user, so this is one reduceat and no sort
+        """
+        if self._user_level is None:
+            converted = np.unpackbits(self._converted_bits).view(bool)
+            #Byte padding at the end of every group's bits; keep only the real rows
+            sizes = np.diff(self._group_offsets)
+            padded_starts = self._bit_offsets[:-1] * 8
+            keep = np.repeat(padded_starts - self._group_offsets[:-1], sizes) + np.arange(len(self))
+            converted = converted[keep]
+            new_user = np.ones(len(self), dtype=bool)
+            new_user[1:] = self._user_ids[1:] != self._user_ids[:-1]
+            new_user[self._group_offsets[:-1][sizes > 0]] = True
+            user_starts = np.flatnonzero(new_user)
+            user_converted = np.logical_or.reduceat(converted, user_starts) if len(user_starts) else np.empty(0, dtype=bool)
+            group_user_offsets = np.searchsorted(user_starts, self._group_offsets)
+            self._user_level = (group_user_offsets, self._user_ids[user_starts], user_converted)
+        return self._user_level
+
+    def user_conversions(self, experiment_id, variant=None):
+        """
+        (user ids, converted) with one entry per user of one experiment or arm, views into the cached user-level arrays
+        """
+        group_user_offsets, users, user_converted = self._users()
+        groups = self._groups(experiment_id, variant)
+        start, stop = group_user_offsets[groups.start], group_user_offsets[groups.stop]
+        return users[start:stop], user_converted[start:stop]
+
+    def counts(self):
+        """
+        The same n/x counts frame as count_users_by_variant, from the cached user-level arrays
+        """
+        group_user_offsets, _, user_converted = self._users()
+        n = np.diff(group_user_offsets)
+        x = np.diff(np.r_[0, np.cumsum(user_converted, dtype=np.int64)][group_user_offsets])
+        observed = n > 0
+        groups = np.flatnonzero(observed)
+        index = pd.MultiIndex.from_arrays(
+            [self.experiment_ids.astype(np.int64)[groups // len(self.variants)], np.array(self.variants, dtype=object)[groups % len(self.variants)]],
+            names=['experiment_id', 'variant'],
+        )
+        return pd.DataFrame({'n': n[observed], 'x': x[observed]}, index=index)
+
+    def to_frame(self):
+        """
+        The sessions back as a DataFrame with compact dtypes (int32 ids, categorical variant, datetime64 dates), for code
+        that needs one. This allocates, so prefer the slices
+        """
+        sizes = np.diff(self._group_offsets)
+        groups = np.repeat(np.arange(len(sizes)), sizes)
+        converted = np.concatenate([self.converted(experiment_id) for experiment_id in self.experiment_ids.tolist()]) if len(self) else np.empty(0, dtype=bool)
+        return pd.DataFrame({
+            'experiment_id': self.experiment_ids[groups // len(self.variants)],
+            'variant': pd.Categorical.from_codes(groups % len(self.variants), self.variants),
+            'user_id': self._user_ids,
+            'session_date': (self._day_offsets.astype(np.int64) + self._first_day).astype('datetime64[D]'),
+            'converted': converted,
+        })
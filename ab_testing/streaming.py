@@ -0,0 +1,136 @@
+"""
+Out-of-core version of count_users_by_variant: reads the sessions file in fixed-size chunks and keeps only one
+(key, converted) pair per distinct (experiment, variant, user), so memory grows with users rather than sessions.
+"""
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNKSIZE = 1_000_000
+
+SESSION_COLUMNS = ['experiment_id', 'variant', 'user_id', 'converted']
+SESSION_DTYPES = {'experiment_id': 'int32', 'variant': 'category', 'user_id': 'int32', 'converted': 'bool'}
+
+#(experiment_id, variant, user_id) packed into one int64: experiment in the top bits, then an 8-bit variant code, then the user id
+_EXPERIMENT_SHIFT = 40
+_VARIANT_SHIFT = 32
+
+
+def _dedupe(keys, converted):
+    """
+    Sorts keys and collapses duplicates, a user counts as converted if any of their sessions converted
+    """
+    if len(keys) == 0:
+        return keys, converted
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    converted = converted[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.logical_or.reduceat(converted, starts)
+
+
+class SessionAggregator:
+    """
+    Feed it session chunks with update(), then read the same n/x counts count_users_by_variant returns from counts()
+    """
+
+    def __init__(self):
+        self.variants = []
+        self._variant_codes = {}
+        self._keys = np.empty(0, dtype=np.int64)
+        self._converted = np.empty(0, dtype=bool)
+        self._pending_keys = []
+        self._pending_converted = []
+        self._pending_size = 0
+
+    def _variant_code(self, variant):
+        if variant not in self._variant_codes:
+            if len(self.variants) == 256:
+                raise ValueError("SessionAggregator supports at most 256 distinct variants.")
+            self._variant_codes[variant] = len(self.variants)
+            self.variants.append(variant)
+        return self._variant_codes[variant]
+
+    def update(self, chunk):
+        """
+        Adds a DataFrame of sessions (experiment_id, variant, user_id, converted) to the running state
+        """
+        if len(chunk) == 0:
+            return
+        variants = chunk['variant'].astype('category')
+        self.update_arrays(
+            chunk['experiment_id'].to_numpy(),
+            variants.cat.codes.to_numpy(),
+            list(variants.cat.categories),
+            chunk['user_id'].to_numpy(),
+            chunk['converted'].to_numpy(dtype=bool),
+        )
+
+    def update_arrays(self, experiment_ids, variant_codes, variant_names, user_ids, converted):
+        """
+        Same as update() for plain arrays, with the variant column dictionary-encoded: variant_codes index into variant_names.
+        Lets columnar readers hand their buffers over without building a DataFrame
+        """
+        if len(user_ids) == 0:
+            return
+        code_lookup = np.array([self._variant_code(variant) for variant in variant_names], dtype=np.int64)
+        user_ids = user_ids.astype(np.int64)
+        if user_ids.min() < 0 or user_ids.max() >= 1 << _VARIANT_SHIFT:
+            raise ValueError("user_id values must fit in 32 unsigned bits.")
+        keys = (
+            (experiment_ids.astype(np.int64) << _EXPERIMENT_SHIFT)
+            | (code_lookup[variant_codes] << _VARIANT_SHIFT)
+            | user_ids
+        )
+        keys, converted = _dedupe(keys, converted.astype(bool, copy=False))
+        self._pending_keys.append(keys)
+        self._pending_converted.append(converted)
+        self._pending_size += len(keys)
+        #Merging costs a sort of the whole state, so only do it once the buffered chunks are as big as the state
+        if self._pending_size >= max(len(self._keys), DEFAULT_CHUNKSIZE):
+            self._merge()
+
+    def _merge(self):
+        if not self._pending_keys:
+            return
+        self._keys, self._converted = _dedupe(
+            np.concatenate([self._keys, *self._pending_keys]),
+            np.concatenate([self._converted, *self._pending_converted]),
+        )
+        self._pending_keys = []
+        self._pending_converted = []
+        self._pending_size = 0
+
+    def counts(self):
+        """
+        DataFrame indexed by (experiment_id, variant) with n (distinct users) and x (users that converted)
+        """
+        self._merge()
+        groups = self._keys >> _VARIANT_SHIFT
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else np.empty(0, dtype=np.int64)
+        group_keys = groups[starts]
+        n = np.diff(np.r_[starts, len(groups)])
+        x = np.add.reduceat(self._converted.astype(np.int64), starts) if len(starts) else np.empty(0, dtype=np.int64)
+        index = pd.MultiIndex.from_arrays(
+            [group_keys >> (_EXPERIMENT_SHIFT - _VARIANT_SHIFT), [self.variants[code] for code in group_keys & 0xFF]],
+            names=['experiment_id', 'variant'],
+        )
+        return pd.DataFrame({'n': n, 'x': x}, index=index)
+
+
+def aggregate_sessions_csv(path, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Streams a user_sessions CSV through a SessionAggregator and returns the per-(experiment_id, variant) n/x counts
+    """
+    aggregator = SessionAggregator()
+    reader = pd.read_csv(
+        path,
+        usecols=SESSION_COLUMNS,
+        dtype=SESSION_DTYPES,
+        true_values=['True', 'true', '1'],
+        false_values=['False', 'false', '0'],
+        chunksize=chunksize,
+    )
+    with reader:
+        for chunk in reader:
+            aggregator.update(chunk)
+    return aggregator.counts()
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from .hypothesis import two_proportion_ztest
+
+RESULTS_SUMMARY_COLUMNS = [
+    'experiment_name', 'control_rate', 'control_size', 'treatment_rate', 'treatment_size',
+    'lift_percent', 'z_score', 'p_value', 'is_significant', 'lower_ci', 'upper_ci',
+]
+
+
+def count_users_by_variant(sessions_df):
+    """
+    Aggregates sessions to user level in one pass and counts users (n) and converted users (x)
+    for every (experiment_id, variant) pair
+    """
+    user_conversions = sessions_df.groupby(['experiment_id', 'variant', 'user_id'], sort=False, observed=True)['converted'].max()
+    return user_conversions.groupby(level=['experiment_id', 'variant'], observed=True).agg(n='size', x='sum')
+
+
+def summarize_experiments(counts_df, experiments):
+    """
+    Builds the whole results_summary table from the per-variant counts with a single vectorized z-test.
+    experiments maps experiment_id -> experiment_name and sets the row order
+    """
+    counts = counts_df.unstack('variant')
+    counts = counts.reindex(list(experiments.keys()))
+    control_n = counts[('n', 'control')].to_numpy()
+    control_x = counts[('x', 'control')].to_numpy()
+    treatment_n = counts[('n', 'treatment')].to_numpy()
+    treatment_x = counts[('x', 'treatment')].to_numpy()
+
+    results = two_proportion_ztest(control_n, control_x, treatment_n, treatment_x)
+    return pd.DataFrame({
+        'experiment_name': list(experiments.values()),
+        'control_rate': np.round(control_x / control_n, 4),
+        'control_size': control_n.astype(int),
+        'treatment_rate': np.round(treatment_x / treatment_n, 4),
+        'treatment_size': treatment_n.astype(int),
+        'lift_percent': results['lift_percent'],
+        'z_score': results['z_score'],
+        'p_value': results['p_value'],
+        'is_significant': results['p_value'] < 0.05,
+        'lower_ci': np.round(results['lower_ci'], 6),
+        'upper_ci': np.round(results['upper_ci'], 6),
+    })
@@ -0,0 +1,188 @@
+"""
+Deterministic synthetic data in the same schemas as data/*.csv (experiments, users, experiment_assignments,
+user_sessions, daily_metrics), at whatever scale you ask for. Users are generated and written in blocks, so memory
+stays flat from 10^5 to 10^9 sessions; each block has its own seed, so the same seed and block size always give
+the same files. The shape follows the shipped data: about 70% of users in each experiment, 1-4 sessions per
+assignment over the 40 days after it, and an 11% user-level conversion rate before the treatment effect.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+START_DATE = "2024-01-01"
+SIGNUP_DAYS = 61
+SESSION_DAYS = 40
+TOTAL_DAYS = SIGNUP_DAYS + SESSION_DAYS - 1
+ASSIGNMENT_PROBABILITY = 0.7
+MAX_SESSIONS_PER_ASSIGNMENT = 4
+SESSION_CONVERSION_RATE = 0.045
+#Lognormal order values with a median around $150
+ORDER_VALUE_LOG_MEAN = np.log(150)
+ORDER_VALUE_LOG_SIGMA = 0.5
+USERS_PER_BLOCK = 100_000
+
+USER_ATTRIBUTES = {
+    "user_segment": (["returning", "new", "VIP"], [0.45, 0.40, 0.15]),
+    "device_type": (["mobile", "desktop", "tablet"], [0.55, 0.35, 0.10]),
+    "location": (["United States", "Canada", "United Kingdom", "Germany", "Australia"], [0.45, 0.20, 0.15, 0.10, 0.10]),
+    "age_group": (["26-35", "36-45", "18-25", "46-55", "56+"], [0.35, 0.255, 0.25, 0.10, 0.045]),
+}
+METRIC_TYPES = ["conversion", "revenue", "click_through", "engagement"]
+
+
+def expected_sessions_per_user(n_experiments):
+    return ASSIGNMENT_PROBABILITY * n_experiments * (1 + MAX_SESSIONS_PER_ASSIGNMENT) / 2
+
+
+def users_for_sessions(n_sessions, n_experiments=5):
+    """
+    How many users give roughly n_sessions sessions
+    """
+    return max(1, int(round(n_sessions / expected_sessions_per_user(n_experiments))))
+
+
+def make_experiments(n_experiments, seed=0):
+    """
+    experiments.csv rows plus the true relative lift of each experiment (between -5% and +20%) in a lift column
+    """
+    rng = np.random.default_rng(np.random.SeedSequence([seed, 0xE]))
+    experiment_ids = np.arange(1, n_experiments + 1)
+    end_date = (pd.Timestamp(START_DATE) + pd.Timedelta(days=TOTAL_DAYS - 1)).strftime("%Y-%m-%d")
+    return pd.DataFrame({
+        "experiment_id": experiment_ids,
+        "experiment_name": [f"synthetic_experiment_{experiment_id}" for experiment_id in experiment_ids],
+        "start_date": START_DATE,
+        "end_date": end_date,
+        "hypothesis": "Synthetic treatment changes the conversion rate",
+        "metric_type": [METRIC_TYPES[(experiment_id - 1) % len(METRIC_TYPES)] for experiment_id in experiment_ids],
+        "lift": np.round(rng.uniform(-0.05, 0.20, n_experiments), 3),
+    })
+
+
+def _generate_block(block_index, first_user_id, n_users, lifts, seed):
+    rng = np.random.default_rng(np.random.SeedSequence([seed, block_index]))
+    n_experiments = len(lifts)
+    user_ids = np.arange(first_user_id, first_user_id + n_users, dtype=np.int64)
+    signup_days = rng.integers(0, SIGNUP_DAYS, n_users)
+    users = {"user_id": user_ids, "signup_day": signup_days}
+    for column, (values, probabilities) in USER_ATTRIBUTES.items():
+        users[column] = np.asarray(values, dtype=object)[rng.choice(len(values), size=n_users, p=probabilities)]
+
+    #Assignments in user order, then experiment order, like the shipped file. Users are assigned when they sign up
+    assigned_user, assigned_experiment = np.nonzero(rng.random((n_users, n_experiments)) < ASSIGNMENT_PROBABILITY)
+    is_treatment = rng.random(len(assigned_user)) < 0.5
+    assignment_days = signup_days[assigned_user]
+
+    sessions_per_assignment = rng.integers(1, MAX_SESSIONS_PER_ASSIGNMENT + 1, len(assigned_user))
+    session_assignment = np.repeat(np.arange(len(assigned_user)), sessions_per_assignment)
+    offsets = rng.integers(0, SESSION_DAYS, len(session_assignment))
+    order = np.lexsort((offsets, session_assignment))
+    session_assignment = session_assignment[order]
+    session_days = assignment_days[session_assignment] + offsets[order]
+    conversion_rates = SESSION_CONVERSION_RATE * (1 + lifts[assigned_experiment] * is_treatment)
+    converted = rng.random(len(session_assignment)) < conversion_rates[session_assignment]
+    revenue = np.where(converted, rng.lognormal(ORDER_VALUE_LOG_MEAN, ORDER_VALUE_LOG_SIGMA, len(converted)), 0.0)
+
+    #daily_metrics cells are (day, experiment, variant); a user counts once per day however many sessions they had
+    cells = (session_days * n_experiments + assigned_experiment[session_assignment]) * 2 + is_treatment[session_assignment]
+    user_days = session_assignment.astype(np.int64) * TOTAL_DAYS + session_days
+    starts = np.flatnonzero(np.r_[True, user_days[1:] != user_days[:-1]])
+    n_cells = TOTAL_DAYS * n_experiments * 2
+    daily = np.stack([
+        np.bincount(cells[starts], minlength=n_cells),
+        np.bincount(cells[starts], weights=np.logical_or.reduceat(converted, starts), minlength=n_cells),
+        np.bincount(cells, weights=revenue, minlength=n_cells),
+    ])
+
+    assignments = {
+        "user_id": user_ids[assigned_user],
+        "experiment_id": assigned_experiment + 1,
+        "is_treatment": is_treatment,
+        "assignment_day": assignment_days,
+    }
+    sessions = {
+        "user_id": user_ids[assigned_user][session_assignment],
+        "experiment_id": assigned_experiment[session_assignment] + 1,
+        "is_treatment": is_treatment[session_assignment],
+        "session_day": session_days,
+        "converted": converted,
+    }
+    return users, assignments, sessions, daily
+
+
+def generate_dataset(out_dir, n_sessions=1_000_000, n_experiments=5, seed=0, users_per_block=USERS_PER_BLOCK):
+    """
+    Writes experiments.csv, users.csv, experiment_assignments.csv, user_sessions.csv and daily_metrics.csv to out_dir
+    (overwriting them) with roughly n_sessions sessions. Returns {table name: rows written}
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    dates = pd.date_range(START_DATE, periods=TOTAL_DAYS).strftime("%Y-%m-%d").to_numpy()
+    variants = np.array(["control", "treatment"], dtype=object)
+
+    experiments_df = make_experiments(n_experiments, seed)
+    experiments_df.drop(columns="lift").to_csv(out_dir / "experiments.csv", index=False)
+    lifts = experiments_df["lift"].to_numpy()
+
+    n_users = users_for_sessions(n_sessions, n_experiments)
+    rows = {"experiments": n_experiments, "users": 0, "experiment_assignments": 0, "user_sessions": 0}
+    daily = np.zeros((3, TOTAL_DAYS * n_experiments * 2))
+    paths = {table_name: out_dir / f"{table_name}.csv" for table_name in ("users", "experiment_assignments", "user_sessions")}
+    files = {table_name: open(path, "w", newline="", encoding="utf-8") for table_name, path in paths.items()}
+    try:
+        for block_index, first_user in enumerate(range(0, n_users, users_per_block)):
+            users, assignments, sessions, block_daily = _generate_block(
+                block_index, first_user + 1, min(users_per_block, n_users - first_user), lifts, seed
+            )
+            daily += block_daily
+            header = block_index == 0
+
+            pd.DataFrame({
+                "user_id": users["user_id"],
+                "signup_date": dates[users["signup_day"]],
+                **{column: users[column] for column in USER_ATTRIBUTES},
+            }).to_csv(files["users"], index=False, header=header)
+
+            n_assignments = len(assignments["user_id"])
+            pd.DataFrame({
+                "assignment_id": np.arange(rows["experiment_assignments"] + 1, rows["experiment_assignments"] + n_assignments + 1),
+                "user_id": assignments["user_id"],
+                "experiment_id": assignments["experiment_id"],
+                "variant": variants[assignments["is_treatment"].astype(np.int64)],
+                "assignment_date": dates[assignments["assignment_day"]],
+            }).to_csv(files["experiment_assignments"], index=False, header=header)
+
+            n_block_sessions = len(sessions["user_id"])
+            pd.DataFrame({
+                "session_id": np.arange(rows["user_sessions"] + 1, rows["user_sessions"] + n_block_sessions + 1),
+                "user_id": sessions["user_id"],
+                "experiment_id": sessions["experiment_id"],
+                "variant": variants[sessions["is_treatment"].astype(np.int64)],
+                "session_date": dates[sessions["session_day"]],
+                "converted": sessions["converted"],
+            }).to_csv(files["user_sessions"], index=False, header=header)
+
+            rows["users"] += len(users["user_id"])
+            rows["experiment_assignments"] += n_assignments
+            rows["user_sessions"] += n_block_sessions
+    finally:
+        for f in files.values():
+            f.close()
+
+    #Cells are laid out (day, experiment, variant), the same order the shipped daily_metrics.csv uses
+    cells = np.flatnonzero(daily[0] > 0)
+    total_users, total_conversions, total_revenue = daily[:, cells]
+    daily_metrics_df = pd.DataFrame({
+        "date": dates[cells // (n_experiments * 2)],
+        "experiment_id": cells // 2 % n_experiments + 1,
+        "variant": variants[cells % 2],
+        "total_users": total_users.astype(np.int64),
+        "total_conversions": total_conversions.astype(np.int64),
+        "conversion_rate": np.round(total_conversions / total_users, 4),
+        "total_revenue": np.round(total_revenue, 2),
+        "avg_revenue_per_user": np.round(total_revenue / total_users, 2),
+    })
+    daily_metrics_df.to_csv(out_dir / "daily_metrics.csv", index=False)
+    rows["daily_metrics"] = len(daily_metrics_df)
+    return rows
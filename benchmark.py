@@ -0,0 +1,227 @@
+"""
+Benchmarks the pipeline on synthetic data: generating it, the batch summary (in memory, from the compact session store and streamed), power/MDE,
+loading it into SQLite (rollups, segment cube and data-quality checks included), every dashboard query and the Bayesian pass over every
+experiment's periods. Each stage runs in a fresh process so its peak RSS is its own. One JSON line per run is appended
+to the output file, and the run is compared with the last one at the same scale, so regressions show up between releases.
+
+Usage: python benchmark.py [--sessions 1000000] [--experiments 5] [--seed 0] [--work-dir benchmarks/work]
+                           [--output benchmarks/results.jsonl] [--stages generate summary_streaming ...]
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+#Sessions above this are only summarized by the streaming aggregator, reading them whole would need too much memory
+IN_MEMORY_LIMIT = 20_000_000
+STAGES = ["generate", "summary_in_memory", "summary_compact", "summary_streaming", "power_mde", "load", "queries", "bayesian"]
+#Parameters every dashboard query gets called with, one call per experiment
+QUERY_PARAMS = {
+    "conversion_rates_over_time.txt": lambda experiment_id: [(grain, experiment_id) for grain in ("daily", "weekly", "monthly")],
+    "experiments_results_summary.txt": lambda experiment_id: [(experiment_id,)],
+    "segment_cube.txt": lambda experiment_id: [(experiment_id,)],
+    "data_quality_checks.txt": lambda experiment_id: [(experiment_id,)],
+    "traffic_forecast.txt": lambda experiment_id: [(experiment_id,)],
+}
+
+
+def _peak_rss_mib():
+    try:
+        import resource
+    except ImportError:
+        #No resource module on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and KiB everywhere else
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _experiments(data_dir):
+    import pandas as pd
+    experiments_df = pd.read_csv(Path(data_dir) / "experiments.csv")
+    return dict(zip(experiments_df["experiment_id"], experiments_df["experiment_name"]))
+
+
+def _generate(config):
+    from ab_testing.synthetic import generate_dataset
+    return {"rows": generate_dataset(config["data_dir"], config["sessions"], config["experiments"], config["seed"])}
+
+
+def _summary_in_memory(config):
+    import pandas as pd
+    from ab_testing import count_users_by_variant, summarize_experiments
+    sessions_df = pd.read_csv(Path(config["data_dir"]) / "user_sessions.csv")
+    summarize_experiments(count_users_by_variant(sessions_df), _experiments(config["data_dir"]))
+    return {}
+
+
+def _summary_compact(config):
+    from ab_testing import SessionStore, summarize_experiments
+    session_store = SessionStore.from_csv(Path(config["data_dir"]) / "user_sessions.csv")
+    summarize_experiments(session_store.counts(), _experiments(config["data_dir"]))
+    return {"store_mib": session_store.nbytes / (1024 * 1024)}
+
+
+def _summary_streaming(config):
+    from ab_testing import aggregate_sessions_csv, summarize_experiments
+    summary_df = summarize_experiments(aggregate_sessions_csv(Path(config["data_dir"]) / "user_sessions.csv"), _experiments(config["data_dir"]))
+    #The load stage picks this up, so the results query has something to read
+    summary_df.to_csv(Path(config["data_dir"]) / "results_summary.csv", index=False)
+    return {}
+
+
+def _power_mde(config):
+    import numpy as np
+    import pandas as pd
+    from ab_testing import analyze_power_from_results, planning_grid
+    analyze_power_from_results(pd.read_csv(Path(config["data_dir"]) / "results_summary.csv"))
+    grid = planning_grid(np.linspace(0.01, 0.3, 100), np.linspace(0.01, 0.3, 100), np.linspace(1_000, 1_000_000, 100))
+    return {"planning_scenarios": len(grid)}
+
+
+def _load(config):
+    from load_csv_files import load_all_csvs
+    db_path = Path(config["db_path"])
+    for path in db_path.parent.glob(db_path.name + "*"):
+        path.unlink()
+    load_all_csvs(config["data_dir"], db_path)
+    return {"db_size_mib": db_path.stat().st_size / (1024 * 1024)}
+
+
+def _queries(config):
+    from ab_testing.db import ReadOnlyConnectionPool, load_queries
+    queries = load_queries(config["queries_dir"])
+    pool = ReadOnlyConnectionPool(config["db_path"])
+    timings = {}
+    try:
+        for query_name, params_for in QUERY_PARAMS.items():
+            if query_name not in queries:
+                continue
+            calls = [params for experiment_id in _experiments(config["data_dir"]) for params in params_for(experiment_id)]
+            start = time.perf_counter()
+            for params in calls:
+                pool.read_df(queries[query_name], params)
+            seconds = time.perf_counter() - start
+            timings[query_name] = {"calls": len(calls), "seconds": seconds, "seconds_per_call": seconds / len(calls)}
+    finally:
+        pool.close()
+    return {"queries": timings}
+
+
+def _bayesian(config):
+    import sqlite3
+    from ab_testing.bayesian import bayesian_from_rollups
+    conn = sqlite3.connect(config["db_path"])
+    periods = {}
+    try:
+        for grain in ("weekly", "monthly"):
+            periods[grain] = len(bayesian_from_rollups(conn, grain))
+    finally:
+        conn.close()
+    return {"periods": periods}
+
+
+STAGE_FUNCTIONS = {
+    "generate": _generate,
+    "summary_in_memory": _summary_in_memory,
+    "summary_compact": _summary_compact,
+    "summary_streaming": _summary_streaming,
+    "power_mde": _power_mde,
+    "load": _load,
+    "queries": _queries,
+    "bayesian": _bayesian,
+}
+
+
+def _run_stage(stage, config):
+    start = time.perf_counter()
+    details = STAGE_FUNCTIONS[stage](config)
+    return {"seconds": time.perf_counter() - start, "peak_rss_mib": _peak_rss_mib(), **details}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous_run(output, record):
+    if not output.exists():
+        return None
+    previous = None
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            run = json.loads(line)
+            if all(run.get(key) == record[key] for key in ("sessions", "experiments", "seed")):
+                previous = run
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the A/B testing pipeline on synthetic data")
+    parser.add_argument("--sessions", type=int, default=1_000_000, help="roughly how many sessions to generate")
+    parser.add_argument("--experiments", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", type=Path, default=Path("benchmarks/work"), help="where the synthetic CSVs and database go")
+    parser.add_argument("--output", type=Path, default=Path("benchmarks/results.jsonl"))
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="run only these stages (they expect the earlier ones' files)")
+    args = parser.parse_args()
+
+    config = {
+        "sessions": args.sessions,
+        "experiments": args.experiments,
+        "seed": args.seed,
+        "data_dir": str(args.work_dir / "data"),
+        "db_path": str(args.work_dir / "ab_testing.db"),
+        "queries_dir": "queries",
+    }
+    stages = [stage for stage in STAGES if stage in args.stages]
+    if args.sessions > IN_MEMORY_LIMIT and "summary_in_memory" in stages:
+        print(f"Skipping summary_in_memory above {IN_MEMORY_LIMIT:,} sessions")
+        stages.remove("summary_in_memory")
+
+    record = {
+        "run_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": multiprocessing.cpu_count(),
+        "sessions": args.sessions,
+        "experiments": args.experiments,
+        "seed": args.seed,
+        "stages": {},
+    }
+    #A fresh process per stage, so peak RSS isn't inherited from whatever ran before
+    context = multiprocessing.get_context("spawn")
+    for stage in stages:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(_run_stage, stage, config).result()
+        record["stages"][stage] = result
+        rss = f"{result['peak_rss_mib']:.0f} MiB" if result["peak_rss_mib"] is not None else "n/a"
+        print(f"{stage:<20} {result['seconds']:>10.2f} s   peak RSS {rss}")
+        for query_name, timing in result.get("queries", {}).items():
+            print(f"    {query_name:<35} {timing['seconds_per_call'] * 1000:>8.2f} ms/call ({timing['calls']} calls)")
+
+    previous = _previous_run(args.output, record)
+    if previous is not None:
+        print(f"\nCompared with {previous['run_at']} ({previous.get('commit')}):")
+        for stage, result in record["stages"].items():
+            if stage in previous["stages"]:
+                change = (result["seconds"] / previous["stages"][stage]["seconds"] - 1) * 100
+                print(f"{stage:<20} {change:>+8.1f}%")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"\nResults appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,96 @@
+import os
 from pathlib import Path
-import sqlite3
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 
+from ab_testing import instrumentation
+from ab_testing.bayesian import bayesian_ab_test, bayesian_by_period
+from ab_testing.cache import StaleWhileRevalidateCache
+from ab_testing.db import ReadOnlyConnectionPool, load_queries
+from ab_testing.figures import confidence_interval_figure, conversion_rates_figure
+from ab_testing.forecast import forecast_durations
+from ab_testing.segments import SEGMENT_DIMENSIONS, segment_tests
+
 QUERIES = Path("queries")
 DB_PATH = "ab_testing.db"
-
-def load_query(filename: str) -> str:
-    return (QUERIES / filename).read_text(encoding="utf-8")
-
-def run_query_df(query: str, params: tuple = ()) -> pd.DataFrame:
-    with sqlite3.connect(DB_PATH) as conn:
-        return pd.read_sql_query(query, conn, params=params)
-
-@st.cache_data
-def get_df(query_name: str, params: tuple):
-    query = load_query(query_name)
-    return run_query_df(query, params)
+#AB_STORAGE=parquet reads the columnar datasets written by load_csv_files.py --parquet-dir instead of SQLite
+STORAGE = os.environ.get("AB_STORAGE", "sqlite")
+PARQUET_DIR = Path(os.environ.get("AB_PARQUET_DIR", "data/parquet"))
+#Cached results older than this (seconds) are served once more while they're recomputed in the background
+CACHE_TTL = float(os.environ.get("AB_CACHE_TTL", 300))
+#How often (seconds) the background watcher checks for a new load to prewarm
+CACHE_POLL_INTERVAL = float(os.environ.get("AB_CACHE_POLL_INTERVAL", 30))
+#Every view the dashboard shows for one experiment, prewarmed for all experiments after each load
+EXPERIMENT_VIEWS = [
+    ("experiments_results_summary.txt", lambda experiment_id: (experiment_id,)),
+    *[("conversion_rates_over_time.txt", lambda experiment_id, grain=grain: (grain, experiment_id)) for grain in ("weekly", "monthly", "daily")],
+    ("segment_cube.txt", lambda experiment_id: (experiment_id,)),
+    ("data_quality_checks.txt", lambda experiment_id: (experiment_id,)),
+    ("traffic_forecast.txt", lambda experiment_id: (experiment_id,)),
+]
+
+#Shared by every session of the app: the connection pool and the query text, loaded once
+@st.cache_resource
+def get_pool() -> ReadOnlyConnectionPool:
+    return ReadOnlyConnectionPool(DB_PATH)
+
+@st.cache_resource
+def get_queries() -> dict:
+    return load_queries(QUERIES)
+
+def run_query_df(query: str, params: tuple = (), name: str = None) -> pd.DataFrame:
+    return get_pool().read_df(query, params, name)
+
+def load_df(query_name: str, params: tuple) -> pd.DataFrame:
+    #Runs on cache misses and background refreshes, never for a cache hit
+    if STORAGE == "parquet":
+        from ab_testing.columnar import QUERY_FUNCTIONS
+        with instrumentation.timer("columnar_query"):
+            return QUERY_FUNCTIONS[query_name](PARQUET_DIR, *params)
+    query = get_queries()[query_name]
+    return run_query_df(query, params, query_name)
+
+def current_data_version() -> int:
+    if STORAGE == "parquet":
+        from ab_testing.columnar import dataset_version
+        return dataset_version(PARQUET_DIR)
+    return get_pool().data_version()
+
+def prewarm_keys() -> list:
+    experiment_ids = load_df("experiments.txt", ())["experiment_id"].astype(int).tolist()
+    return [("experiments.txt", ())] + [(query_name, params_for(experiment_id)) for experiment_id in experiment_ids for query_name, params_for in EXPERIMENT_VIEWS]
+
+#One cache for every session. Results are keyed by query and params and stamped with the data version they came from:
+#expired or out-of-date results are still served while a background thread recomputes them, and a watcher thread
+#prewarms every experiment's views as soon as the loader or the analysis job writes new data.
+#Cached DataFrames are shared between sessions, so treat them as read-only
+@st.cache_resource
+def get_cache() -> StaleWhileRevalidateCache:
+    cache = StaleWhileRevalidateCache(load_df, ttl=CACHE_TTL)
+    cache.watch(current_data_version, prewarm_keys, interval=CACHE_POLL_INTERVAL)
+    return cache
+
+def get_df(query_name: str, params: tuple, data_version: int):
+    with instrumentation.timer("get_df"):
+        return get_cache().get(query_name, params, data_version)
+
+data_version = current_data_version()
+if get_cache().prewarmed_version != data_version:
+    get_cache().prewarm(prewarm_keys(), data_version)
 
 st.set_page_config(page_title="A/B Testing Analysis", layout="wide")
 st.title("A/B Testing Dashboard")
 
+#Timings are off unless AB_INSTRUMENTATION=1 or the debug panel is open. Most of the timed work runs on the cache's
+#threads and the metrics are shared by every session, so the switch is process-wide too and follows the latest rerun.
+#The default has to stay fixed: Streamlit would treat a checkbox with a new default as a new widget and drop the click
+show_debug = st.sidebar.checkbox("Show debug panel", value=instrumentation.ENABLED_AT_START)
+if show_debug:
+    instrumentation.enable()
+else:
+    instrumentation.disable()
+
 st.header("Experiment Analysis")
 st.info(
     """
@@ -41,65 +110,228 @@ st.info(
 
 st.subheader("Conversion Rates Over Time")
 
-experiment_mapping_dict = {'Checkout Button Color':1, 'Pricing Display Test':2, 'Email Subject Line': 3, 'Product Page Layout': 4, 'Free Shipping Threshold': 5}
+#Experiments come from the database, so new ones show up here without touching this file
+experiments_df = get_df("experiments.txt", (), data_version)
+experiment_names = {int(experiment_id): name for experiment_id, name in zip(experiments_df["experiment_id"], experiments_df["experiment_name"])}
 
 col1,col2 = st.columns(2)
 with col1:
-    experiment = st.selectbox('Select an experiment',['Checkout Button Color', 'Pricing Display Test', 'Email Subject Line', 'Product Page Layout', 'Free Shipping Threshold'])
-selected_experiment = experiment_mapping_dict[experiment]
+    selected_experiment = st.selectbox('Select an experiment', list(experiment_names), format_func=lambda experiment_id: experiment_names[experiment_id].replace("_", " ").title())
 
 
 with col2:
     time_option = st.selectbox(
         "Choose a time period",
-        ["Weekly", "Monthly"]
+        ["Weekly", "Monthly", "Daily"]
     )
 
+#The loader checks every experiment's data on the way in; anything that failed makes the results below suspect
+quality_checks_df = get_df("data_quality_checks.txt", (selected_experiment,), data_version)
+failed_checks = quality_checks_df[quality_checks_df["status"] == "fail"]
+warned_checks = quality_checks_df[quality_checks_df["status"] == "warn"]
+if len(failed_checks):
+    st.error("**Data quality checks failed, treat these results with caution:** " + "; ".join(
+        f"{name.replace('_', ' ')}: {detail}" for name, detail in zip(failed_checks["check_name"], failed_checks["detail"])
+    ))
+if len(warned_checks):
+    st.warning("**Data quality warnings:** " + "; ".join(
+        f"{name.replace('_', ' ')}: {detail}" for name, detail in zip(warned_checks["check_name"], warned_checks["detail"])
+    ))
+with st.expander(f"Data quality checks ({len(quality_checks_df) - len(failed_checks) - len(warned_checks)} of {len(quality_checks_df)} passed)"):
+    st.dataframe(quality_checks_df, hide_index=True, use_container_width=True)
+
 experiments_results_summary = 'experiments_results_summary.txt'
-experiments_results_summary_df = get_df(experiments_results_summary,(selected_experiment,))
+experiments_results_summary_df = get_df(experiments_results_summary,(selected_experiment,), data_version)
 metric1, metric2, metric3, metric4 = st.columns(4)
-metric1.metric("Lift", f"{experiments_results_summary_df['lift_percent'].iloc[0]:+.2f}%" if experiments_results_summary_df["lift_percent"] is not None else "N/A")
-metric2.metric("p-value", f"{experiments_results_summary_df['p_value'].iloc[0]:.4g}")
-metric3.metric("z-score", f"{experiments_results_summary_df['z_score'].iloc[0]:.3f}")
-metric4.metric("Significant?", "Yes ✅" if experiments_results_summary_df["p_value"].iloc[0] < 0.05 else "No ❌")
-
-
-
-##CONFIDENCE INTERVAL PLOTS SHOULD BE RIGHT HERE!!!!!!!!
+#Nothing to show until statistical_tests.py has analyzed this experiment
+if len(experiments_results_summary_df):
+    metric1.metric("Lift", f"{experiments_results_summary_df['lift_percent'].iloc[0]:+.2f}%")
+    metric2.metric("p-value", f"{experiments_results_summary_df['p_value'].iloc[0]:.4g}")
+    metric3.metric("z-score", f"{experiments_results_summary_df['z_score'].iloc[0]:.3f}")
+    metric4.metric("Significant?", "Yes ✅" if experiments_results_summary_df["p_value"].iloc[0] < 0.05 else "No ❌")
+else:
+    for metric, label in zip((metric1, metric2, metric3, metric4), ("Lift", "p-value", "z-score", "Significant?")):
+        metric.metric(label, "N/A")
 
 
 
+#Confidence intervals: each variant's rate and the treatment - control difference, the same plots the exported reports have
+if len(experiments_results_summary_df):
+    with instrumentation.timer("figure:confidence_intervals"):
+        st.plotly_chart(confidence_interval_figure(experiments_results_summary_df.iloc[0]), use_container_width=True)
 
 
+#Both variants come back from the pre-aggregated rollups in one query
+conversion_rates_df = get_df("conversion_rates_over_time.txt", (time_option.lower(), selected_experiment), data_version)
+# if option == "Weekly":
+#     df["time_period"] = pd.to_datetime(df["time_period"])
+#df["time_period"] = pd.to_datetime(df["time_period"])
+with instrumentation.timer("figure:conversion_rates"):
+    conversion_rates_fig = conversion_rates_figure(conversion_rates_df, f"{time_option} period")
+    st.plotly_chart(conversion_rates_fig, use_container_width=True)
+
+
+st.subheader("Bayesian Analysis")
+
+#Computed on every load from the counts: a few milliseconds for one experiment, and for its periods in one vectorized pass
+bayes1, bayes2, bayes3, bayes4 = st.columns(4)
+if len(experiments_results_summary_df) and experiments_results_summary_df.reindex(columns=["control_conversions", "treatment_conversions"]).notna().all(axis=None):
+    row = experiments_results_summary_df.iloc[0]
+    with instrumentation.timer("bayesian"):
+        bayesian = bayesian_ab_test(row["control_size"], row["control_conversions"], row["treatment_size"], row["treatment_conversions"])
+    bayes1.metric("P(treatment better)", f"{bayesian['prob_treatment_better']:.1%}")
+    bayes2.metric("Expected loss, ship treatment", f"{bayesian['expected_loss_treatment']:.3%}")
+    bayes3.metric("Expected loss, keep control", f"{bayesian['expected_loss_control']:.3%}")
+    bayes4.metric("95% credible interval for lift", f"[{bayesian['lift_lower_percent']:+.1f}%, {bayesian['lift_upper_percent']:+.1f}%]")
+else:
+    #No results yet, results stored before the converter counts were, or the parquet results_summary export which has none
+    for metric, label in zip((bayes1, bayes2, bayes3, bayes4), ("P(treatment better)", "Expected loss, ship treatment", "Expected loss, keep control", "95% credible interval for lift")):
+        metric.metric(label, "N/A")
+
+with instrumentation.timer("bayesian_by_period"):
+    bayesian_periods_df = bayesian_by_period(conversion_rates_df)
+with instrumentation.timer("figure:bayesian"):
+    bayesian_fig = px.line(
+        bayesian_periods_df,
+        x="time_period",
+        y="prob_treatment_better",
+        markers=True,
+        range_y=[0, 1],
+        labels={"time_period": f"{time_option} period", "prob_treatment_better": "P(treatment better), that period's users"},
+    )
+    st.plotly_chart(bayesian_fig, use_container_width=True)
 
 
+st.subheader("Duration Forecast")
 
+col1, col2 = st.columns(2)
+with col1:
+    forecast_lift = st.slider("Lift to detect (%)", min_value=1, max_value=30, value=10)
+with col2:
+    forecast_power = st.select_slider("Target power", options=[0.7, 0.8, 0.9, 0.95], value=0.8)
+
+#The arrival trend is fitted by the loader as days arrive and the baseline comes from the latest analysis run; projecting them over a grid of lifts is one vectorized call
+traffic_forecast_df = get_df("traffic_forecast.txt", (selected_experiment,), data_version)
+if len(traffic_forecast_df) and traffic_forecast_df["control_rate"].notna().all():
+    lift_grid = [lift / 100 for lift in range(1, 31)]
+    with instrumentation.timer("forecast_durations"):
+        forecast_df = forecast_durations(traffic_forecast_df, lift_grid, power=forecast_power)
+    selected_forecast = forecast_df.iloc[forecast_lift - 1]
+
+    def _days_label(days):
+        return "Not at this traffic" if days == float("inf") else f"{days:.0f} days"
+
+    forecast1, forecast2, forecast3, forecast4 = st.columns(4)
+    forecast1.metric("New users per group per day", f"{selected_forecast['daily_users_per_group']:,.0f}", f"{selected_forecast['daily_users_trend']:+.2f}/day")
+    forecast2.metric("Baseline conversion rate", f"{selected_forecast['baseline_rate']:.2%}")
+    forecast3.metric("Days to significance", _days_label(selected_forecast["days_to_significance"]))
+    forecast4.metric(f"Days to {forecast_power:.0%} power", _days_label(selected_forecast["days_to_target_power"]))
+    st.caption(
+        f"Days after the last day of traffic ({traffic_forecast_df['last_date'].iloc[0]}) until a true {forecast_lift}% lift would be "
+        f"expected to reach significance, and until the test would have {forecast_power:.0%} power to detect it, if new users keep arriving at the current trend."
+    )
 
-conversion_period = "conversion_rates_over_time.txt"
-if time_option == "Weekly":
-    conversion_period = "conversion_rates_over_time_weekly.txt"
+    forecast_long_df = forecast_df.assign(lift_percent=forecast_df["relative_lift"] * 100).melt(
+        id_vars="lift_percent",
+        value_vars=["days_to_significance", "days_to_target_power"],
+        var_name="milestone",
+        value_name="days",
+    )
+    with instrumentation.timer("figure:forecast"):
+        forecast_fig = px.line(
+            forecast_long_df[forecast_long_df["days"] != float("inf")],
+            x="lift_percent",
+            y="days",
+            color="milestone",
+            markers=True,
+            log_y=True,
+            labels={"lift_percent": "True lift (%)", "days": "Days from the last day of traffic"},
+        )
+        st.plotly_chart(forecast_fig, use_container_width=True)
+elif len(traffic_forecast_df):
+    st.info("No analysis results for this experiment yet; run statistical_tests.py to forecast from them.")
 else:
-    conversion_period = "conversion_rates_over_time_monthly.txt"
+    st.info("No sessions loaded for this experiment yet.")
 
-conversion_rates_control_df = get_df(conversion_period,(selected_experiment, 'control'))
-conversion_rates_treatment_df = get_df(conversion_period,(selected_experiment, 'treatment'))
-
-conversion_rates_df = pd.concat([conversion_rates_control_df, conversion_rates_treatment_df], ignore_index=True)
-# if option == "Weekly":
-#     df["time_period"] = pd.to_datetime(df["time_period"])
-#df["time_period"] = pd.to_datetime(df["time_period"])
-conversion_rates_fig = px.line(
-    conversion_rates_df,
-    x="time_period",
-    y="conversion_rate",
-    color="variant",          
-    markers=True
-)
-st.plotly_chart(conversion_rates_fig, use_container_width=True)
 
+st.subheader("Segmentation Analysis")
 
+col1, col2 = st.columns(2)
+with col1:
+    dimension = st.selectbox("Segment by", SEGMENT_DIMENSIONS, format_func=lambda name: name.replace("_", " ").title())
+with col2:
+    correction = st.selectbox("Multiple-comparison correction", ["Holm", "Benjamini-Hochberg"])
 
+#The cube is precomputed by the loader, so slicing by another dimension is just a filter. P-values are corrected over every segment of the experiment
+segment_cube_df = get_df("segment_cube.txt", (selected_experiment,), data_version)
+with instrumentation.timer("segment_tests"):
+    segment_results_df = segment_tests(segment_cube_df, method="holm" if correction == "Holm" else "fdr_bh")
+segment_results_df = segment_results_df[segment_results_df["dimension"] == dimension]
 
+segment_results_df = segment_results_df.assign(
+    difference=segment_results_df["treatment_rate"] - segment_results_df["control_rate"],
+    significant=segment_results_df["is_significant"].map({True: "Significant", False: "Not significant"}),
+)
+with instrumentation.timer("figure:segments"):
+    segment_fig = px.bar(
+        segment_results_df,
+        x="segment_value",
+        y="difference",
+        color="significant",
+        error_y=segment_results_df["upper_ci"] - segment_results_df["difference"],
+        error_y_minus=segment_results_df["difference"] - segment_results_df["lower_ci"],
+        labels={"segment_value": dimension.replace("_", " ").title(), "difference": "Treatment - control conversion rate"},
+    )
+    st.plotly_chart(segment_fig, use_container_width=True)
+st.dataframe(
+    segment_results_df[["segment_value", "control_users", "control_rate", "treatment_users", "treatment_rate", "lift_percent", "p_value", "adjusted_p_value", "is_significant"]],
+    hide_index=True,
+    use_container_width=True,
+)
 
 
+if show_debug:
+    st.header("Debug")
+    metrics = instrumentation.snapshot()
+
+    cache_stats = get_cache().stats()
+    cache1, cache2, cache3, cache4, cache5 = st.columns(5)
+    cache1.metric("Fresh hits", cache_stats["fresh_hits"])
+    cache2.metric("Stale hits", cache_stats["stale_hits"])
+    cache3.metric("Misses", cache_stats["misses"])
+    cache4.metric("Background refreshes", cache_stats["refreshes"])
+    cache5.metric("Cached results", cache_stats["entries"])
+
+    st.subheader("Stage timings")
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "stage": stage,
+                "count": histogram["count"],
+                "mean_ms": histogram["sum"] / histogram["count"] * 1000,
+                "p50_ms (bucket)": instrumentation.quantile(stage, 0.5) * 1000,
+                "p95_ms (bucket)": instrumentation.quantile(stage, 0.95) * 1000,
+                "max_ms": histogram["max"] * 1000,
+            }
+            for stage, histogram in sorted(metrics["histograms"].items())
+        ]),
+        hide_index=True,
+        use_container_width=True,
+    )
 
+    st.subheader("Slowest recent queries")
+    slowest = instrumentation.slowest_queries(10)
+    if not slowest:
+        st.write("No SQL queries recorded yet (results may all be coming from the cache).")
+    else:
+        st.dataframe(
+            pd.DataFrame([{"query": query["name"], "params": str(query["params"]), "ms": query["seconds"] * 1000} for query in slowest]),
+            hide_index=True,
+            use_container_width=True,
+        )
+        explained = st.selectbox("Query plan for", range(len(slowest)), format_func=lambda i: f"{slowest[i]['name']} {slowest[i]['params']}")
+        st.dataframe(get_pool().explain_query_plan(slowest[explained]["sql"], slowest[explained]["params"]), hide_index=True)
+
+    export1, export2 = st.columns(2)
+    export1.download_button("Download Prometheus metrics", instrumentation.to_prometheus(), file_name="ab_testing_metrics.prom")
+    export2.download_button("Download JSON metrics", instrumentation.to_json(), file_name="ab_testing_metrics.json")
@@ -0,0 +1,30 @@
+"""
+Renders every analyzed experiment's report (metric tiles, conversion rates over time, CI plots, power and MDE verdicts)
+to static files for the weekly stakeholder pack, on a pool of worker processes. Experiments whose data hasn't changed
+since the last export are skipped; see ab_testing/reports.py.
+
+Usage: python export_reports.py [--db ab_testing.db] [--output reports] [--formats png pdf] [--grain weekly|monthly|daily]
+                                [--workers N] [--force]
+"""
+import argparse
+import os
+import time
+
+from ab_testing.reports import REPORT_FORMATS, export_reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export one report per experiment from the results in ab_testing.db")
+    parser.add_argument("--db", default="ab_testing.db")
+    parser.add_argument("--output", default="reports", help="directory for the reports, manifest.json and index.html")
+    parser.add_argument("--formats", nargs="+", choices=REPORT_FORMATS, default=["png", "pdf"], help="png, svg and pdf need kaleido and Chrome; html needs neither")
+    parser.add_argument("--grain", choices=["weekly", "monthly", "daily"], default="weekly", help="period of the conversion-over-time chart")
+    #Each worker drives its own headless Chrome through kaleido, so more workers than cores doesn't help
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="render on this many processes")
+    parser.add_argument("--force", action="store_true", help="re-render every report, even unchanged ones")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    statuses = export_reports(args.db, args.output, args.formats, args.grain, args.workers, args.force)
+    rendered = sum(status == "rendered" for status in statuses.values())
+    print(f"{rendered} reports rendered, {len(statuses) - rendered} unchanged, in {time.perf_counter() - start:.1f} s")
+    print(f"Index: {os.path.join(args.output, 'index.html')}")
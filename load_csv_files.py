@@ -1,9 +1,110 @@
+import argparse
+import csv
+import hashlib
+import io
 import sqlite3
-import pandas as pd
+import time
+from datetime import date
 from pathlib import Path
 
-DATA_DIR = Path("data")       
+from ab_testing.forecast import FIRST_SESSIONS_TABLE as FORECAST_FIRST_SESSIONS_TABLE, refresh_forecast_state
+from ab_testing.quality import QUALITY_SOURCES, QUALITY_TABLE, read_quality_checks, read_quality_counts, refresh_quality_counts, write_quality_checks
+from ab_testing.results_store import create_results_tables
+from ab_testing.rollups import refresh_rollups
+from ab_testing.segments import SEGMENT_TABLE, refresh_segment_cube
+from ab_testing.sequential import STATS_TABLE as SEQUENTIAL_STATS_TABLE, refresh_sequential_stats
+
+DATA_DIR = Path("data")
 DB_PATH = Path("ab_testing.db")
+CHUNK_SIZE = 50_000
+STATE_TABLE = "_csv_load_state"
+
+# Column types for the tables we know about. SQLite has no real date type, so DATE columns are
+# normalised to ISO-8601 text: it sorts correctly, indexes well and works with date()/strftime() in the queries.
+# Columns that aren't listed here (or CSVs we don't know about) get no declared type.
+TABLE_SCHEMAS = {
+    "experiments": {
+        "experiment_id": "INTEGER",
+        "experiment_name": "TEXT",
+        "start_date": "DATE",
+        "end_date": "DATE",
+        "hypothesis": "TEXT",
+        "metric_type": "TEXT",
+    },
+    "users": {
+        "user_id": "INTEGER",
+        "signup_date": "DATE",
+        "user_segment": "TEXT",
+        "device_type": "TEXT",
+        "location": "TEXT",
+        "age_group": "TEXT",
+    },
+    "experiment_assignments": {
+        "assignment_id": "INTEGER",
+        "user_id": "INTEGER",
+        "experiment_id": "INTEGER",
+        "variant": "TEXT",
+        "assignment_date": "DATE",
+    },
+    "user_sessions": {
+        "session_id": "INTEGER",
+        "user_id": "INTEGER",
+        "experiment_id": "INTEGER",
+        "variant": "TEXT",
+        "session_date": "DATE",
+        "converted": "BOOLEAN",
+    },
+    "daily_metrics": {
+        "date": "DATE",
+        "experiment_id": "INTEGER",
+        "variant": "TEXT",
+        "total_users": "INTEGER",
+        "total_conversions": "INTEGER",
+        "conversion_rate": "REAL",
+        "total_revenue": "REAL",
+        "avg_revenue_per_user": "REAL",
+    },
+    "results_summary": {
+        "experiment_name": "TEXT",
+        "control_rate": "REAL",
+        "control_size": "INTEGER",
+        "treatment_rate": "REAL",
+        "treatment_size": "INTEGER",
+        "lift_percent": "REAL",
+        "z_score": "REAL",
+        "p_value": "REAL",
+        "is_significant": "BOOLEAN",
+        "lower_ci": "REAL",
+        "upper_ci": "REAL",
+    },
+}
+
+INDEXES = {
+    "user_sessions": [("experiment_id", "variant", "session_date"), ("user_id",)],
+    "experiment_assignments": [("experiment_id", "variant", "assignment_date"), ("user_id",)],
+    "daily_metrics": [("experiment_id", "variant", "date")],
+}
+
+# Parents first, so anything that reads one table while loading another sees it already loaded
+LOAD_ORDER = ["experiments", "users", "experiment_assignments", "user_sessions", "daily_metrics"]
+# Tables the segment cube is built from; it's rebuilt whenever one of them changes
+SEGMENT_SOURCES = ["users", "experiment_assignments", "user_sessions"]
+
+
+def _to_bool(value: str) -> int:
+    return 1 if value.strip().lower() in ("true", "1", "t", "yes") else 0
+
+def _to_date(value: str) -> str:
+    return date.fromisoformat(value[:10]).isoformat()
+
+CONVERTERS = {
+    "INTEGER": int,
+    "REAL": float,
+    "BOOLEAN": _to_bool,
+    "DATE": _to_date,
+    "TEXT": str,
+    "": str,
+}
 
 def csv_to_table_name(csv_path: Path) -> str:
     """
@@ -12,25 +113,234 @@ def csv_to_table_name(csv_path: Path) -> str:
     """
     return csv_path.stem.lower()
 
-def load_all_csvs():
-    csv_files = list(DATA_DIR.glob("*.csv"))
+def _column_types(table_name: str, header: list) -> list:
+    """
+    (column, declared type) for every named column in the header. Blank headers, like the unnamed
+    index column pandas writes by default, are dropped.
+    """
+    schema = TABLE_SCHEMAS.get(table_name, {})
+    return [(column, schema.get(column, "")) for column in header if column.strip()]
+
+def _file_fingerprint(csv_path: Path, prefix_size: int):
+    """
+    sha256 of the whole file and of its first prefix_size bytes, computed in one read
+    """
+    hasher = hashlib.sha256()
+    prefix_digest = None
+    read_so_far = 0
+    with open(csv_path, "rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block:
+                break
+            if prefix_digest is None and read_so_far + len(block) >= prefix_size:
+                hasher.update(block[:prefix_size - read_so_far])
+                prefix_digest = hasher.hexdigest()
+                hasher.update(block[prefix_size - read_so_far:])
+            else:
+                hasher.update(block)
+            read_so_far += len(block)
+    if prefix_digest is None and read_so_far >= prefix_size:
+        prefix_digest = hasher.hexdigest()
+    return hasher.hexdigest(), prefix_digest
+
+def _ends_with_newline(csv_path: Path, size: int) -> bool:
+    with open(csv_path, "rb") as f:
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+def _read_rows(csv_path: Path, offset: int = 0):
+    """
+    Returns (header, csv reader, handle to close) for the file, with rows starting at byte offset (0 means right after the header)
+    """
+    f = open(csv_path, "rb")
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    reader = csv.reader(text)
+    header = next(reader)
+    if offset:
+        text.detach()
+        f.seek(offset)
+        text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+        reader = csv.reader(text)
+    return header, reader, text
+
+def _create_table(conn: sqlite3.Connection, table_name: str, columns: list):
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    column_sql = ", ".join(f'"{column}" {column_type}'.strip() for column, column_type in columns)
+    conn.execute(f'CREATE TABLE "{table_name}" ({column_sql})')
+
+def _create_indexes(conn: sqlite3.Connection, table_name: str):
+    for index_columns in INDEXES.get(table_name, []):
+        index_name = f"idx_{table_name}_{'_'.join(index_columns)}"
+        column_sql = ", ".join(f'"{column}"' for column in index_columns)
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_sql})')
+
+def _insert_rows(conn: sqlite3.Connection, table_name: str, header: list, columns: list, rows, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Converts rows to their column types and inserts them with executemany, chunk_size rows at a time
+    """
+    positions = [header.index(column) for column, _ in columns]
+    converters = [CONVERTERS.get(column_type, str) for _, column_type in columns]
+    placeholders = ", ".join("?" for _ in columns)
+    insert_sql = f'INSERT INTO "{table_name}" VALUES ({placeholders})'
+
+    def convert(row):
+        return tuple(
+            converter(row[position]) if position < len(row) and row[position] != "" else None
+            for position, converter in zip(positions, converters)
+        )
+
+    inserted = 0
+    chunk = []
+    for row in rows:
+        if not row:
+            continue
+        chunk.append(convert(row))
+        if len(chunk) >= chunk_size:
+            conn.executemany(insert_sql, chunk)
+            inserted += len(chunk)
+            chunk = []
+    if chunk:
+        conn.executemany(insert_sql, chunk)
+        inserted += len(chunk)
+    return inserted
+
+def _table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone() is not None
+
+def load_csv(conn: sqlite3.Connection, csv_path: Path, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    Loads one CSV into its table and returns what happened: 'skipped' when the file is unchanged,
+    'appended' when only new rows were added to the end of the file and 'replaced' otherwise.
+    Must be called inside a transaction.
+    """
+    table_name = csv_to_table_name(csv_path)
+    stat = csv_path.stat()
+    state = conn.execute(f"SELECT size, mtime, sha256 FROM {STATE_TABLE} WHERE file_name = ?", (csv_path.name,)).fetchone()
+    if not _table_exists(conn, table_name):
+        state = None
+
+    if state is not None and state[0] == stat.st_size and state[1] == stat.st_mtime:
+        return "skipped"
+
+    previous_size = state[0] if state is not None else 0
+    sha256, prefix_sha256 = _file_fingerprint(csv_path, previous_size)
+
+    if state is not None and sha256 == state[2]:
+        status = "skipped"
+    elif (
+        state is not None
+        and stat.st_size > previous_size
+        and prefix_sha256 == state[2]
+        and _ends_with_newline(csv_path, previous_size)
+    ):
+        # Append-only change: the old contents are untouched, load just the new tail
+        header, rows, handle = _read_rows(csv_path, offset=previous_size)
+        with handle:
+            _insert_rows(conn, table_name, header, _column_types(table_name, header), rows, chunk_size)
+        status = "appended"
+    else:
+        header, rows, handle = _read_rows(csv_path)
+        columns = _column_types(table_name, header)
+        _create_table(conn, table_name, columns)
+        with handle:
+            _insert_rows(conn, table_name, header, columns, rows, chunk_size)
+        status = "replaced"
+
+    _create_indexes(conn, table_name)
+    conn.execute(
+        f"INSERT OR REPLACE INTO {STATE_TABLE} (file_name, table_name, size, mtime, sha256, loaded_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (csv_path.name, table_name, stat.st_size, stat.st_mtime, sha256, time.strftime("%Y-%m-%dT%H:%M:%S")),
+    )
+    return status
+
+def _load_order(csv_path: Path):
+    table_name = csv_to_table_name(csv_path)
+    return (LOAD_ORDER.index(table_name) if table_name in LOAD_ORDER else len(LOAD_ORDER), table_name)
+
+def load_all_csvs(data_dir: Path = DATA_DIR, db_path: Path = DB_PATH, chunk_size: int = CHUNK_SIZE, parquet_dir: Path = None) -> dict:
+    """
+    Loads every CSV in data_dir into db_path in a single transaction, skipping unchanged files and
+    loading only the new tail of append-only ones, then refreshes the conversion rollups, the sequential monitor's
+    counts, the segment cube, the arrival forecast fits and the data-quality checks. Returns {table_name: 'skipped' | 'appended' | 'replaced'}
+    With parquet_dir, every table that changed (or has no dataset yet) is also written there as a partitioned Parquet dataset
+    """
+    csv_files = sorted(Path(data_dir).glob("*.csv"), key=_load_order)
 
     if not csv_files:
         print("No CSV files found.")
-        return
+        return {}
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ("
+            "file_name TEXT PRIMARY KEY, table_name TEXT, size INTEGER, mtime REAL, sha256 TEXT, loaded_at TEXT)"
+        )
+        statuses = {}
+        conn.execute("BEGIN")
+        try:
+            for csv_file in csv_files:
+                statuses[csv_to_table_name(csv_file)] = load_csv(conn, csv_file, chunk_size)
+            # Keep the dashboard's conversion rollups in step with the sessions, in the same transaction
+            if statuses.get("user_sessions", "skipped") != "skipped":
+                refresh_rollups(conn, full=statuses["user_sessions"] == "replaced")
+            # The sequential monitor's distinct users and converters only need the sessions user_sessions gained
+            if _table_exists(conn, "user_sessions") and (statuses.get("user_sessions", "skipped") != "skipped" or not _table_exists(conn, SEQUENTIAL_STATS_TABLE)):
+                refresh_sequential_stats(conn, full=statuses.get("user_sessions") == "replaced")
+            # Same for the segment cube, which joins assignments, sessions and user attributes
+            if all(_table_exists(conn, table_name) for table_name in SEGMENT_SOURCES) and (
+                any(statuses.get(table_name, "skipped") != "skipped" for table_name in SEGMENT_SOURCES)
+                or not _table_exists(conn, SEGMENT_TABLE)
+            ):
+                refresh_segment_cube(conn)
+            # The duration forecaster's per-experiment arrival fits only need the days user_sessions gained
+            if _table_exists(conn, "user_sessions") and (statuses.get("user_sessions", "skipped") != "skipped" or not _table_exists(conn, FORECAST_FIRST_SESSIONS_TABLE)):
+                refresh_forecast_state(conn, full=statuses.get("user_sessions") == "replaced")
+            # The data-quality counts only need what changed (just the new sessions on an append); the checks are read off them
+            if any(statuses.get(table_name, "skipped") != "skipped" for table_name in QUALITY_SOURCES) or not _table_exists(conn, QUALITY_TABLE):
+                refresh_quality_counts(conn, statuses)
+                write_quality_checks(conn, read_quality_counts(conn).results())
+            # The analysis job writes its results here; the dashboard needs the tables to exist before the first run
+            create_results_tables(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("PRAGMA synchronous = NORMAL")
+        if any(status != "skipped" for status in statuses.values()):
+            conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+
+    if parquet_dir is not None:
+        export_parquet(csv_files, statuses, parquet_dir)
 
-    with sqlite3.connect(DB_PATH) as conn:
-        for csv_file in csv_files:
-            table_name = csv_to_table_name(csv_file)
-            df = pd.read_csv(csv_file)
+    return statuses
 
-            df.to_sql(
-                table_name,
-                conn,
-                if_exists="replace",
-                index=False
-            )
+def export_parquet(csv_files: list, statuses: dict, parquet_dir: Path):
+    # pyarrow is only needed for the columnar copy
+    from ab_testing.columnar import write_table_dataset
 
+    for csv_file in csv_files:
+        table_name = csv_to_table_name(csv_file)
+        out_dir = Path(parquet_dir) / table_name
+        if statuses.get(table_name) != "skipped" or not out_dir.exists():
+            write_table_dataset(csv_file, out_dir, TABLE_SCHEMAS.get(table_name))
 
 
-load_all_csvs()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load data/*.csv into ab_testing.db")
+    parser.add_argument("--parquet-dir", type=Path, help="also write the tables as partitioned Parquet datasets here (e.g. data/parquet)")
+    args = parser.parse_args()
+    for table_name, status in load_all_csvs(parquet_dir=args.parquet_dir).items():
+        print(f"{table_name}: {status}")
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        flagged = read_quality_checks(conn).query("status != 'pass'")
+    finally:
+        conn.close()
+    for row in flagged.itertuples(index=False):
+        print(f"data quality {row.status.upper()}: experiment {row.experiment_id} {row.check_name}: {row.detail}")
@@ -1,437 +1,316 @@
-import pandas as pd
-import numpy as np
-from scipy import stats
-from scipy.optimize import fsolve
-from statsmodels.stats.power import zt_ind_solve_power
-from math import *
-from statsmodels.stats.proportion import proportion_effectsize
-
-user_sessions_df = pd.read_csv('data/user_sessions.csv')
-
-
-#Phase 1: Exploring data and running some hypothesis tests
-
-#Just exploring!!!!
-# print(user_sessions_df.head(10))
-
-# print(user_sessions_df.describe())
-# print(("\n"))
-
-#How many total sessions do we have?
-print('Total sessions:', user_sessions_df['session_id'].nunique())
-
-#Hmmm, what about the experiments? Let's check how many experiments we have
-print('Total experiments:', user_sessions_df['experiment_id'].nunique())
-
-#Now let's check the conversion rates for these sessions, starting with the average conversion rate then the conversion rates per person
-#Take a look at this side next time
-overall_conversion =  user_sessions_df.groupby('user_id')
-average_conversion = (overall_conversion['converted'].max() / len(overall_conversion)).mean()
-#print('Average conversion rate:', average_conversion)
-# #Pretty low average conversion rate, but let's see if any of the experiments did better
-
-# conversion = 
-# conversion_rates_by_experiment = user_sessions_df.groupby('experiment_id')['converted'].mean()
-# print('Conversion rates by experiment:', conversion_rates_by_experiment)
-# print("\n\n")
-#They are about the same, just about 2% conversion rate for all experiments. Not too good.
-
-#Lets take a look at the conversion rates of the control group vs the treatment groups of experiment 1:button_color
-button_color_control = user_sessions_df[(user_sessions_df['experiment_id'] == 1) & (user_sessions_df['variant'] == 'control')]
-button_color_treatment = user_sessions_df[(user_sessions_df['experiment_id'] == 1) & (user_sessions_df['variant'] == 'treatment')]
-button_color_control_conversion = button_color_control.groupby('user_id')['converted'].max().sum()
-button_color_treatment_conversion = button_color_treatment.groupby('user_id')['converted'].max().sum()
-button_color_control_sample_size = len(button_color_control.groupby('user_id')['converted'].max())
-button_color_treatment_sample_size = len(button_color_treatment.groupby('user_id')['converted'].max())
-button_color_control_rate = button_color_control_conversion / button_color_control_sample_size
-button_color_treatment_rate = button_color_treatment_conversion / button_color_treatment_sample_size
-print("\n\n")
-print(button_color_control_rate)
-print("Experiment 1 Control group Conversion Rates:", button_color_control_rate.mean())
-print("Experiment 1 Treatment group Conversion Rates:", button_color_treatment_rate.mean())
-#print(f"The treatment group has a higher conversion rate, with an absolute difference of {round(button_color_treatment_rate - button_color_control_rate,4)} ")
-print(f"The percentage improvement(relative lift) between these two is {round((button_color_treatment_rate - button_color_control_rate)/button_color_control_rate * 100,2)}%")
-print("\n\n")
-#The treatment group seems to have a higher conversion rate in general
-
-
-#Now time for the real work. Let's make a function for running the two-proportion z-test on our data
-def two_proportion_ztest(n1, x1, n2, x2):
-    """
-    Perform two-proportion z-test.
-    
-    Parameters:
-    n1: sample size for group 1 (control)
-    x1: number of successes in group 1 (control conversions)
-    n2: sample size for group 2 (treatment)
-    x2: number of successes in group 2 (treatment conversions)
-    
-    Returns:
-    dict with z_score, p_value, significance (boolean), lower confidence interval, upper confidence interval and lift_percent
-    """
-
-    if n1 == 0 or n2 == 0:
-        raise ValueError("Sample sizes n1 and n2 must be greater than 0.")
-
-    p1 = x1 / n1
-    p2 = x2 / n2
-    p_pool = (x1 + x2) / (n1 + n2)
-
-    if p_pool == 0 or p_pool == 1:
-        return {'z_score': 0.0,'p_value': 1.0,'significant': False,'lower_ci': 0.0,'upper_ci': 0.0,'lift_percent': 0.0}
-    
-
-
-    standard_error = sqrt(p_pool * (1 - p_pool) * (1/n1 + 1/n2))
-    if standard_error == 0:
-        z_score = 0.0
-        p_value_two_tail = 1.0
-    else:
-        z_score = (p2 - p1) / standard_error
-        p_value_two_tail = 2 * stats.norm.sf(abs(z_score))
+"""
+Batch job: reads the session data, summarizes every experiment, runs the power, sample size and MDE
+analysis, stores the run in ab_testing.db (experiment_results, one row per experiment and run) and writes data/results_summary.csv. The analysis functions themselves live in the ab_testing package.
+
+Usage: python statistical_tests.py [--sessions data/user_sessions.csv] [--experiments data/experiments.csv] [--output data/results_summary.csv] [--db ab_testing.db] [--explore]
+                                   [--chunksize N | --parquet-dir data/parquet | --workers N]
+                                   [--bootstrap N [--permutations N] [--daily-metrics data/daily_metrics.csv] [--seed N]]
+                                   [--cuped [--assignments data/experiment_assignments.csv] [--users data/users.csv]]
+                                   [--bayesian [--bayesian-grain weekly|monthly]]
+                                   [--multiarm [--daily-metrics data/daily_metrics.csv] [--correction holm|fdr_bh]]
+                                   [--forecast LIFT... [--forecast-power P]] [--sequential [--planned-users N]]
+                                   [--profile timings.json | timings.prom]
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import sqlite3
 
+import pandas as pd
 
-    difference = p2 - p1
-    standard_error_diff = sqrt((p1*(1-p1)/n1) + (p2*(1-p2)/n2))
-    confidence_interval_lower = difference - 1.96 * standard_error_diff
-    confidence_interval_upper = difference + 1.96 * standard_error_diff
-    if p1 == 0:
-        lift_percent = float("inf") if p2 > 0 else 0.0
-    else:
-        lift_percent = round((p2 - p1) / p1 * 100, 2)
-    return {'z_score':z_score, 'p_value':p_value_two_tail, 'significant': p_value_two_tail < 0.05, 'lower_ci': confidence_interval_lower, 'upper_ci': confidence_interval_upper, 'lift_percent':lift_percent }
-
-
-
-button_color_results = two_proportion_ztest(button_color_control_sample_size,button_color_control_conversion, button_color_treatment_sample_size, button_color_treatment_conversion)
-print(f"\n\nThe button color results are {button_color_results}\n")
-
-experiments_df = list(pd.read_csv('data/experiments.csv')['experiment_name'])
-experiments = {}
-for i in range(1,6):
-    experiments[i] = experiments_df[i - 1]
-print(f'{experiments}\n')
-results_summary_df = pd.DataFrame()
-
-for index,item in experiments.items():
-    df = user_sessions_df[user_sessions_df['experiment_id'] == index]
-    control_df = df[df['variant'] == 'control']
-    treatment_df = df[df['variant'] == 'treatment']
-
-    #Aggregate to user level
-    control_df_conversions = control_df.groupby('user_id')['converted'].max()
-    treatment_df_conversions = treatment_df.groupby('user_id')['converted'].max()
-
-    #Count users and conversions
-    control_n = len(control_df_conversions)
-    treatment_n = len(treatment_df_conversions)
-    control_x = control_df_conversions.sum()
-    treatment_x = treatment_df_conversions.sum()
-    
-    # print(f"Control_n is {control_n}. Control_x is {control_x}. Treatment_n is {treatment_n} and treatment_x is {treatment_x}")
-    # break
-    control_rate = round(control_x/control_n, 4)
-    treatment_rate = round(treatment_x/treatment_n, 4)
-    results = two_proportion_ztest(control_n,control_x,treatment_n,treatment_x)
-    print(f"Experiment {index}: {item}")
-    print(f"Control Conversion Rate: {control_rate} ({control_x}/{control_n})")
-    print(f"Treatment Conversion Rate: {treatment_rate} ({treatment_x}/{treatment_n})")
-    print(f"Lift_percent: {results['lift_percent']}")
-    print(f"Z-score: {results['z_score']}")
-    print(f"P-value: {results['p_value']}")
-    if results['p_value'] < 0.05:
-        print('Decision: REJECT H0 - Result is STASTISTICALLY SIGNIFICANT')
+from ab_testing import instrumentation
+from ab_testing import (
+    two_proportion_ztest,
+    summarize_experiments,
+    aggregate_sessions_csv,
+    analyze_power_from_results,
+)
+from ab_testing.bayesian import bayesian_from_rollups, bayesian_summary
+from ab_testing.cuped import build_covariates, cuped_summary
+from ab_testing.forecast import forecast_durations, read_forecast_state, refresh_forecast_state
+from ab_testing.multiarm import compare_arms, conversion_stats, daily_metric_stats
+from ab_testing.parallel import run_parallel_analysis
+from ab_testing.resampling import conversion_units_from_counts, revenue_units_from_daily_metrics, resample_experiments
+from ab_testing.results_store import save_results_to_db
+from ab_testing.sequential import SequentialMonitor, refresh_sequential_stats
+from ab_testing.session_store import SessionStore
+from ab_testing.summary import RESULTS_SUMMARY_COLUMNS
+
+
+def explore(session_store):
+    #Phase 1: Exploring data and running some hypothesis tests
+
+    #Just exploring!!!!
+    # print(user_sessions_df.head(10))
+
+    # print(user_sessions_df.describe())
+    # print(("\n"))
+
+    #How many total sessions do we have?
+    print('Total sessions:', len(session_store))
+
+    #Hmmm, what about the experiments? Let's check how many experiments we have
+    print('Total experiments:', len(session_store.experiment_ids))
+
+    #Now let's check the conversion rates for these sessions, starting with the average conversion rate then the conversion rates per person
+    #Take a look at this side next time
+    #print('Average conversion rate:', average_conversion)
+    # #Pretty low average conversion rate, but let's see if any of the experiments did better
+
+    # conversion = 
+    # conversion_rates_by_experiment = user_sessions_df.groupby('experiment_id')['converted'].mean()
+    # print('Conversion rates by experiment:', conversion_rates_by_experiment)
+    # print("\n\n")
+    #They are about the same, just about 2% conversion rate for all experiments. Not too good.
+
+    #Lets take a look at the conversion rates of the control group vs the treatment groups of experiment 1:button_color
+    #One entry per user, straight from the store's cached user-level arrays instead of filtered copies of the sessions
+    button_color_control_users, button_color_control_converted = session_store.user_conversions(1, 'control')
+    button_color_treatment_users, button_color_treatment_converted = session_store.user_conversions(1, 'treatment')
+    button_color_control_conversion = button_color_control_converted.sum()
+    button_color_treatment_conversion = button_color_treatment_converted.sum()
+    button_color_control_sample_size = len(button_color_control_users)
+    button_color_treatment_sample_size = len(button_color_treatment_users)
+    button_color_control_rate = button_color_control_conversion / button_color_control_sample_size
+    button_color_treatment_rate = button_color_treatment_conversion / button_color_treatment_sample_size
+    print("\n\n")
+    print(button_color_control_rate)
+    print("Experiment 1 Control group Conversion Rates:", button_color_control_rate.mean())
+    print("Experiment 1 Treatment group Conversion Rates:", button_color_treatment_rate.mean())
+    #print(f"The treatment group has a higher conversion rate, with an absolute difference of {round(button_color_treatment_rate - button_color_control_rate,4)} ")
+    print(f"The percentage improvement(relative lift) between these two is {round((button_color_treatment_rate - button_color_control_rate)/button_color_control_rate * 100,2)}%")
+    print("\n\n")
+    #The treatment group seems to have a higher conversion rate in general
+
+    button_color_results = two_proportion_ztest(button_color_control_sample_size,button_color_control_conversion, button_color_treatment_sample_size, button_color_treatment_conversion)
+    print(f"\n\nThe button color results are {button_color_results}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the A/B test analysis for every experiment")
+    parser.add_argument('--sessions', default='data/user_sessions.csv')
+    parser.add_argument('--experiments', default='data/experiments.csv')
+    parser.add_argument('--output', default='data/results_summary.csv')
+    parser.add_argument('--db', default='ab_testing.db', help="SQLite database the results are stored in for the dashboard")
+    parser.add_argument('--explore', action='store_true', help="print the exploration output for experiment 1 first")
+    parser.add_argument('--chunksize', type=int, help="stream the sessions file in chunks of this many rows instead of loading it whole")
+    parser.add_argument('--parquet-dir', help="read sessions from the columnar dataset written by load_csv_files.py --parquet-dir")
+    parser.add_argument('--workers', type=int, help="analyze experiments in parallel on this many processes")
+    parser.add_argument('--bootstrap', type=int, default=0, help="also print bootstrap CIs for the lift from this many replicates")
+    parser.add_argument('--permutations', type=int, default=0, help="with --bootstrap, also run this many permutations for a p-value")
+    parser.add_argument('--daily-metrics', help="with --bootstrap or --multiarm, also analyze revenue per user from this daily_metrics file")
+    parser.add_argument('--seed', type=int, default=0, help="seed for --bootstrap and --permutations")
+    parser.add_argument('--cuped', action='store_true', help="also print CUPED-adjusted results, power and MDE using pre-assignment covariates")
+    parser.add_argument('--assignments', default='data/experiment_assignments.csv')
+    parser.add_argument('--users', default='data/users.csv')
+    parser.add_argument('--bayesian', action='store_true', help="also print Beta-Binomial posteriors: P(treatment > control), expected loss and lift credible intervals")
+    parser.add_argument('--bayesian-grain', choices=['weekly', 'monthly'], help="with --bayesian, also print them per period from the conversion rollups in --db")
+    parser.add_argument('--multiarm', action='store_true', help="also compare every arm with control on every metric, with corrected p-values")
+    parser.add_argument('--correction', choices=['holm', 'fdr_bh'], default='holm', help="with --multiarm, the multiple-comparison correction within each experiment")
+    parser.add_argument('--forecast', type=float, nargs='+', metavar='LIFT', help="also print how many more days each experiment needs to detect these relative lifts (0.05 = +5%%), from the arrival fits and this run's results in --db")
+    parser.add_argument('--forecast-power', type=float, default=0.8, help="with --forecast, the target power")
+    parser.add_argument('--sequential', action='store_true', help="also run a sequential check on the counts in --db: always-valid p-values and confidence sequences, safe to repeat as often as you like")
+    parser.add_argument('--planned-users', type=int, help="with --sequential, the planned users per group, for the O'Brien-Fleming group-sequential boundaries")
+    parser.add_argument('--profile', help="time every stage and write the histograms here (Prometheus text for .prom, JSON otherwise)")
+    args = parser.parse_args()
+    if (args.chunksize or args.parquet_dir) and args.explore:
+        parser.error("--explore needs the whole sessions file in memory, it can't be combined with --chunksize or --parquet-dir")
+    if args.workers and (args.chunksize or args.parquet_dir):
+        parser.error("--workers partitions the in-memory sessions frame, it can't be combined with --chunksize or --parquet-dir")
+    if args.permutations and not args.bootstrap:
+        parser.error("--permutations only applies with --bootstrap")
+    if args.daily_metrics and not (args.bootstrap or args.multiarm):
+        parser.error("--daily-metrics only applies with --bootstrap or --multiarm")
+    if args.cuped and (args.chunksize or args.parquet_dir):
+        parser.error("--cuped needs user-level sessions in memory, it can't be combined with --chunksize or --parquet-dir")
+    if args.bayesian_grain and not args.bayesian:
+        parser.error("--bayesian-grain only applies with --bayesian")
+    if args.planned_users and not args.sequential:
+        parser.error("--planned-users only applies with --sequential")
+
+    if args.profile:
+        instrumentation.enable()
+
+    #In memory, the sessions live in a compact SessionStore: a few bytes per session instead of a default-dtype frame
+    if args.chunksize or args.parquet_dir:
+        session_store = None
     else:
-        print('Decision: FAIL TO REJECT H0 - Not enough evidence')
-    print(f"95% Confidence Interval Limits: [{round(results['lower_ci'],6)}%, {round(results['upper_ci'],6)}%]")
-    print("\n")
-    new_row = pd.DataFrame({'experiment_name':[item], 'control_rate':[control_rate],'control_size':[control_n], 'treatment_rate':[treatment_rate], 'treatment_size':treatment_n,'lift_percent':[results['lift_percent']],'z_score':[results['z_score']],'p_value':[results['p_value']],'is_significant': [results['p_value'] < 0.05]
-                            , 'lower_ci': round(results['lower_ci'],6),'upper_ci': round(results['upper_ci'],6)})
-    results_summary_df = pd.concat([results_summary_df,new_row])
-
-
-print(results_summary_df)
-results_summary_df.to_csv('data/results_summary.csv')
-#With these results, checkout_button_color has a very low p-value(REJECT H0) and is highly significant. Business recommendation would be to use the new button color immediately
-#pricing_display_test has a very high p-value(FAIL TO REJECT H0) and is not close to significant. Business recommendation would be not to display discount percentages
-#email_subject_line has a  high p-value(FAIL TO REJECT H0) and is not close to significant. Business recommendation would be not to implement personalized subject lines.
-#product_page_layout has a high enough p-value(FAIL TO REJECT H0) and is not significant, although very close to that. In this case, lift_percent is negative, meaning that it's economically better to use a list layout over grid layout; 7% could be crucial
-#free_shipping_threshold has a low p-value(REJECT H0) and is significant. Very close to not being significant. 9.58% lift also makes it economically beneficial. Lower the shipping threshold, but discuss with stakeholders and maybe launch to a percentagfe of users(maybe 30%), and monitor progress.
-
-
-#Phase 2: Time to look at sample sizes and power analysis. We want to know the ideal number of users needed for our tests
-
-#Key definitions: 
-#1.) Sample users: Number of users in each group. More users means more sensitive tests.
-#2.) Effect size: The minimum detectable effect. Would be the smallest difference you want to be able to detect like  a 3% lift from controlled experiment to treatment experiment
-#3.) Statistical power: The probability of detecting a real effect when it exists, like the ability to detect a 5% lift.
-#4.) Significance level: The probability of incorrectly rejecting a true null hypothesis in a statistical test(chance of a false positive)
-
-#Let's start with getting the power for each of our experiments
-def calculate_statistical_power_from_results(summary_df):
-    p1 = summary_df['control_rate']
-    p2 = summary_df['treatment_rate']
-    effect_size = proportion_effectsize(p2, p1).iloc[0]
-    print(f"The effect soze  is {effect_size}")
-    nobs1 = summary_df['control_size']
-    control_n = summary_df['control_size']
-    treatment_n = summary_df['treatment_size']
-    ratio = treatment_n.iloc[0] / control_n.iloc[0]
-    control_count = user_sessions_df[user_sessions_df['variant'] == 'control']['user_id'].nunique()
-    treatment_count = user_sessions_df[user_sessions_df['variant'] == 'treatment']['user_id'].nunique()
-    #Maybe change the ratio here too
-    power = zt_ind_solve_power(effect_size=effect_size, alpha=0.05 ,nobs1=nobs1, ratio=ratio, alternative='two-sided')
-    return power
-
-print("\n\nBANKAI\n")
-#TAKE A VERY GOOD LOOK AT HOW YOURE DOING THE two proportion z test function. It MAY BE OFF. CHECKED AS OF 12:59 am 26/11/25
-for index,items in experiments.items():
-    power = calculate_statistical_power_from_results(results_summary_df[results_summary_df['experiment_name'] == items])
-    print(f"The power for the experiment {items} is {power}\n")
-
-
-
-#Now let's try and get the number of users we would need to detect a lift(sample size)
-def calculate_sample_users_from_results(summary_df):
-    """
-    Calculates the number of users per group required to detect a lift, the total number of users based on the ratio and the multiplier to reach
-    the required users per group
-    """
-    p1 = summary_df['control_rate']
-    p2 = summary_df['treatment_rate']
-    control_n = summary_df['control_size'].iloc[0]
-    treatment_n = summary_df['treatment_size'].iloc[0]
-    effect_size = proportion_effectsize(p2, p1).iloc[0]
-    ratio = treatment_n / control_n
-    
-    required_users = int(round(zt_ind_solve_power(effect_size=effect_size,alpha=0.05,power=0.8,ratio=ratio, alternative='two-sided'),0))
-
-    total_current = control_n + treatment_n
-    total_required = int(round(required_users * (1 + ratio),0))
-    multiplier = round(required_users / control_n,1)
-
-    #Problem with these print statements here!!
-    # print(f"\n{summary_df['experiment_name'].iloc[0]}:")
-    # print(f"The effect size  is {effect_size}")
-    # print(f"Current: Control={control_n:,}, Treatment={treatment_n:,} (Total: {total_current:,})")
-    # print(f"Required: {required_users:,.0f} per control group")
-    # print(f"Total required: {total_required:,.0f} users")
-    # print(f"Need {multiplier:.1f}x more users")
-    return required_users, total_required, multiplier
-#Will add this to dataframe which will be formatted to csv 
-for index,items in experiments.items():
-    print(calculate_sample_users_from_results(results_summary_df[results_summary_df['experiment_name'] == items]))
-
-
-
-#Now it's time to work on an effect size calculator for a minimum detectable effect
-
-
-#CHANGE THIS. YOU'RE IMPROVING A BIT
-#This seems right. effect_size is an arbitrary value that people don't really use when talking
-#MDE is used to get the lift you actually want to detect and that is mde_relative_lift
-def calculate_minimum_detectable_effect_from_results(summary_df):
-    """
-    Calculates the minimum lift you could have detected from control conversion to treatment conversion 
-    """
-    control_rate = summary_df['control_rate'].iloc[0]
-    treatment_rate = summary_df['treatment_rate'].iloc[0]
-    control_n = summary_df['control_size'].iloc[0]
-    treatment_n = summary_df['treatment_size'].iloc[0]
-    ratio = treatment_n / control_n
-    nobs1 = summary_df['control_size']
-
-    effect_size = zt_ind_solve_power(effect_size=None,nobs1=control_n,alpha=0.05,power=0.8,ratio=ratio, alternative='two-sided')
-    
-    def equation(p2):
-        return (2 * np.arcsin(np.sqrt(p2)) - 2 * np.arcsin(np.sqrt(control_rate))) - effect_size
-
-    mde_treatment_rate = fsolve(equation, control_rate * 1.1)[0]
-    mde_relative_lift = (mde_treatment_rate - control_rate) / control_rate * 100
-
-    return {
-        'effect_size': effect_size,
-        'baseline_rate': control_rate, #Control rate
-        'mde_treatment_rate': mde_treatment_rate,  # THEORETICAL minimum
-        'mde_relative_lift_pct': mde_relative_lift,  # MDE as %
-        'actual_treatment_rate': treatment_rate,  # ACTUAL from data
-        'actual_lift_pct': summary_df['lift_percent'].iloc[0],  # ACTUAL lift
-        'sample_size': control_n
-    }
-
-print("\nNow time for MDE\n")#Mde displayed all turn out to be 12% for mde. Sample sizes and conversion rates are very similar
-for index,items in experiments.items():
-    print(f"This is for the experiment {items}")
-    mde = calculate_minimum_detectable_effect_from_results(results_summary_df[results_summary_df['experiment_name'] == items])
-    print(f"   MDE (what you COULD detect): {mde['mde_relative_lift_pct']:.1f}%")
-    print(f"   Actual (what you DID observe): {mde['actual_lift_pct']:.1f}%")
-    print(f"   ")
-    if abs(mde['actual_lift_pct']) >= abs(mde['mde_relative_lift_pct']):
-        print(f"   ✅ Actual lift > MDE → Well-powered")
+        with instrumentation.timer("read_sessions"):
+            session_store = SessionStore.from_csv(args.sessions)
+    if args.explore:
+        explore(session_store)
+    #--workers and --cuped still take a sessions frame, decoded from the store once (with compact dtypes) if either is on
+    user_sessions_df = session_store.to_frame() if session_store is not None and (args.workers or args.cuped) else None
+
+    experiments_df = pd.read_csv(args.experiments)
+    experiments = dict(zip(experiments_df['experiment_id'], experiments_df['experiment_name']))
+    print(f'{experiments}\n')
+
+    #Every source ends in the same consolidated table: results_summary plus power, sample size and MDE per experiment
+    if args.workers:
+        with instrumentation.timer("parallel_analysis"):
+            variant_counts_df, analysis_df = run_parallel_analysis(user_sessions_df, experiments, workers=args.workers)
     else:
-        print(f"   ❌ Actual lift < MDE → Underpowered")
-    print("\nOnto the next\n")
-    
-    # print(calculate_minimum_detectable_effect_from_results(results_summary_df[results_summary_df['experiment_name'] == items]))
-
-
-
-#Good work. Now time to create functions for calculating power, sample size and minimum detectable effect for values inputted by users.
-#For these , probably leave alpha as a default of 0.05
-def calculate_power(baseline_rate, expected_lift, sample_size, alpha=0.05):
-    """
-    Calculates statistical power for a planned A/B test
-    Assumptions: The ratio of control size to treatment size is 1:1
-    """
+        with instrumentation.timer("count_users"):
+            if args.parquet_dir:
+                from ab_testing.columnar import count_users_arrow, open_dataset
+                variant_counts_df = count_users_arrow(open_dataset('user_sessions', args.parquet_dir), experiment_ids=experiments.keys())
+            elif args.chunksize:
+                variant_counts_df = aggregate_sessions_csv(args.sessions, args.chunksize)
+            else:
+                variant_counts_df = session_store.counts()
+        with instrumentation.timer("summarize_experiments"):
+            summary_df = summarize_experiments(variant_counts_df, experiments)
+        with instrumentation.timer("power_analysis"):
+            analysis_df = analyze_power_from_results(summary_df)
+    results_summary_df = analysis_df[RESULTS_SUMMARY_COLUMNS]
+    #The results store also keeps the exact converter counts, the dashboard's Bayesian view starts from them
+    conversions = variant_counts_df['x'].unstack('variant').reindex(list(experiments.keys()))
+    analysis_df = analysis_df.assign(control_conversions=conversions['control'].to_numpy(), treatment_conversions=conversions['treatment'].to_numpy())
+
+    for index, row in zip(experiments.keys(), results_summary_df.itertuples(index=False)):
+        print(f"Experiment {index}: {row.experiment_name}")
+        control_x = variant_counts_df.loc[(index, 'control'), 'x']
+        treatment_x = variant_counts_df.loc[(index, 'treatment'), 'x']
+        print(f"Control Conversion Rate: {row.control_rate} ({control_x}/{row.control_size})")
+        print(f"Treatment Conversion Rate: {row.treatment_rate} ({treatment_x}/{row.treatment_size})")
+        print(f"Lift_percent: {row.lift_percent}")
+        print(f"Z-score: {row.z_score}")
+        print(f"P-value: {row.p_value}")
+        if row.p_value < 0.05:
+            print('Decision: REJECT H0 - Result is STASTISTICALLY SIGNIFICANT')
+        else:
+            print('Decision: FAIL TO REJECT H0 - Not enough evidence')
+        print(f"95% Confidence Interval Limits: [{row.lower_ci}%, {row.upper_ci}%]")
+        print("\n")
+
+    print(results_summary_df)
+    with instrumentation.timer("write_results"):
+        results_summary_df.to_csv(args.output, index=False)
+        run_at = save_results_to_db(args.db, analysis_df, list(experiments.keys()))
+    print(f"Results stored in {args.db} (run {run_at})")
+    #With these results, checkout_button_color has a very low p-value(REJECT H0) and is highly significant. Business recommendation would be to use the new button color immediately
+    #pricing_display_test has a very high p-value(FAIL TO REJECT H0) and is not close to significant. Business recommendation would be not to display discount percentages
+    #email_subject_line has a  high p-value(FAIL TO REJECT H0) and is not close to significant. Business recommendation would be not to implement personalized subject lines.
+    #product_page_layout has a high enough p-value(FAIL TO REJECT H0) and is not significant, although very close to that. In this case, lift_percent is negative, meaning that it's economically better to use a list layout over grid layout; 7% could be crucial
+    #free_shipping_threshold has a low p-value(REJECT H0) and is significant. Very close to not being significant. 9.58% lift also makes it economically beneficial. Lower the shipping threshold, but discuss with stakeholders and maybe launch to a percentagfe of users(maybe 30%), and monitor progress.
+
+    print("\n\nBANKAI\n")
+    #TAKE A VERY GOOD LOOK AT HOW YOURE DOING THE two proportion z test function. It MAY BE OFF. CHECKED AS OF 12:59 am 26/11/25
+    for row in analysis_df.itertuples(index=False):
+        print(f"The power for the experiment {row.experiment_name} is {row.power}\n")
+
+    #Will add this to dataframe which will be formatted to csv 
+    for row in analysis_df.itertuples(index=False):
+        print((row.required_users_per_group, row.total_required_users, row.users_multiplier))
+
+    print("\nNow time for MDE\n")#Mde displayed all turn out to be 12% for mde. Sample sizes and conversion rates are very similar
+    for row in analysis_df.itertuples(index=False):
+        print(f"This is for the experiment {row.experiment_name}")
+        print(f"   MDE (what you COULD detect): {row.mde_relative_lift_pct:.1f}%")
+        print(f"   Actual (what you DID observe): {row.lift_percent:.1f}%")
+        print(f"   ")
+        if row.well_powered:
+            print(f"   ✅ Actual lift > MDE → Well-powered")
+        else:
+            print(f"   ❌ Actual lift < MDE → Underpowered")
+        print("\nOnto the next\n")
+
+    if args.bootstrap:
+        #Normal-approximation CIs are shaky for low conversion rates and revenue, so cross-check them by resampling
+        #One worker pool for both runs, rather than one each
+        with ProcessPoolExecutor(max_workers=args.workers) if args.workers and args.workers > 1 else nullcontext() as pool:
+            print("\nBootstrap CIs for conversion rate\n")
+            with instrumentation.timer("bootstrap_conversion"):
+                conversion_df = resample_experiments(
+                    conversion_units_from_counts(variant_counts_df), args.bootstrap, args.permutations, seed=args.seed, pool=pool,
+                )
+            print(conversion_df.assign(experiment_name=conversion_df['experiment_id'].map(experiments)))
+            if args.daily_metrics:
+                print("\nBootstrap CIs for revenue per user (resampling days)\n")
+                with instrumentation.timer("bootstrap_revenue"):
+                    revenue_df = resample_experiments(
+                        revenue_units_from_daily_metrics(pd.read_csv(args.daily_metrics)), args.bootstrap, args.permutations, seed=args.seed, pool=pool,
+                    )
+                print(revenue_df.assign(experiment_name=revenue_df['experiment_id'].map(experiments)))
+
+    if args.cuped:
+        #Same test with the variance the pre-experiment covariates explain taken out, and the power/MDE that buys
+        print("\nCUPED-adjusted results\n")
+        with instrumentation.timer("cuped"):
+            covariates_df = build_covariates(pd.read_csv(args.assignments), user_sessions_df, pd.read_csv(args.users))
+            cuped_df = analyze_power_from_results(cuped_summary(covariates_df, experiments))
+        print(cuped_df[['experiment_name', 'lift_percent', 'p_value', 'lower_ci', 'upper_ci', 'variance_reduction', 'power', 'users_multiplier', 'mde_relative_lift_pct']])
+
+    if args.bayesian:
+        #Same counts under a Beta(1, 1) prior: how likely treatment is better, and what picking the wrong arm would cost
+        print("\nBayesian results\n")
+        with instrumentation.timer("bayesian"):
+            bayesian_df = bayesian_summary(variant_counts_df, experiments)
+        print(bayesian_df[['experiment_name', 'prob_treatment_better', 'expected_loss_treatment', 'expected_loss_control', 'lift_lower_percent', 'lift_upper_percent']].to_string(index=False))
+        if args.bayesian_grain:
+            print(f"\nBayesian results per {args.bayesian_grain} period\n")
+            conn = sqlite3.connect(args.db)
+            try:
+                with instrumentation.timer("bayesian_by_period"):
+                    period_df = bayesian_from_rollups(conn, args.bayesian_grain)
+            finally:
+                conn.close()
+            print(period_df.assign(experiment_name=period_df['experiment_id'].map(experiments))[
+                ['experiment_name', 'time_period', 'prob_treatment_better', 'expected_loss_treatment', 'lift_lower_percent', 'lift_upper_percent']
+            ].to_string(index=False))
+
+    if args.multiarm:
+        #Every arm against control on every metric, one vectorized pass over per-arm sums however many arms there are
+        print("\nEvery arm against control\n")
+        with instrumentation.timer("multiarm"):
+            arm_stats_df = conversion_stats(variant_counts_df)
+            if args.daily_metrics:
+                arm_stats_df = pd.concat([arm_stats_df, daily_metric_stats(pd.read_csv(args.daily_metrics))], ignore_index=True)
+            arms_df = compare_arms(arm_stats_df, method=args.correction)
+        print(arms_df.assign(experiment_name=arms_df['experiment_id'].map(experiments))[
+            ['experiment_name', 'metric', 'variant', 'control_value', 'variant_value', 'lift_percent', 'lift_lower_percent', 'lift_upper_percent', 'p_value', 'adjusted_p_value', 'is_significant']
+        ].to_string(index=False))
+
+    if args.forecast:
+        #Days from the last loaded day until each lift would be significant / have the target power, at the current traffic trend
+        print("\nDuration forecast\n")
+        conn = sqlite3.connect(args.db)
+        try:
+            with instrumentation.timer("forecast"):
+                #Picks up any days load_csv_files.py hasn't folded in yet; a no-op otherwise
+                refresh_forecast_state(conn)
+                conn.commit()
+                forecast_df = forecast_durations(read_forecast_state(conn), args.forecast, power=args.forecast_power)
+        finally:
+            conn.close()
+        print(forecast_df.assign(experiment_name=forecast_df['experiment_id'].map(experiments))[
+            ['experiment_name', 'relative_lift', 'baseline_rate', 'daily_users_per_group', 'users_per_group_so_far', 'days_to_significance', 'days_to_target_power', 'target_power_date']
+        ].to_string(index=False))
+
+    if args.sequential:
+        #Peeking-safe check of every experiment from counts kept in --db; each run is a look, so it's recorded there too
+        print("\nSequential check\n")
+        conn = sqlite3.connect(args.db)
+        try:
+            with instrumentation.timer("sequential"):
+                #Picks up any sessions load_csv_files.py hasn't folded in yet; a no-op otherwise
+                monitor = SequentialMonitor(conn)
+                refresh_sequential_stats(conn)
+                conn.commit()
+                sequential_df = monitor.evaluate(args.planned_users)
+        finally:
+            conn.close()
+        columns = ['experiment_name', 'control_n', 'treatment_n', 'difference', 'always_valid_p_value', 'cs_lower', 'cs_upper', 'significant']
+        if args.planned_users:
+            columns += ['information_fraction', 'looks', 'obf_boundary', 'z_score', 'alpha_spent', 'crossed_boundary']
+        print(sequential_df.assign(experiment_name=sequential_df.index.map(experiments))[columns].to_string(index=False))
+
+    print("\nWE GOOD WITH ALL OF IT\n")
+    if args.profile:
+        instrumentation.write_report(args.profile)
+        print(f"Stage timings written to {args.profile}")
 
-    treatment_rate = baseline_rate * (1 + expected_lift)
-    effect_size = proportion_effectsize(treatment_rate, baseline_rate)
-
-    power = zt_ind_solve_power(effect_size=effect_size, alpha=alpha,nobs1=sample_size, ratio=1.0, alternative='two-sided')
-
-    if power >= 0.80:
-        interpretation = "Good power! You have a high chance of detecting this effect."
-        recommendation = "Proceed with the test."
-    elif power >= 0.60:
-        interpretation = "Moderate power. You might detect the effect, but you won't have a high chance of doing so."
-        recommendation = "Consider running longer or testing a bigger effect."
-    else:
-        interpretation = "Low power! High chance of missing the effect even if it exists."
-        recommendation = "Increase sample size or test larger changes."
-
-    return {
-        'baseline_rate': baseline_rate,
-        'treatment_rate': treatment_rate,
-        'expected_lift': expected_lift,
-        'absolute_lift': treatment_rate - baseline_rate,
-        'sample_size': sample_size,
-        'total_users': sample_size * 2,
-        'effect_size': effect_size,
-        'power': power,
-        'alpha': alpha,
-        'interpretation': interpretation,
-        'recommendation': recommendation
-    }
-
-def calculate_sample_size(baseline_rate, expected_lift,power=0.8, alpha=0.05):
-    """
-    Calculate number of required users for the user's for detecting a lift from a particular baseline rate
-    Assuming equal grpups for control and treatment
-    """
-    treatment_rate = baseline_rate * (1 + expected_lift)
-    effect_size = proportion_effectsize(treatment_rate, baseline_rate)
-
-    required_users = int(round(zt_ind_solve_power(effect_size=effect_size,alpha=0.05,power=0.8,ratio=1.0, alternative='two-sided'),0))
-
-    required_users_per_group = math.ceil(required_users)
-    total_users = required_users_per_group * 2
-    
-    if total_users <= 2000:
-        interpretation = (
-            "Small–moderate sample size. This test should be easy to run "
-            "if you have steady traffic."
-        )
-        recommendation = (
-            "You can likely proceed with this design as-is."
-        )
-    elif total_users <= 20000:
-        interpretation = (
-            "Moderate–large sample size. You’ll need decent traffic or a longer test duration."
-        )
-        recommendation = (
-            "Make sure your traffic volume and test duration are sufficient; "
-            "consider slightly larger lifts if this is hard to reach."
-        )
-    else:
-        interpretation = (
-            "Very large required sample size. With this baseline and expected lift, "
-            "the test needs a lot of users to reliably detect the effect."
-        )
-        recommendation = (
-            "Consider one or more of: (1) testing a larger expected lift, "
-            "(2) relaxing the power requirement, or (3) running the test for longer."
-        )
-
-
-    return {
-        'baseline_rate': baseline_rate,
-        'treatment_rate': treatment_rate,
-        'expected_lift': expected_lift,
-        'absolute_lift': treatment_rate - baseline_rate,
-        'effect_size': effect_size,
-        'alpha': alpha,
-        'required_sample_per_group': required_users_per_group,
-        'total_required_users': total_users,
-        'interpretation': interpretation,
-        'recommendation': recommendation,
-    }
-
-def calculate_minimum_detectable_effect(baseline_rate,expected_lift,sample_size,power=0.8,alpha=0.05):
-    """
-    Calculates the effect size and minimum detectable effect
-    """
-    treatment_rate = baseline_rate * (1 + expected_lift)
-
-
-    effect_size = zt_ind_solve_power(effect_size=None,nobs1=sample_size,alpha=alpha,power=power,ratio=1.0, alternative='two-sided')
-    
-    def equation(p2):
-        return (2 * np.arcsin(np.sqrt(p2)) - 2 * np.arcsin(np.sqrt(baseline_rate))) - effect_size
-
-    mde_treatment_rate = fsolve(equation, baseline_rate * 1.1)[0]
-    mde_relative_lift = (mde_treatment_rate - baseline_rate) / baseline_rate * 100
-
-    expected_relative_lift_pct = expected_lift * 100
-    absolute_lift_expected = treatment_rate - baseline_rate
-
-    if effect_size < 0.2:
-        sensitivity_label = "very high – can detect tiny effects"
-    elif effect_size < 0.5:
-        sensitivity_label = "high – can detect small effects"
-    elif effect_size < 0.8:
-        sensitivity_label = "moderate – best for medium-sized effects"
-    else:
-        sensitivity_label = "low – only large effects are detectable"
-
-    if expected_relative_lift_pct >= mde_relative_lift:
-        interpretation = (
-            "Your expected lift is larger than the minimum detectable effect. "
-            "This design should have roughly the requested power to detect the effect."
-        )
-        recommendation = (
-            "Proceed with this sample size, or increase it if you also want sensitivity "
-            "to smaller lifts."
-        )
-    else:
-        interpretation = (
-            "Your expected lift is smaller than the minimum detectable effect. "
-            "There is a high chance this test will miss the effect even if it exists."
-        )
-        recommendation = (
-            "Increase the sample size, accept a larger detectable lift, or relax the "
-            "power requirement if that’s acceptable."
-        )
-
-    return {
-        'baseline_rate': baseline_rate,
-        'expected_treatment_rate': treatment_rate,
-        'expected_lift': expected_lift,
-        'expected_relative_lift_pct': expected_relative_lift_pct,
-        'absolute_lift_expected': absolute_lift_expected,
-
-        'effect_size_required': effect_size,       # Cohen's h
-        'mde_treatment_rate': mde_treatment_rate,           # min detectable rate
-        'mde_relative_lift_pct': mde_relative_lift,     # MDE in %
-
-        'sample_size_per_group': sample_size,# Make sure to include per group here
-        'total_users': sample_size * 2,
-        'target_power': power,
-        'alpha': alpha,
-
-        'sensitivity_label': sensitivity_label,
-        'interpretation': interpretation,
-        'recommendation': recommendation,
-    }
 
 #Charts to show
 #Dropdown menu for each experiment(can also do control vs treatment)
@@ -453,4 +332,6 @@ def calculate_minimum_detectable_effect(baseline_rate,expected_lift,sample_size,
 
 #Last chart would be on segmentation analysis(or could be before calculator)
 
-print("\nWE GOOD WITH ALL OF IT\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from ab_testing.cache import StaleWhileRevalidateCache
+
+
+def test_close_releases_readers_waiting_on_a_queued_refresh():
+    release = threading.Event()
+
+    def loader(query_name, *params):
+        release.wait(5)
+        return query_name
+
+    cache = StaleWhileRevalidateCache(loader, workers=1)
+    running, queued = cache.prewarm([("running.txt", ()), ("queued.txt", ())], data_version=1)
+    errors = []
+
+    #What get() waits on for a key that is being computed; taken before close() so the reader can't race it
+    assert cache._in_flight[("queued.txt", ())] is queued
+
+    def read():
+        try:
+            queued.result()
+        except CancelledError as error:
+            errors.append(error)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    cache.close()
+    reader.join(2)
+    assert not reader.is_alive() and len(errors) == 1
+    assert queued.cancelled()
+    #The refresh that was already running still finishes
+    release.set()
+    assert running.result(2) == "running.txt"
+    #Nothing computes a refresh asked for after close either
+    with pytest.raises(CancelledError):
+        cache.prewarm([("late.txt", ())], data_version=2)[0].result(1)
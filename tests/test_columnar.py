@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from ab_testing import columnar
+
+
+def _write_sessions(csv_path, n_experiments, months):
+    rng = np.random.default_rng(0)
+    days = pd.date_range("2024-01-01", periods=months, freq="MS")
+    rows = n_experiments * months * 3
+    pd.DataFrame({
+        "session_id": np.arange(rows),
+        "user_id": rng.integers(1, 10_000, rows),
+        "experiment_id": np.tile(np.arange(1, n_experiments + 1), months * 3),
+        "variant": rng.choice(["control", "treatment"], rows),
+        "session_date": days[np.repeat(np.arange(months), n_experiments * 3)].strftime("%Y-%m-%d"),
+        "converted": rng.integers(0, 2, rows).astype(bool),
+    }).to_csv(csv_path, index=False)
+    return rows
+
+
+def _read_back(parquet_dir):
+    return columnar.open_dataset("user_sessions", parquet_dir).to_table().to_pandas()
+
+
+def test_writes_more_partitions_than_the_pyarrow_default(tmp_path):
+    rows = _write_sessions(tmp_path / "user_sessions.csv", 400, 4)
+    columnar.write_table_dataset(tmp_path / "user_sessions.csv", tmp_path / "parquet" / "user_sessions", {"session_date": "DATE"})
+    sessions = _read_back(tmp_path / "parquet")
+    assert len(sessions) == rows
+    assert sessions.groupby(["experiment_id", "month"]).ngroups == 1600
+
+
+def test_catalog_past_the_open_file_budget_is_written_in_groups(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, "MAX_OPEN_FILES", 10)
+    rows = _write_sessions(tmp_path / "user_sessions.csv", 12, 4)
+    out_dir = tmp_path / "parquet" / "user_sessions"
+    columnar.write_table_dataset(tmp_path / "user_sessions.csv", out_dir, {"session_date": "DATE"})
+    assert len(_read_back(tmp_path / "parquet")) == rows
+    #One file per partition: every group kept all of its partitions open
+    assert len(list(out_dir.rglob("*.parquet"))) == 48
+
+
+def test_dataset_version_changes_on_rewrite(tmp_path):
+    _write_sessions(tmp_path / "user_sessions.csv", 2, 1)
+    assert columnar.dataset_version(tmp_path / "parquet") == 0
+    columnar.write_table_dataset(tmp_path / "user_sessions.csv", tmp_path / "parquet" / "user_sessions", {"session_date": "DATE"})
+    first = columnar.dataset_version(tmp_path / "parquet")
+    columnar.write_table_dataset(tmp_path / "user_sessions.csv", tmp_path / "parquet" / "user_sessions", {"session_date": "DATE"})
+    assert columnar.dataset_version(tmp_path / "parquet") > first > 0
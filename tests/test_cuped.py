@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from ab_testing.cuped import build_covariates, cuped_summary
+from ab_testing.power import analyze_power_from_results
+
+
+def _inputs():
+    assignments = pd.DataFrame({
+        "experiment_id": 1,
+        "variant": ["control", "treatment", "control", "treatment"],
+        "user_id": [1, 2, 3, 4],
+        "assignment_date": ["2024-02-10", "2024-02-11", "2024-02-12", "2024-02-13"],
+    })
+    sessions = pd.DataFrame({
+        "experiment_id": 1,
+        "user_id": [1, 2, 3, 4],
+        "session_date": ["2024-02-10", "2024-02-11", "2024-02-12", "2024-02-13"],
+        "converted": [False, True, False, True],
+    })
+    #User 3 has no signup_date and user 4 isn't in users at all
+    users = pd.DataFrame({
+        "user_id": [1, 2, 3],
+        "signup_date": ["2024-02-01", "2024-01-11", None],
+        "user_segment": ["new", "returning", "new"],
+        "device_type": ["desktop", "mobile", "mobile"],
+        "location": ["United States", "United States", "Canada"],
+        "age_group": ["18-25", "26-35", "18-25"],
+    })
+    return assignments, sessions, users
+
+
+def test_tenure_is_zero_without_a_signup_date():
+    covariates = build_covariates(*_inputs())
+    assert covariates["tenure_days"].tolist() == [9.0, 31.0, 0.0, 0.0]
+    assert (covariates.loc[3, ["device_type_mobile", "location_United States"]] == 0).all()
+
+
+def test_experiment_without_assignments_gets_an_empty_row():
+    summary = cuped_summary(build_covariates(*_inputs()), {1: "has_users", 2: "no_users_yet"})
+    empty = summary.set_index("experiment_name").loc["no_users_yet"]
+    assert empty["control_size"] == 0 and empty["treatment_size"] == 0
+    assert np.isnan(empty["p_value"]) and not empty["is_significant"]
+    assert len(analyze_power_from_results(summary)) == 2
@@ -0,0 +1,67 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from ab_testing.forecast import daily_arrivals, forecast_durations, read_forecast_state, refresh_forecast_state
+from ab_testing.results_store import save_results
+
+
+def _sessions(days=10, users_per_day=100, returns=3):
+    #users_per_day new users a day, each coming back on the next `returns` days too
+    rows = []
+    for day in range(days):
+        for user in range(day * users_per_day, (day + 1) * users_per_day):
+            variant = "control" if user % 2 == 0 else "treatment"
+            for visit in range(returns + 1):
+                if day + visit < days:
+                    rows.append((1, user, variant, (pd.Timestamp("2024-01-01") + pd.Timedelta(days=day + visit)).strftime("%Y-%m-%d")))
+    return pd.DataFrame(rows, columns=["experiment_id", "user_id", "variant", "session_date"]).assign(converted=False)
+
+
+def _connect(sessions):
+    conn = sqlite3.connect(":memory:")
+    sessions.to_sql("user_sessions", conn, index=False)
+    return conn
+
+
+def _save_results(conn, control_size, treatment_size, control_rate):
+    save_results(conn, pd.DataFrame([{
+        "experiment_name": "exp", "control_rate": control_rate, "control_size": control_size,
+        "treatment_rate": control_rate, "treatment_size": treatment_size,
+    }]), [1])
+
+
+def test_fit_counts_new_users_not_returning_ones():
+    conn = _connect(_sessions())
+    refresh_forecast_state(conn)
+    state = read_forecast_state(conn)
+    assert state["sum_new_users"].iloc[0] == 1000
+    forecast = forecast_durations(state, [0.1])
+    #Each group gains 50 new users a day, not the 200 daily actives
+    assert np.isclose(forecast["daily_users_per_group"].iloc[0], 50)
+    #No analysis run yet: nothing to forecast from
+    assert np.isnan(forecast["days_to_significance"].iloc[0])
+
+
+def test_users_so_far_and_baseline_come_from_the_results():
+    conn = _connect(_sessions())
+    refresh_forecast_state(conn)
+    _save_results(conn, 500, 490, 0.14)
+    forecast = forecast_durations(read_forecast_state(conn), [0.1])
+    assert forecast["users_per_group_so_far"].iloc[0] == 490
+    assert forecast["baseline_rate"].iloc[0] == 0.14
+    needed = forecast["users_per_group_for_significance"].iloc[0]
+    assert forecast["days_to_significance"].iloc[0] == np.ceil((needed - 490) / 50)
+
+
+def test_appended_sessions_match_a_rebuild():
+    sessions = _sessions()
+    conn = _connect(sessions[sessions["session_date"] <= "2024-01-05"])
+    refresh_forecast_state(conn)
+    sessions[sessions["session_date"] > "2024-01-05"].to_sql("user_sessions", conn, index=False, if_exists="append")
+    refresh_forecast_state(conn)
+    appended = read_forecast_state(conn)
+    refresh_forecast_state(conn, full=True)
+    pd.testing.assert_frame_equal(appended, read_forecast_state(conn))
+    assert (daily_arrivals(sessions)["new_users"] == 100).all()
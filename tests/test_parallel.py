@@ -0,0 +1,33 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from ab_testing.parallel import run_parallel_analysis
+from ab_testing.power import analyze_power_from_results
+from ab_testing.summary import count_users_by_variant, summarize_experiments
+
+
+def _sessions():
+    rng = np.random.default_rng(0)
+    rows = 5000
+    return pd.DataFrame({
+        "experiment_id": rng.choice([1, 3], rows),
+        "variant": rng.choice(["control", "treatment"], rows),
+        "user_id": rng.integers(1, 2000, rows),
+        "converted": rng.random(rows) < 0.1,
+    })
+
+
+def test_parallel_matches_serial_with_an_experiment_without_sessions():
+    sessions = _sessions()
+    experiments = {1: "first", 2: "no_sessions_yet", 3: "third"}
+    #The empty experiment's NaN row warns the same way on both paths
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        serial_counts = count_users_by_variant(sessions)
+        serial = analyze_power_from_results(summarize_experiments(serial_counts, experiments))
+        parallel_counts, parallel = run_parallel_analysis(sessions, experiments, workers=2)
+    pd.testing.assert_frame_equal(parallel, serial)
+    pd.testing.assert_frame_equal(parallel_counts.sort_index(), serial_counts.sort_index(), check_dtype=False)
+    assert np.isnan(parallel.loc[1, "p_value"])
@@ -0,0 +1,62 @@
+import sqlite3
+
+import pandas as pd
+
+from ab_testing.quality import DataQualityAccumulator, read_quality_counts, refresh_quality_counts
+
+
+def _assignment_counts(users):
+    return pd.DataFrame({
+        "experiment_id": 1,
+        "variant": list(users),
+        "day": "2024-01-01",
+        "users": list(users.values()),
+    })
+
+
+def _srm(checks):
+    return checks.set_index("check_name").loc["sample_ratio_mismatch"]
+
+
+def test_srm_fails_when_an_arm_has_no_users():
+    quality = DataQualityAccumulator()
+    quality.add_counts("assignments", _assignment_counts({"control": 1000}))
+    assert _srm(quality.results())["status"] == "fail"
+
+
+def test_srm_counts_arms_only_other_sources_have():
+    quality = DataQualityAccumulator()
+    quality.add_counts("assignments", _assignment_counts({"control": 1000, "treatment": 1010}))
+    assert _srm(quality.results())["status"] == "pass"
+    #A third arm that shows up in daily_metrics but got no assignments
+    quality.add_counts("daily", pd.DataFrame({"experiment_id": [1], "variant": ["treatment_b"], "day": ["2024-01-01"], "reported_users": [50]}))
+    assert _srm(quality.results())["status"] == "fail"
+
+
+def test_appended_sessions_give_the_same_counts_as_a_rebuild():
+    conn = sqlite3.connect(":memory:")
+    pd.DataFrame({
+        "experiment_id": [1, 1, 1, 1],
+        "user_id": [1, 2, 3, 3],
+        "variant": ["control", "treatment", "control", "treatment"],
+        "assignment_date": ["2024-01-02", "2024-01-02", "2024-01-03", "2024-01-04"],
+    }).to_sql("experiment_assignments", conn, index=False)
+    sessions = pd.DataFrame({
+        "experiment_id": [1, 1, 1, 1, 1],
+        "user_id": [1, 2, 3, 1, 9],
+        "variant": ["control", "treatment", "control", "treatment", "control"],
+        "session_date": ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-05", "2024-01-05"],
+        "converted": [0, 1, 0, 1, 0],
+    })
+    sessions.iloc[:3].to_sql("user_sessions", conn, index=False)
+    refresh_quality_counts(conn, {"experiment_assignments": "replaced", "user_sessions": "replaced"})
+    sessions.iloc[3:].to_sql("user_sessions", conn, index=False, if_exists="append")
+    refresh_quality_counts(conn, {"user_sessions": "appended"})
+    appended = read_quality_counts(conn).results()
+
+    refresh_quality_counts(conn, {"user_sessions": "replaced"})
+    pd.testing.assert_frame_equal(appended, read_quality_counts(conn).results())
+    checks = appended.set_index("check_name")
+    assert checks.loc["sessions_before_assignment", "value"] == 1
+    assert checks.loc["session_variant_mismatch", "value"] == 2
+    assert checks.loc["duplicate_assignments", "value"] == 1
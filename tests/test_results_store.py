@@ -0,0 +1,25 @@
+import sqlite3
+
+import pandas as pd
+
+from ab_testing.results_store import LATEST_RESULTS_VIEW, results_history, save_results
+
+
+def _run(p_value):
+    return pd.DataFrame([{"experiment_name": "exp", "control_size": 100, "treatment_size": 100, "p_value": p_value}])
+
+
+def test_runs_in_the_same_second_are_kept_apart():
+    conn = sqlite3.connect(":memory:")
+    first = save_results(conn, _run(0.5), [1])
+    second = save_results(conn, _run(0.01), [1])
+    assert second > first
+    assert len(results_history(conn, 1)) == 2
+    assert pd.read_sql_query(f"SELECT p_value FROM {LATEST_RESULTS_VIEW}", conn)["p_value"].tolist() == [0.01]
+
+
+def test_a_new_run_sorts_after_one_stamped_ahead_of_the_clock():
+    conn = sqlite3.connect(":memory:")
+    save_results(conn, _run(0.5), [1], run_at="2999-01-01T00:00:00+00:00")
+    assert save_results(conn, _run(0.01), [1]) == "2999-01-01T00:00:00.000001+00:00"
+    assert pd.read_sql_query(f"SELECT p_value FROM {LATEST_RESULTS_VIEW}", conn)["p_value"].tolist() == [0.01]
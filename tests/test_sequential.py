@@ -0,0 +1,83 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ab_testing.sequential import SequentialMonitor, group_sequential_boundaries, obrien_fleming_spending, refresh_sequential_stats
+
+
+def test_boundaries_match_published_lan_demets_obrien_fleming():
+    #Five equally spaced looks, two-sided alpha = 0.05
+    boundaries, spent = group_sequential_boundaries(np.arange(1, 6) / 5, alpha=0.05)
+    np.testing.assert_allclose(boundaries, [4.8769, 3.3569, 2.6803, 2.2898, 2.0310], atol=1e-3)
+    assert spent[-1] == pytest.approx(0.05)
+    np.testing.assert_allclose(spent, obrien_fleming_spending(np.arange(1, 6) / 5))
+
+
+@pytest.mark.parametrize("looks", [5, 20, 100])
+def test_null_type_one_error_stays_within_alpha(looks):
+    alpha = 0.05
+    fractions = np.arange(1, looks + 1) / looks
+    boundaries, _ = group_sequential_boundaries(fractions, alpha)
+    rng = np.random.default_rng(looks)
+    simulations = 200_000
+    rejected = 0
+    #z at each look of a no-effect experiment: a Brownian motion in information time, scaled to unit variance
+    for _ in range(4):
+        steps = rng.standard_normal((simulations // 4, looks)) * np.sqrt(np.diff(fractions, prepend=0.0))
+        z = np.cumsum(steps, axis=1) / np.sqrt(fractions)
+        rejected += (np.abs(z) >= boundaries).any(axis=1).sum()
+    error_rate = rejected / simulations
+    assert error_rate <= alpha + 3 * np.sqrt(alpha * (1 - alpha) / simulations)
+
+
+def _sessions(rng, experiments, users, first_user, date):
+    experiment_ids = np.repeat(np.arange(1, experiments + 1), users)
+    return pd.DataFrame({
+        "experiment_id": experiment_ids,
+        "variant": np.tile(np.repeat(["control", "treatment"], users // 2), experiments),
+        "user_id": np.tile(np.arange(first_user, first_user + users), experiments),
+        "session_date": date,
+        "converted": rng.random(len(experiment_ids)) < 0.1,
+    })
+
+
+def test_monitor_records_looks_only_when_information_grows():
+    rng = np.random.default_rng(0)
+    conn = sqlite3.connect(":memory:")
+    monitor = SequentialMonitor(conn)
+    monitor.update_sessions(_sessions(rng, 3, 200, 0, "2024-01-01"))
+    first = monitor.evaluate(planned_users_per_group=1000)
+    assert (first["looks"] == 1).all()
+    np.testing.assert_allclose(first["information_fraction"], 0.1)
+
+    #Same users again: no new information, so no new look and the same boundary
+    monitor.update_sessions(_sessions(rng, 3, 200, 0, "2024-01-01").assign(converted=False))
+    again = monitor.evaluate(planned_users_per_group=1000)
+    assert (again["looks"] == 1).all()
+    np.testing.assert_allclose(again["obf_boundary"], first["obf_boundary"])
+
+    monitor.update_sessions(_sessions(rng, 3, 1800, 200, "2024-01-02"))
+    final = monitor.evaluate(planned_users_per_group=1000)
+    assert (final["looks"] == 2).all()
+    assert (final["information_fraction"] == 1.0).all()
+    assert final["alpha_spent"].to_numpy() == pytest.approx(0.05)
+
+
+def test_refresh_from_user_sessions_counts_each_user_once():
+    rng = np.random.default_rng(1)
+    conn = sqlite3.connect(":memory:")
+    day_one = _sessions(rng, 2, 100, 0, "2024-01-01")
+    day_one.to_sql("user_sessions", conn, index=False)
+    refresh_sequential_stats(conn)
+    #A second session for every day-one user plus new users the next day
+    pd.concat([day_one, _sessions(rng, 2, 100, 100, "2024-01-02")]).to_sql("user_sessions", conn, index=False, if_exists="append")
+    refresh_sequential_stats(conn)
+    refresh_sequential_stats(conn)
+
+    stats = SequentialMonitor(conn).stats()
+    sessions = pd.read_sql_query("SELECT * FROM user_sessions", conn)
+    users = sessions.groupby(["experiment_id", "variant", "user_id"])["converted"].max().groupby(["experiment_id", "variant"]).agg(["size", "sum"])
+    assert stats["control_n"].tolist() == users.xs("control", level="variant")["size"].tolist()
+    assert stats["treatment_x"].tolist() == users.xs("treatment", level="variant")["sum"].tolist()